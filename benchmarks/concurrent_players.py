@@ -0,0 +1,128 @@
+"""
+Concurrent player benchmark for the multi-player session server (cyoa.session_server).
+
+Launches one shared backend and a SessionServer in front of it, then plays N simultaneous sessions
+over HTTP for each N in --players. Every turn is streamed, so the report has both time to first
+story token and full turn latency (p50/p95/p99) per player count, plus completed turns per second.
+The largest player count whose p95 turn latency stays within --slo is reported as the capacity of
+one backend.
+
+Usage:
+    python -m benchmarks.concurrent_players --players 1,4,16,32 --turns 3 --token-latency 0.002 --slo 5
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.turn_latency import USER_ACTIONS, USER_BACKGROUND, git_commit, make_orchestrator, parse_list, summarize
+from cyoa.request_scheduler import RequestScheduler
+from cyoa.session_server import SessionManager, SessionServer
+
+
+def play(url, player, turns):
+    """One player's session: introduction plus `turns` turns. Returns [(ttft, total), ...] per turn."""
+    with requests.Session() as http:
+        resp = http.post(f"{url}/sessions", json={"user_name": f"Player {player}", "user_background": USER_BACKGROUND}, timeout=60)
+        resp.raise_for_status()
+        session_id = resp.json()["session_id"]
+        samples = []
+        for turn in range(turns + 1):
+            body = {} if turn == 0 else {"input": USER_ACTIONS[(player + turn) % len(USER_ACTIONS)]}
+            start = time.perf_counter()
+            first = None
+            with http.post(f"{url}/sessions/{session_id}/turns", json=body, headers={"Accept": "text/event-stream"}, stream=True, timeout=600) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines(decode_unicode=True):
+                    if first is None and line.startswith("event: token"):
+                        first = time.perf_counter() - start
+                    elif line.startswith("event: error"):
+                        raise RuntimeError(f"Turn failed for player {player}")
+            total = time.perf_counter() - start
+            samples.append((first if first is not None else total, total))
+        http.delete(f"{url}/sessions/{session_id}", timeout=60)
+    return samples
+
+
+def run_level(url, players, turns):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=players) as pool:
+        results = list(pool.map(lambda player: play(url, player, turns), range(players)))
+    wall = time.perf_counter() - start
+    samples = [sample for result in results for sample in result]
+    return {
+        "players": players,
+        "wall": wall,
+        "turns_per_second": len(samples) / wall if wall else None,
+        "ttft": summarize([ttft for ttft, _ in samples]),
+        "turn": summarize([total for _, total in samples]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how many concurrent players one backend sustains")
+    parser.add_argument("--backend", choices=["stub", "vllm"], default="stub")
+    parser.add_argument("--model", default="stub-model", help="Model path (or stub model id)")
+    parser.add_argument("--port", type=int, help="Backend port (default: pick a free one)")
+    parser.add_argument("--gpu", type=int, default=None)
+    parser.add_argument("--players", type=parse_list(int), default=[1, 4, 16], help="Comma-separated concurrent player counts")
+    parser.add_argument("--turns", type=int, default=2, help="Turns per player after the introduction")
+    parser.add_argument("--cast-size", type=int, default=2, help="Bold characters per storyteller segment (stub)")
+    parser.add_argument("--story-tokens", type=int, default=120, help="Length of a storyteller segment (stub)")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Seconds per generated token (stub)")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="Seconds per uncached prompt token (stub)")
+    parser.add_argument("--character-concurrency", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=0, help="Schedule requests by role with this many in flight per backend (0 = no scheduler)")
+    parser.add_argument("--max-concurrent-turns", type=int, default=64)
+    parser.add_argument("--slo", type=float, default=5.0, help="p95 turn latency (seconds) a player count must stay within")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--server-log", help="Write backend server output to this file (default: discard)")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    options = parser.parse_args(argv)
+
+    scenario = {
+        "cast_size": options.cast_size, "story_tokens": options.story_tokens,
+        "token_latency": options.token_latency, "prefill_latency": options.prefill_latency,
+    }
+    scheduler = RequestScheduler(max_in_flight=options.max_in_flight) if options.max_in_flight else None
+    orchestrator = make_orchestrator(scenario, options, scheduler=scheduler)
+    manager = SessionManager(orchestrator, max_concurrent_turns=options.max_concurrent_turns)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    report = {"meta": {"commit": git_commit(), "backend": options.backend, "model": options.model, "scenario": scenario, "slo": options.slo, "max_in_flight": options.max_in_flight}, "results": []}
+    try:
+        orchestrator.start_storyteller_and_director(timeout=options.startup_timeout)
+        server = asyncio.run_coroutine_threadsafe(SessionServer(manager, port=0).start(), loop).result()
+        url = f"http://127.0.0.1:{server.port}"
+        for players in options.players:
+            result = run_level(url, players, options.turns)
+            if scheduler is not None:
+                result["scheduler"] = scheduler.stats()["classes"]
+            report["results"].append(result)
+            turn = result["turn"]
+            print(f"[Benchmark] players={players} turn p50={turn['p50']:.3f}s p95={turn['p95']:.3f}s ttft p50={result['ttft']['p50']:.3f}s {result['turns_per_second']:.2f} turns/s", file=sys.stderr)
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        manager.close()
+        orchestrator.stop_all()
+
+    within = [r["players"] for r in report["results"] if r["turn"]["p95"] is not None and r["turn"]["p95"] <= options.slo]
+    report["max_players_within_slo"] = max(within) if within else 0
+    print(f"[Benchmark] {report['max_players_within_slo']} concurrent players within p95 <= {options.slo}s", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
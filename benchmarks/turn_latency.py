@@ -0,0 +1,275 @@
+"""
+End-to-end turn latency benchmark for AgentOrchestrator.
+
+Runs whole story sessions (the same StorySession that interactive_story_loop drives) and, with
+--mode agents, run_story_agents, against a launched backend, sweeping cast size, story length,
+turn count and backend latency. Reports per-stage latency (storyteller, director, each character
+request, character fan-out, integration), total turn p50/p95/p99 and tokens in and out, as JSON
+that can be compared between commits.
+
+By default every scenario runs on the CPU-only stub backend (scripts/stub_openai_server.py), whose
+latency is controlled with --token-latency/--prefill-latency. --backend vllm benchmarks a real model.
+
+Usage:
+    python -m benchmarks.turn_latency --cast-sizes 1,4 --turns 3 --token-latency 0,0.005 --output before.json
+    python -m benchmarks.turn_latency ... --output after.json --compare before.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import BackendTopology
+from cyoa.backend_metrics import parse_prometheus_text, prefix_cache_stats
+from cyoa.story_session import StorySession
+
+STAGES = ["storyteller", "director", "character", "characters", "integration"]
+USER_NAME = "Astra Vey"
+USER_BACKGROUND = "A cartographer searching for a lost city."
+USER_ACTIONS = ["Astra asks who they are.", "Astra follows the path north.", "Astra studies the map.", "Astra waits for nightfall."]
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of values with linear interpolation; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values):
+    """count, mean, p50/p95/p99 and max of a list of latencies."""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def token_counters(orchestrator):
+    """Total prompt and generated tokens across the orchestrator's backends, from their /metrics."""
+    totals = {"prompt": 0.0, "completion": 0.0, "cached": 0.0}
+    for url in dict.fromkeys(orchestrator.character_pool.urls if orchestrator.shared_backend else [orchestrator.storyteller_url, orchestrator.director_url, orchestrator.character_url]):
+        resp = orchestrator.client.get(f"{url}/metrics", timeout=5)
+        if resp.status_code != 200:
+            continue
+        metrics = parse_prometheus_text(resp.text)
+        totals["prompt"] += metrics.get("vllm:prompt_tokens_total", 0.0)
+        totals["completion"] += metrics.get("vllm:generation_tokens_total", 0.0)
+        totals["cached"] += prefix_cache_stats(metrics).get("hits") or 0.0
+    return totals
+
+
+def time_characters(orchestrator):
+    """Record the latency of every character request; returns the list it appends to."""
+    latencies = []
+    lock = threading.Lock()
+    ask_character = orchestrator.ask_character
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return ask_character(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    orchestrator.ask_character = timed
+    return latencies
+
+
+def make_orchestrator(scenario, options, **kwargs):
+    backend_args = None
+    if options.backend == "stub":
+        backend_args = [
+            "--cast-size", str(scenario["cast_size"]), "--story-tokens", str(scenario["story_tokens"]),
+            "--token-latency", str(scenario["token_latency"]), "--prefill-latency", str(scenario["prefill_latency"]),
+        ]
+    orchestrator = AgentOrchestrator(
+        options.model, storyteller_port=options.port,
+        topology=BackendTopology(shared_backend=True, shared_gpus=None if options.gpu is None else [options.gpu], backend=options.backend, backend_args=backend_args),
+        character_concurrency=options.character_concurrency, **kwargs
+    )
+    orchestrator.log_agent = lambda *args, **kwargs: None
+    for pool in orchestrator.character_pool.pools:
+        pool.log_file = options.server_log
+    return orchestrator
+
+
+def run_sessions(orchestrator, scenario, repeats):
+    """Play `repeats` sessions of scenario['turns'] turns; returns per-stage and per-turn samples."""
+    samples = {stage: [] for stage in STAGES}
+    samples["intro"] = []
+    samples["turn"] = []
+    tokens = {"prompt": [], "completion": [], "cached": []}
+    samples["character"] = time_characters(orchestrator)
+    for _ in range(repeats):
+        session = StorySession(orchestrator, USER_NAME, USER_BACKGROUND)
+        try:
+            session.start()
+            samples["intro"].append(session.history[0]["timings"]["total"])
+            for turn in range(scenario["turns"]):
+                before = token_counters(orchestrator)
+                session.advance(USER_ACTIONS[turn % len(USER_ACTIONS)])
+                after = token_counters(orchestrator)
+                timings = session.history[-1]["timings"]
+                for stage in ["storyteller", "director", "characters", "integration"]:
+                    samples[stage].append(timings[stage])
+                samples["turn"].append(timings["total"])
+                for key in tokens:
+                    tokens[key].append(after[key] - before[key])
+        finally:
+            session.close()
+    return samples, tokens
+
+
+def run_agents(orchestrator, repeats):
+    """Time run_story_agents (one storyteller, director and character call) `repeats` times."""
+    storyteller_prompt = orchestrator.build_storyteller_prompt_with_user(USER_NAME, USER_BACKGROUND)
+    # run_story_agents takes its director prompt up front, so build it from a warm-up introduction
+    director_prompt = orchestrator.build_director_prompt(orchestrator.generate_story_segment(storyteller_prompt), USER_NAME)
+    samples = {"turn": []}
+    tokens = {"prompt": [], "completion": [], "cached": []}
+    for _ in range(repeats):
+        before = token_counters(orchestrator)
+        start = time.perf_counter()
+        orchestrator.run_story_agents(storyteller_prompt, director_prompt)
+        samples["turn"].append(time.perf_counter() - start)
+        after = token_counters(orchestrator)
+        for key in tokens:
+            tokens[key].append(after[key] - before[key])
+    return samples, tokens
+
+
+def run_scenario(scenario, options):
+    """Launch a backend for scenario, benchmark it and return the scenario's report."""
+    orchestrator = make_orchestrator(scenario, options)
+    try:
+        start = time.perf_counter()
+        orchestrator.start_storyteller_and_director(timeout=options.startup_timeout)
+        startup = time.perf_counter() - start
+        if options.mode == "agents":
+            samples, tokens = run_agents(orchestrator, options.repeats * max(1, scenario["turns"]))
+        else:
+            samples, tokens = run_sessions(orchestrator, scenario, options.repeats)
+    finally:
+        orchestrator.stop_all()
+    return {
+        "scenario": scenario,
+        "startup": startup,
+        "latency": {name: summarize(values) for name, values in samples.items()},
+        "tokens": {key: {"total": sum(values), "per_turn": sum(values) / len(values) if values else None} for key, values in tokens.items()},
+    }
+
+
+def scenarios(options):
+    """Cartesian product of the swept parameters."""
+    for cast_size, story_tokens, turns, token_latency in itertools.product(options.cast_sizes, options.story_tokens, options.turns, options.token_latency):
+        yield {
+            "cast_size": cast_size, "story_tokens": story_tokens, "turns": turns,
+            "token_latency": token_latency, "prefill_latency": options.prefill_latency,
+        }
+
+
+def scenario_key(scenario):
+    return json.dumps(scenario, sort_keys=True)
+
+
+def compare(baseline, current, threshold=0.1, metric="p50", min_delta=0.001):
+    """
+    Compare two reports scenario by scenario. Returns one row per (scenario, latency series) present in
+    both, with the relative change of `metric`; rows slower by more than threshold (and by at least
+    min_delta seconds, so sub-millisecond stages do not flap) are flagged.
+    """
+    previous = {scenario_key(r["scenario"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        before = previous.get(scenario_key(result["scenario"]))
+        if before is None:
+            continue
+        for name, stats in result["latency"].items():
+            old, new = (before["latency"].get(name) or {}).get(metric), stats.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append({"scenario": result["scenario"], "series": name, "before": old, "after": new, "change": change, "regression": change > threshold and new - old >= min_delta})
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_list(kind):
+    return lambda text: [kind(part) for part in text.split(",") if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end story turn latency")
+    parser.add_argument("--backend", choices=["stub", "vllm"], default="stub")
+    parser.add_argument("--model", default="stub-model", help="Model path (or stub model id)")
+    parser.add_argument("--port", type=int, help="Backend port (default: pick a free one)")
+    parser.add_argument("--gpu", type=int, default=None)
+    parser.add_argument("--mode", choices=["session", "agents"], default="session", help="Benchmark StorySession turns or run_story_agents")
+    parser.add_argument("--cast-sizes", type=parse_list(int), default=[1, 4], help="Comma-separated cast sizes (stub)")
+    parser.add_argument("--story-tokens", type=parse_list(int), default=[120], help="Comma-separated storyteller segment lengths (stub)")
+    parser.add_argument("--turns", type=parse_list(int), default=[3], help="Comma-separated turns per session")
+    parser.add_argument("--token-latency", type=parse_list(float), default=[0.0], help="Comma-separated seconds per generated token (stub)")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="Seconds per uncached prompt token (stub)")
+    parser.add_argument("--repeats", type=int, default=3, help="Sessions per scenario")
+    parser.add_argument("--character-concurrency", type=int, default=4)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--server-log", help="Write backend server output to this file (default: discard)")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative p50 slowdown reported as a regression")
+    options = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "backend": options.backend, "model": options.model, "mode": options.mode,
+        },
+        "results": [],
+    }
+    for scenario in scenarios(options):
+        result = run_scenario(scenario, options)
+        report["results"].append(result)
+        turn = result["latency"]["turn"]
+        print(f"[Benchmark] {scenario_key(scenario)} turn p50={turn['p50']:.3f}s p95={turn['p95']:.3f}s p99={turn['p99']:.3f}s", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if options.compare:
+        with open(options.compare) as f:
+            rows = compare(json.load(f), report, threshold=options.threshold)
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"[Compare] {flag:10} {row['series']:12} {row['before']:.4f}s -> {row['after']:.4f}s ({row['change']:+.1%}) {scenario_key(row['scenario'])}", file=sys.stderr)
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
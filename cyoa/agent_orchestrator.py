@@ -1,8 +1,16 @@
+# Prompt layout: every prompt starts with static text shared by all sessions, then per-session text
+# (user character, character persona), then per-turn content last, so backends with prefix caching
+# can reuse the KV cache of everything before the part that changed.
 STORYTELLER_SYSTEM_PROMPT = (
     "You are a creative storyteller. Write a brief story introduction with up to 4 major characters. You MUST introduce at least one major character in bold (using **like this**), e.g., **Elder Marrow**. Only major characters should be bolded. Your response must be a story with at least one bolded major character."
 )
 DIRECTOR_SYSTEM_PROMPT = (
-    "You are a story director. Only spawn a character agent for major characters introduced in bold (using **like this**) in the story. If there is a new major character, describe their role, personality, and provide a system prompt for the character agent. If there are multiple major characters, output a JSON array, with one object per character, in the following format: [{\"spawn\": true, \"character_name\": string, \"character_prompt\": string}, ...]. If no character should be spawned, output an empty array: []. Respond ONLY with valid JSON, with double quotes, and do not include any other text, explanation, or formatting. Do NOT use the 'reasoning_content' field. Your response MUST be valid JSON in the 'content' field only. Example: [{\"spawn\": true, \"character_name\": \"Elder Marrow\", \"character_prompt\": \"You are Elder Marrow, a wise old shopkeeper with a mysterious past. Respond in character.\"}]"
+    "You are a story director. Only spawn a character agent for major characters introduced in bold (using **like this**) in the story. Never spawn an agent for the main character, who is the user. If there is a new major character, describe their role, personality, and provide a system prompt for the character agent. If there are multiple major characters, output a JSON array, with one object per character, in the following format: [{\"spawn\": true, \"character_name\": string, \"character_prompt\": string}, ...]. If no character should be spawned, output an empty array: []. Respond ONLY with valid JSON, with double quotes, and do not include any other text, explanation, or formatting. Do NOT use the 'reasoning_content' field. Your response MUST be valid JSON in the 'content' field only. Example: [{\"spawn\": true, \"character_name\": \"Elder Marrow\", \"character_prompt\": \"You are Elder Marrow, a wise old shopkeeper with a mysterious past. Respond in character.\"}]"
+)
+CHARACTER_SYSTEM_PROMPT = (
+    "Respond in character to the following events in the world. "
+    "Your response will be sent to the director, who will integrate it into the ongoing story. "
+    "Only respond to what you can see or hear. If you are not present in the scene, respond with an empty string."
 )
 def get_user_character_info():
     """Prompt the user for character name and background info."""
@@ -12,72 +20,101 @@ def get_user_character_info():
     print("Enter any background info for your character (optional):", end=' ', flush=True)
     background = sys.stdin.readline().strip()
     return name, background
-import time
+import logging
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
 import requests
-from scripts.spawn_vllm_server import VLLMServerManager
+from cyoa.llm_client import StreamStats, build_chat_payload, chat_completions_url, get_default_client, message_content
+from scripts.spawn_and_connect import StartupCoordinator
+from scripts.resource_allocator import Allocation
+from scripts.spawn_vllm_server import VLLMServerManager, wait_for_ready
+from cyoa.backend_metrics import parse_prometheus_text, prefix_cache_stats
+from cyoa.backend_pool import BackendRouter, BackendTopology, CharacterBackendPool, ReplicaSet
+from cyoa.character_dispatch import CharacterDispatcher
+from cyoa.completion_cache import CachingClient, is_deterministic
+from cyoa.director_output import IncrementalEntryParser, director_response_format, director_token_budget, parse_director_reply, rejects_response_format
+from cyoa.event_log import AGENT_COLORS, agent_event
+from cyoa.request_scheduler import SchedulingClient, request_class
+from cyoa.retry_policy import BackendUnavailable, Retrier, endpoint_key
+from cyoa.speculation import CHOICES_INSTRUCTION
+from cyoa.story_segmenter import bold_names
+from cyoa.story_session import StorySession
+from cyoa.tracing import Tracer, record_response, record_usage
+
+logger = logging.getLogger("cyoa.orchestrator")
+
+
+class _OpenStream:
+    """A stream whose request was accepted (its first delta already read), as returned to Retrier.call."""
+
+    status_code = 200
+    headers = {}
+
+    def __init__(self, stream, head):
+        self.stream = stream
+        self.head = head
+
 
 class AgentOrchestrator:
-    # ANSI color codes for log coloring
-    AGENT_COLORS = {
-        'Storyteller': '\033[95m',  # Magenta
-        'Director': '\033[94m',     # Blue
-        'Character': '\033[92m',    # Green
-        'ENDC': '\033[0m'
-    }
+    AGENT_COLORS = AGENT_COLORS
 
     def set_logger(self, logger):
         self.logger = logger
 
     def log_agent(self, agent_type, message, prompt_or_response, agent_name=None):
-        color = self.AGENT_COLORS.get(agent_type, '')
-        endc = self.AGENT_COLORS['ENDC']
-        name_str = f" ({agent_name})" if agent_name else ""
-        log_msg = f"{color}[{agent_type}{name_str}] {message}:{endc}\n{prompt_or_response}\n"
-        if hasattr(self, 'logger') and self.logger:
-            self.logger.debug(log_msg)
-        else:
-            print(log_msg)
+        # Formatting is deferred to the logger's handlers (see cyoa.event_log) and skipped below DEBUG
+        agent_event(getattr(self, 'logger', None) or logger, agent_type, message, prompt_or_response, agent_name=agent_name)
     def build_character_prompt(self, character_name, character_system_prompt, visible_story_segment):
         return [
-            {"role": "system", "content": (
-                f"You are {character_name}. Respond in character to the following events in the world. "
-                "Your response will be sent to the director, who will integrate it into the ongoing story. "
-                "Only respond to what you can see or hear. If you are not present in the scene, respond with an empty string."
-            )},
-            {"role": "system", "content": character_system_prompt},
+            {"role": "system", "content": CHARACTER_SYSTEM_PROMPT},
+            {"role": "system", "content": f"You are {character_name}.\n{character_system_prompt}"},
             {"role": "user", "content": visible_story_segment}
         ]
 
-    def director_distribute_and_collect(self, story, director_data, user_name):
+    def ask_character(self, character_name, character_system_prompt, visible_story_segment, queued_at=None):
+        """
+        Send one character its prompt and return its reply ("" on a non-200 response).
+        queued_at: perf_counter() time the call was submitted, recorded as the span's queue_time.
+        """
+        character_prompt = self.build_character_prompt(character_name, character_system_prompt, visible_story_segment)
+        self.log_agent('Character', 'Prompt', character_prompt, agent_name=character_name)
+        with self.tracer.span("character", queued_at=queued_at, character=character_name), request_class("character"):
+            try:
+                with self.backend('character') as character_url:
+                    resp_char = self.chat_with_retries(character_url, character_prompt, 256)
+            except BackendUnavailable as e:
+                # A missing character reply should not sink the whole turn
+                (getattr(self, 'logger', None) or logger).warning("Character %s skipped: %s", character_name, e)
+                return ""
+        if resp_char.status_code == 200:
+            char_reply = message_content(resp_char)
+        else:
+            char_reply = ""
+        self.log_agent('Character', 'Response', char_reply, agent_name=character_name)
+        return char_reply
+
+    def director_distribute_and_collect(self, story, director_data, user_name, max_workers=None):
         """
         For each character agent (not the user), send the relevant story segment and collect their responses.
+        Each character only sees the segments it appears in (see StorySegmenter); characters absent from
+        the scene get an empty response without a request.
+        Requests are fanned out concurrently (up to max_workers, default self.character_concurrency) so the
+        backend can batch them; the result keeps the director's ordering.
         Returns: dict mapping character_name -> response
         """
-        responses = {}
+        names = []
         for char in director_data:
-            if not char.get("spawn"):
-                continue
-            character_name = char.get("character_name")
-            if character_name == user_name:
-                continue  # Never spawn agent for user
-            character_system_prompt = char.get("character_prompt", "You are a character.")
-            # For now, send the whole story to each agent; in a real system, parse for relevant segments
-            character_prompt = self.build_character_prompt(character_name, character_system_prompt, story)
-            self.start_character_manager()  # (Re)start for each agent; in a real system, pool/reuse
-            resp_char = self.post_with_retries(
-                f"{self.character_url}/v1/chat/completions",
-                {
-                    "model": self.model_path,
-                    "messages": character_prompt,
-                    "max_tokens": 256
-                }
-            )
-            if resp_char.status_code == 200:
-                char_reply = resp_char.json()["choices"][0]["message"]["content"]
-            else:
-                char_reply = ""
-            responses[character_name] = char_reply
-        return responses
+            name = char.get("character_name")
+            if char.get("spawn") and name != user_name and name not in names:  # Never spawn agent for user
+                names.append(name)
+        with self.tracer.span("characters", characters=len(names)):
+            dispatcher = CharacterDispatcher(self, story, user_name, max_workers=max_workers)
+            try:
+                for char in director_data:
+                    dispatcher.submit(char)
+                return dispatcher.results(names)
+            finally:
+                dispatcher.close()
 
     def director_integrate_character_responses(self, story, char_responses):
         """
@@ -89,243 +126,526 @@ class AgentOrchestrator:
                 story += f"\n[{char}]: {reply.strip()}"
         return story
 
-    def interactive_story_loop(self, user_name, user_background, user_inputs, max_turns=5):
+    def generate_story_segment(self, storyteller_prompt, on_token=None, max_tokens=512, timings=None):
+        """
+        Run the storyteller. With on_token, the completion is streamed and on_token(delta) is called
+        as prose arrives; the full text is still returned for the director and character stages.
+        A streamed call's TTFT and inter-token latency are set on the storyteller span and, if a timings
+        dict is given (a StorySession turn's), stored in it.
+        """
+        with self.tracer.span("storyteller", streamed=on_token is not None), request_class("storyteller"), self.backend('storyteller') as storyteller_url:
+            if on_token is None:
+                resp = self.chat_with_retries(storyteller_url, storyteller_prompt, max_tokens)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"Storyteller agent failed: {resp.status_code}")
+                return message_content(resp)
+            return self._stream_story_segment(storyteller_url, storyteller_prompt, on_token, max_tokens, timings)
+
+    def speculate_story_segment(self, storyteller_prompt, cancelled, max_tokens=512):
+        """
+        Stream a storyteller continuation in the background, stopping as soon as cancelled (a
+        threading.Event) is set; closing the stream aborts the request on the backend.
+        Returns the text, or None if cancelled.
+        """
+        parts = []
+        with self.tracer.span("speculation") as span, request_class("speculation"), self.backend('storyteller') as storyteller_url:
+            stream = self.chat_stream(storyteller_url, storyteller_prompt, max_tokens, on_usage=lambda usage: record_usage(span, usage))
+            try:
+                for delta in stream:
+                    if cancelled.is_set():
+                        span.set(cancelled=True)
+                        return None
+                    parts.append(delta)
+            finally:
+                stream.close()
+        return None if cancelled.is_set() else "".join(parts)
+
+    def _stream_story_segment(self, storyteller_url, storyteller_prompt, on_token, max_tokens, timings=None):
+        stats = StreamStats()
+        parts = []
+        try:
+            for delta in self.stream_with_retries(storyteller_url, storyteller_prompt, max_tokens):
+                stats.record_chunk()
+                parts.append(delta)
+                on_token(delta)
+        except requests.exceptions.HTTPError as e:
+            raise RuntimeError(f"Storyteller agent failed: {e.response.status_code}")
+        stats.finish()
+        summary = stats.as_dict()
+        latencies = {key: summary[key] for key in ("ttft", "mean_inter_token_latency", "max_inter_token_latency")}
+        self.tracer.annotate(status_code=200, completion_chunks=summary["chunks"], **latencies)
+        if timings is not None:
+            timings.update(latencies)
+        return "".join(parts)
+
+    def director_request(self, director_prompt, expected_characters):
+        """
+        POST a director prompt with a max_tokens budget sized for expected_characters and, when enabled,
+        a json_schema response_format. A 400 is asked again once without response_format; structured
+        output stays off for later turns only if the error said the backend cannot do it.
+        """
+        max_tokens = director_token_budget(expected_characters)
+        with request_class("director"), self.backend('director') as director_url:
+            if self.structured_director:
+                resp = self.chat_with_retries(director_url, director_prompt, max_tokens, response_format=director_response_format(expected_characters))
+                if resp.status_code != 400:
+                    return resp
+                self._structured_request_failed(resp)
+            return self.chat_with_retries(director_url, director_prompt, max_tokens)
+
+    def _structured_request_failed(self, resp):
+        """A structured director request got a 400: turn structured output off if the backend does not support it."""
+        if rejects_response_format(resp):
+            self.structured_director = False
+            (getattr(self, 'logger', None) or logger).warning("Director backend rejected response_format; falling back to prompt-only JSON")
+        else:
+            (getattr(self, 'logger', None) or logger).warning("Director request failed (400); retrying once without response_format")
+
+    def chat_stream(self, base_url, messages, max_tokens, timeout=None, on_usage=None, **params):
+        """Stream a chat completion for self.model_path from base_url, yielding content deltas; on_usage gets the token counts."""
+        return self.client.stream(chat_completions_url(base_url), self.chat_payload(messages, max_tokens, **params), timeout=timeout, on_usage=on_usage)
+
+    def chat_payload(self, messages, max_tokens, **params):
+        """Chat completion body for self.model_path with self.sampling (params take precedence)."""
+        return build_chat_payload(self.model_path, messages, max_tokens, **dict(self.sampling, **params))
+
+    def _stream_director(self, director_prompt, expected_characters, on_entry):
+        """
+        Stream the director reply, calling on_entry(entry) as each array element closes. Returns the reply,
+        or None if the stream failed before producing anything (the caller then falls back to a plain request).
+        """
+        max_tokens = director_token_budget(expected_characters)
+        parser = IncrementalEntryParser()
+        structured = self.structured_director
+        with request_class("director"), self.backend('director') as director_url:
+            while True:
+                params = {"response_format": director_response_format(expected_characters)} if structured else {}
+                try:
+                    for delta in self.stream_with_retries(director_url, director_prompt, max_tokens, **params):
+                        for entry in parser.feed(delta):
+                            on_entry(entry)
+                    return parser.reply
+                except requests.exceptions.HTTPError as e:
+                    if e.response.status_code == 400 and structured:
+                        self._structured_request_failed(e.response)
+                        structured = False
+                        continue
+                    raise RuntimeError(f"Director agent failed: {e.response.status_code}")
+                except BackendUnavailable:
+                    return None  # never connected; the plain request reports an open circuit at once
+                except requests.exceptions.ConnectionError:
+                    if parser.reply:
+                        raise
+                    return None
+
+    def run_director(self, story, user_name, new_names=None, on_entry=None):
+        """
+        Ask the director which character agents to spawn (excluding user). Returns (reply, director_data).
+        new_names: if given, the director only considers these not-yet-seen characters.
+        on_entry: if given, the reply is streamed and on_entry(entry) is called for each entry as soon as
+        it is complete, so its character can start before the director finishes.
+        A malformed reply yields whatever entries parse_director_reply can recover (possibly []).
+        """
+        director_prompt = self.build_director_prompt(story, user_name, new_names=new_names)
+        self.log_agent('Director', 'Prompt', director_prompt)
+        expected = len(new_names) if new_names else len([name for name in bold_names(story) if name != user_name])
+        with self.tracer.span("director", new_names=len(new_names) if new_names else None, streamed=on_entry is not None):
+            director_reply = self._stream_director(director_prompt, expected, on_entry) if on_entry is not None else None
+            if director_reply is None:
+                resp_dir = self.director_request(director_prompt, expected)
+                if resp_dir.status_code != 200:
+                    raise RuntimeError(f"Director agent failed: {resp_dir.status_code}")
+                director_reply = message_content(resp_dir)
+        self.log_agent('Director', 'Response', director_reply)
+        director_data = parse_director_reply(director_reply)
+        if on_entry is not None:
+            for entry in director_data:
+                on_entry(entry)  # entries the incremental parser missed; repeats are the caller's to ignore
+        return director_reply, director_data
+
+    def summarize_story(self, previous_summary, text, max_tokens=256):
+        """Fold text into previous_summary; used by StoryContext off the critical path of a turn."""
+        prompt = [
+            {"role": "system", "content": "You summarize stories. Keep every major character's name in bold (using **like this**), their goals, and unresolved plot threads. Respond with the summary only."},
+            {"role": "user", "content": f"Summary so far: {previous_summary or 'None.'}\n\nNew events:\n{text}"}
+        ]
+        try:
+            with self.tracer.span("summarizer"), request_class("summarizer"), self.backend('storyteller') as storyteller_url:
+                resp = self.chat_with_retries(storyteller_url, prompt, max_tokens)
+        except BackendUnavailable:
+            return previous_summary  # e.g. shed by the scheduler; the next turn tries again
+        if resp.status_code != 200:
+            return previous_summary
+        return message_content(resp) or previous_summary
+
+    def interactive_story_loop(self, user_name, user_background, user_inputs, max_turns=5, on_token=None):
         """
         Main loop: storyteller -> director -> character agents -> director integrates -> user.
-        user_inputs: list of user input strings for each turn.
+        user_inputs: list of user input strings for each turn. The introduction is generated first,
+        then each input advances the story by one turn (see StorySession).
+        on_token: optional callback; when given, storyteller prose is streamed to it as it is generated.
         """
-        story = None
-        # If no user input, generate and return the story introduction only
-        if not user_inputs:
-            storyteller_prompt = self.build_storyteller_prompt_with_user(user_name, user_background)
-            self.log_agent('Storyteller', 'Prompt', storyteller_prompt)
-            resp = self.post_with_retries(
-                f"{self.storyteller_url}/v1/chat/completions",
-                {
-                    "model": self.model_path,
-                    "messages": storyteller_prompt,
-                    "max_tokens": 512
-                }
-            )
-            if resp.status_code != 200:
-                raise RuntimeError(f"Storyteller agent failed: {resp.status_code}")
-            story = resp.json()["choices"][0]["message"].get("content")
-            self.log_agent('Storyteller', 'Response', story)
-            return story
-
-        for turn, user_input in enumerate(user_inputs[:max_turns]):
-            # 1. Storyteller generates next story segment
-            if turn == 0:
-                storyteller_prompt = self.build_storyteller_prompt_with_user(user_name, user_background)
-                self.log_agent('Storyteller', 'Prompt', storyteller_prompt)
-            else:
-                storyteller_prompt = [
-                    {"role": "system", "content": f"Continue the story. The user says: {user_input}"},
-                    {"role": "system", "content": STORYTELLER_SYSTEM_PROMPT},
-                    {"role": "user", "content": story}
-                ]
-                self.log_agent('Storyteller', 'Prompt', storyteller_prompt)
-            resp = self.post_with_retries(
-                f"{self.storyteller_url}/v1/chat/completions",
-                {
-                    "model": self.model_path,
-                    "messages": storyteller_prompt,
-                    "max_tokens": 512
-                }
-            )
-            if resp.status_code != 200:
-                raise RuntimeError(f"Storyteller agent failed: {resp.status_code}")
-            story = resp.json()["choices"][0]["message"].get("content")
-            self.log_agent('Storyteller', 'Response', story)
-
-            # 2. Director decides which character agents to spawn (excluding user)
-            director_prompt = self.build_director_prompt(story, user_name)
-            self.log_agent('Director', 'Prompt', director_prompt)
-            resp_dir = self.post_with_retries(
-                f"{self.director_url}/v1/chat/completions",
-                {
-                    "model": self.model_path,
-                    "messages": director_prompt,
-                    "max_tokens": 2048
-                }
-            )
-            if resp_dir.status_code != 200:
-                raise RuntimeError(f"Director agent failed: {resp_dir.status_code}")
-            import json
-            director_reply = resp_dir.json()["choices"][0]["message"].get("content")
-            self.log_agent('Director', 'Response', director_reply)
-            director_data = json.loads(director_reply)
-
-            # 3. Director distributes story to character agents and collects responses
-            char_responses = {}
-            for char in director_data:
-                if not char.get("spawn"):
-                    continue
-                character_name = char.get("character_name")
-                if character_name == user_name:
-                    continue  # Never spawn agent for user
-                character_system_prompt = char.get("character_prompt", "You are a character.")
-                character_prompt = self.build_character_prompt(character_name, character_system_prompt, story)
-                self.log_agent('Character', 'Prompt', character_prompt, agent_name=character_name)
-                self.start_character_manager()
-                resp_char = self.post_with_retries(
-                    f"{self.character_url}/v1/chat/completions",
-                    {
-                        "model": self.model_path,
-                        "messages": character_prompt,
-                        "max_tokens": 256
-                    }
-                )
-                if resp_char.status_code == 200:
-                    char_reply = resp_char.json()["choices"][0]["message"]["content"]
-                else:
-                    char_reply = ""
-                self.log_agent('Character', 'Response', char_reply, agent_name=character_name)
-                char_responses[character_name] = char_reply
-
-            # 4. Director integrates character responses into the story
-            story = self.director_integrate_character_responses(story, char_responses)
-
-            # 5. Present updated story to user (in a real app, yield/return here)
-                # Only return story; main_app.py handles user-facing output
-        return story
-    def build_storyteller_prompt_with_user(self, user_name, user_background):
-        explanation = (
+        session = StorySession(self, user_name, user_background)
+        session.start(on_token=on_token)
+        for user_input in user_inputs[:max_turns]:
+            session.advance(user_input, on_token=on_token)
+        # Only return story; main_app.py handles user-facing output
+        return session.story
+
+    def build_user_character_prompt(self, user_name, user_background):
+        return (
             f"The story should primarily be about the user character: **{user_name}**. "
             "Use the following background information to inform the story. "
             "Make sure to introduce this character in bold (using **like this**), and center the story around them. "
             "Background: " + (user_background if user_background else "None provided.")
         )
+
+    def storyteller_system_prompt(self):
+        # The choices instruction is fixed per orchestrator, so the prompt prefix stays cacheable
+        if self.story_choices:
+            return STORYTELLER_SYSTEM_PROMPT + CHOICES_INSTRUCTION.format(n=self.story_choices)
+        return STORYTELLER_SYSTEM_PROMPT
+
+    def build_storyteller_prompt_with_user(self, user_name, user_background):
         return [
-            {"role": "system", "content": explanation},
-            {"role": "system", "content": STORYTELLER_SYSTEM_PROMPT},
+            {"role": "system", "content": self.storyteller_system_prompt()},
+            {"role": "system", "content": self.build_user_character_prompt(user_name, user_background)},
             {"role": "user", "content": "Begin the story. Make sure to introduce at least one major character in bold (using **like this**)."}
         ]
 
-    def build_director_prompt(self, story, user_name):
+    def build_storyteller_continuation_prompt(self, story, user_input, user_name=None, user_background=None):
+        # Same static/session prefix as the intro prompt; the story (which only grows between
+        # summaries) precedes the per-turn user action
+        prompt = [{"role": "system", "content": self.storyteller_system_prompt()}]
+        if user_name:
+            prompt.append({"role": "system", "content": self.build_user_character_prompt(user_name, user_background)})
+        prompt.append({"role": "user", "content": f"Story so far:\n{story}\n\nContinue the story. The user says: {user_input}"})
+        return prompt
+
+    def build_director_prompt(self, story, user_name, new_names=None):
+        request = f"Given the following story, spawn a character agent if appropriate (but never for {user_name}). Only output valid JSON in your response. Do not provide any explanation. Story: {story}"
+        if new_names:
+            request += f"\nOnly consider these new characters: {', '.join(new_names)}."
         return [
-            {"role": "system", "content": (
-                f"You are a story director. The main character is {user_name}. Do NOT spawn an agent for this character, but treat them as the user. "
-                "Only spawn a character agent for other major characters introduced in bold (using **like this**) in the story. "
-                "If there is a new major character (not the user), describe their role, personality, and provide a system prompt for the character agent. "
-                "If there are multiple major characters, output a JSON array, with one object per character, in the following format: [{\"spawn\": true, \"character_name\": string, \"character_prompt\": string}, ...]. "
-                "If no character should be spawned, output an empty array: []. Respond ONLY with valid JSON, with double quotes, and do not include any other text, explanation, or formatting. "
-                "Do NOT use the 'reasoning_content' field. Your response MUST be valid JSON in the 'content' field only. "
-                "Example: [{\"spawn\": true, \"character_name\": \"Elder Marrow\", \"character_prompt\": \"You are Elder Marrow, a wise old shopkeeper with a mysterious past. Respond in character.\"}]"
-            )},
-            {"role": "user", "content": f"Given the following story, spawn a character agent if appropriate (but never for {user_name}). Only output valid JSON in your response. Do not provide any explanation. Story: {story}"}
+            {"role": "system", "content": DIRECTOR_SYSTEM_PROMPT},
+            {"role": "system", "content": f"The main character is {user_name}. Do NOT spawn an agent for this character, but treat them as the user."},
+            {"role": "user", "content": request}
         ]
-    def __init__(self, model_path, storyteller_port=8999, director_port=9000, character_port=9001, storyteller_gpu=0, director_gpu=1, character_gpu=2):
+
+    def __init__(self, model_path, *, storyteller_port=None, director_port=None, character_port=None, storyteller_gpu=None, director_gpu=None, character_gpu=None, topology=None, character_concurrency=4, client=None, context_budgets=None, enable_prefix_caching=True, tracer=None, retrier=None, turn_deadline=None, structured_director=True, stream_director=True, story_choices=0, speculative_branches=0, completion_cache=None, scheduler=None, sampling=None):
+        """
+        topology: cyoa.backend_pool.BackendTopology saying which servers to run (one per role by default,
+        or shared replicas), on which backend, and where ports and GPUs come from.
+        Ports left as None are picked free by the topology's allocator when the orchestrator is created
+        (with a shared backend, replicas take consecutive ports from storyteller_port if given); GPUs
+        left as None are taken from its device inventory when the servers launch, along with their
+        gpu_memory_utilization share.
+        tracer: cyoa.tracing.Tracer that receives a span per turn and per agent call.
+        retrier: cyoa.retry_policy.Retrier (backoff policy and per-backend circuit breakers) for every request.
+        turn_deadline: seconds a StorySession turn may spend retrying before giving up (None = unbounded).
+        structured_director: constrain director replies with a json_schema response_format.
+        stream_director: stream director replies in StorySession turns and start each character as soon as
+        its entry is complete.
+        story_choices: ask the storyteller to end each segment with this many numbered choices.
+        speculative_branches: pre-generate the continuation of up to this many listed choices while the
+        player decides (see cyoa.speculation); 0 disables speculation.
+        completion_cache: cyoa.completion_cache.CompletionCache that answers repeated deterministic chat
+        completions (or every completion, with cache_all) without a backend request.
+        sampling: parameters added to every chat completion, e.g. {"temperature": 0} or {"seed": 7};
+        without either, only a cache_all completion_cache ever stores anything.
+        scheduler: cyoa.request_scheduler.RequestScheduler that orders requests to each backend by role
+        (storyteller first, speculation and summaries last) and caps how many run at once.
+        """
         self.model_path = model_path
-        self.storyteller_port = storyteller_port
-        self.director_port = director_port
-        self.character_port = character_port
+        self.topology = topology = topology or BackendTopology()
+        self.shared_backend = shared_backend = topology.shared_backend
+        self.context_budgets = context_budgets
+        self.client = client or get_default_client()
+        self.scheduler = scheduler
+        if scheduler is not None:
+            # Cache hits (below) never take a scheduler slot
+            self.client = SchedulingClient(self.client, scheduler, on_wait=self._record_scheduler_wait)
+        self.sampling = dict(sampling or {})
+        self.completion_cache = completion_cache
+        if completion_cache is not None:
+            self.client = CachingClient(self.client, completion_cache)
+            if not completion_cache.cache_all and not is_deterministic(self.sampling):
+                logger.warning("Completion cache will stay empty: requests are sampled (set temperature 0 or a seed, or cache_all)")
+        self.tracer = tracer or Tracer()
+        self.retrier = retrier or Retrier()
+        self.turn_deadline = turn_deadline
+        self.structured_director = structured_director
+        self.stream_director = stream_director
+        self.story_choices = story_choices
+        self.speculative_branches = speculative_branches
+        self.character_concurrency = character_concurrency
+        self.startup = None
+        self.allocator = topology.allocator
+        self.server_options = topology.server_options
+        self.allocations = []  # Allocations from self.allocator, released by stop_all()
+        self._unplaced = []  # servers whose GPU is picked from the inventory at launch
+        self.storyteller_port = self._port(storyteller_port)
+        # A shared backend serves every role from the storyteller's port
+        self.director_port = director_port if shared_backend else self._port(director_port)
+        character_autoscale = topology.character_autoscale
+        self.character_port = character_port if shared_backend or character_autoscale is not None else self._port(character_port)
         self.storyteller_gpu = storyteller_gpu
         self.director_gpu = director_gpu
         self.character_gpu = character_gpu
         self.storyteller_url = f"http://127.0.0.1:{self.storyteller_port}"
         self.director_url = f"http://127.0.0.1:{self.director_port}"
         self.character_url = f"http://127.0.0.1:{self.character_port}"
-        self.storyteller_manager = VLLMServerManager(self.model_path, self.storyteller_port, gpu=self.storyteller_gpu, log_file="storyteller_server.log")
-        self.director_manager = VLLMServerManager(self.model_path, self.director_port, gpu=self.director_gpu, log_file="director_server.log")
-        self.character_manager = None
+        manager_kwargs = dict(self.server_options, enable_prefix_caching=enable_prefix_caching, backend=topology.backend, backend_args=topology.backend_args)
+        if shared_backend:
+            shared_gpus, shared_replicas = topology.shared_gpus, topology.shared_replicas
+            gpus = list(shared_gpus) if shared_gpus is not None else [storyteller_gpu] * shared_replicas
+            ports = [self.storyteller_port] + [storyteller_port + i if storyteller_port is not None else self._port(None) for i in range(1, shared_replicas)]
+            replicas = [
+                CharacterBackendPool(self.model_path, ports[i], gpu=gpus[i % len(gpus)], log_file=f"shared_server_{i}.log", client=self.client, manager_kwargs=dict(manager_kwargs))
+                for i in range(shared_replicas)
+            ]
+            if shared_gpus is None and storyteller_gpu is None:
+                self._unplaced = list(replicas)
+            # One pool (router) serves every role; role URLs all point at the first replica
+            self.character_pool = BackendRouter(replicas)
+            self.storyteller_url = self.director_url = self.character_url = self.character_pool.url
+            self.storyteller_manager = self.director_manager = None
+        else:
+            self.storyteller_manager = VLLMServerManager(self.model_path, self.storyteller_port, gpu=self.storyteller_gpu, log_file="storyteller_server.log", **manager_kwargs)
+            self.director_manager = VLLMServerManager(self.model_path, self.director_port, gpu=self.director_gpu, log_file="director_server.log", **manager_kwargs)
+            servers = [self.storyteller_manager, self.director_manager]
+            if character_autoscale is not None:
+                # The replica set picks ports and devices for its replicas itself, as they launch
+                self.character_pool = ReplicaSet(self.model_path, allocator=self.allocator, client=self.client, manager_kwargs=dict(manager_kwargs), **character_autoscale)
+                self.character_url = self.character_pool.url
+            else:
+                self.character_pool = CharacterBackendPool(self.model_path, self.character_port, gpu=self.character_gpu, log_file="character_server.log", client=self.client, manager_kwargs=dict(manager_kwargs))
+                servers.append(self.character_pool)
+            self._unplaced = [server for server in servers if server.gpu is None]
+        if topology.backend == "stub":
+            self._unplaced = []  # the stub runs on CPU
+
+    def _port(self, port):
+        """port as given, or a free one from the allocator."""
+        if port is not None:
+            return port
+        allocation = Allocation(self.allocator.allocate_port())
+        self.allocations.append(allocation)
+        return allocation.port
+
+    def place_servers(self):
+        """Give every server still without a GPU one from the allocator's inventory (idempotent)."""
+        while self._unplaced:
+            server = self._unplaced.pop(0)
+            server.gpu = self.allocator.allocate_device()
+            self.allocations.append(Allocation(None, server.gpu))
+            fraction = self.allocator.memory_fraction(server.gpu)
+            if fraction is None or "gpu_memory_utilization" in self.server_options:
+                continue
+            if isinstance(server, CharacterBackendPool):
+                server.manager_kwargs["gpu_memory_utilization"] = fraction
+            else:
+                server.gpu_memory_utilization = fraction
+
+    def _record_scheduler_wait(self, seconds):
+        span = self.tracer.current()
+        if span is not None:
+            span.add("scheduler_wait", seconds)
+
+    @contextmanager
+    def backend(self, role):
+        """Yield the base URL that serves role ('storyteller', 'director' or 'character') for one request."""
+        if self.shared_backend or role == 'character':
+            with self.character_pool.acquire() as url:
+                yield url
+        else:
+            yield self.storyteller_url if role == 'storyteller' else self.director_url
+
+    @property
+    def character_manager(self):
+        return self.character_pool.manager
 
     def wait_for_server_ready(self, url, timeout=60):
-        import requests
-        start = time.time()
-        while time.time() - start < timeout:
+        # Backoff probing; RuntimeError if the server does not come up in time
+        return wait_for_ready(url, timeout=timeout, get=self.client.get)
+
+    def await_startup(self, url, timeout=None):
+        """
+        For a refused connection: if url is a server launched by start_storyteller_and_director that has
+        not come up yet, block on its readiness check (at most timeout seconds) and return True. False
+        for any other server, so the failure is retried as usual. BackendUnavailable if it never comes up.
+        """
+        if self.startup is None:
+            return False
+        key = endpoint_key(url)
+        for server, future in zip(self.startup.servers, self.startup.futures):
+            if future.done() or endpoint_key(server.url) != key:
+                continue
             try:
-                resp = requests.get(f"{url}/v1/models", timeout=2)
-                if resp.status_code == 200:
-                    return True
-            except Exception:
-                time.sleep(1)
-        raise RuntimeError(f"vLLM server not available at {url}")
+                future.result(timeout=None if timeout is None else max(0.0, timeout))
+            except FutureTimeout:
+                raise BackendUnavailable(f"{key} was still starting at the turn deadline") from None
+            except Exception as e:
+                raise BackendUnavailable(f"{key} failed to start: {e}") from e
+            return True
+        return False
+
+    def prefix_cache_stats(self):
+        """Prefix cache counters and hit rate per backend URL, read from each server's /metrics."""
+        stats = {}
+        urls = self.character_pool.urls if self.shared_backend else [self.storyteller_url, self.director_url] + self.character_pool.urls
+        for url in dict.fromkeys(urls):
+            try:
+                resp = self.client.get(f"{url}/metrics", timeout=2)
+            except requests.exceptions.RequestException:
+                continue
+            if resp.status_code == 200:
+                stats[url] = prefix_cache_stats(parse_prometheus_text(resp.text))
+        return stats
 
-    def start_storyteller_and_director(self):
-        self.storyteller_manager.start()
-        self.director_manager.start()
+    def start_storyteller_and_director(self, wait=True, timeout=600):
+        """
+        Launch every backend at once (storyteller, director and the character pool, or the shared
+        replicas), block until all are ready and return one readiness future per server.
+        With wait=False, return the futures without waiting.
+        """
+        self.place_servers()
+        if self.shared_backend:
+            servers = list(self.character_pool.pools)
+        else:
+            servers = [self.storyteller_manager, self.director_manager, self.character_pool]
+        self.startup = StartupCoordinator(servers, timeout=timeout)
+        futures = self.startup.start()
+        if wait:
+            self.startup.wait()
+        return futures
 
     def stop_all(self):
         for manager in [self.storyteller_manager, self.director_manager]:
+            if manager is None:
+                continue
             try:
                 manager.stop()
             except Exception:
                 pass
-        if self.character_manager:
-            try:
-                self.character_manager.stop()
-            except Exception:
-                pass
+        try:
+            self.character_pool.shutdown()
+        except Exception:
+            pass
+        allocations, self.allocations = self.allocations, []
+        for allocation in allocations:
+            self.allocator.release(allocation)
 
     def start_character_manager(self):
-        self.character_manager = VLLMServerManager(self.model_path, self.character_port, gpu=self.character_gpu, log_file="character_server.log")
-        self.character_manager.start()
+        # Idempotent: the pool launches the character backend once and reuses it across turns
+        self.place_servers()
+        return self.character_pool.start()
 
-    def post_with_retries(self, url, payload, max_retries=5, wait=3):
-        import requests
-        for attempt in range(max_retries):
-            try:
-                resp = requests.post(url, json=payload)
-            except requests.exceptions.ConnectionError:
-                # Wait for server if connection fails
-                # Example: url = 'http://127.0.0.1:8999/v1/chat/completions'
-                # url.rsplit('/v1', 1)[0] -> 'http://127.0.0.1:8999'
-                self.wait_for_server_ready(url.rsplit('/v1', 1)[0])
-                resp = requests.post(url, json=payload)
-            if resp.status_code == 200:
-                return resp
-            print(f"API returned {resp.status_code}, retrying in {wait}s... (attempt {attempt+1}/{max_retries})")
-            time.sleep(wait)
+    def post_with_retries(self, url, payload, max_retries=None, wait=None):
+        """
+        POST payload to url through self.retrier: connection errors, 429 and 5xx are retried with jittered
+        backoff (honoring Retry-After) within the current turn deadline, other statuses return at once.
+        A refused connection to a server still starting up waits for it instead (see await_startup).
+        Returns the last response; raises BackendUnavailable if the backend never answered or its circuit
+        is open. max_retries and wait override the policy's attempts and base delay for this call.
+        """
+        # Retries, status and token usage are recorded on the current agent span
+        span = self.tracer.current()
+
+        def send(time_left):
+            if time_left is None:
+                return self.client.post(url, payload)
+            # Never wait on a response past the turn deadline
+            return self.client.post(url, payload, timeout=(min(self.client.connect_timeout, time_left), time_left))
+
+        def on_retry(attempt, delay, resp, error):
+            reason = resp.status_code if resp is not None else type(error).__name__
+            (getattr(self, 'logger', None) or logger).warning("API returned %s, retrying in %.2fs... (attempt %d)", reason, delay, attempt + 1)
+            if span is not None:
+                span.add("retries")
+
+        resp = self.retrier.call(url, send, max_attempts=max_retries, base_delay=wait, on_retry=on_retry,
+                                 wait_ready=lambda time_left: self.await_startup(url, time_left))
+        record_response(span, resp)
         return resp
 
+    def stream_with_retries(self, base_url, messages, max_tokens, **params):
+        """
+        Stream a chat completion for self.model_path from base_url (via chat_stream), yielding content
+        deltas. Opening the stream, up to its first delta, goes through self.retrier like post_with_retries
+        (backoff, Retry-After, breaker, deadline); once content has arrived, errors propagate so nothing is
+        shown twice. Token usage is set on the current span. Raises HTTPError with the last response if the
+        backend never accepted the request, BackendUnavailable if it never answered.
+        """
+        url = chat_completions_url(base_url)
+        # The stream's final usage chunk carries the token counts record_response reads for plain calls
+        span = self.tracer.current()
+        params["on_usage"] = lambda usage: record_usage(span, usage)
+
+        def send(time_left):
+            if time_left is not None:
+                # Never wait on the first delta past the turn deadline
+                params["timeout"] = (min(self.client.connect_timeout, time_left), time_left)
+            stream = self.chat_stream(base_url, messages, max_tokens, **params)
+            try:
+                head = [next(stream)]
+            except StopIteration:
+                head = []
+            except requests.exceptions.HTTPError as e:
+                return e.response
+            return _OpenStream(stream, head)
+
+        def on_retry(attempt, delay, resp, error):
+            reason = resp.status_code if resp is not None else type(error).__name__
+            (getattr(self, 'logger', None) or logger).warning("Stream returned %s, retrying in %.2fs... (attempt %d)", reason, delay, attempt + 1)
+            if span is not None:
+                span.add("retries")
+
+        opened = self.retrier.call(url, send, on_retry=on_retry, wait_ready=lambda time_left: self.await_startup(url, time_left))
+        if not isinstance(opened, _OpenStream):
+            record_response(span, opened)
+            raise requests.exceptions.HTTPError(f"{opened.status_code} from {url}", response=opened)
+        try:
+            yield from opened.head
+            yield from opened.stream
+        finally:
+            close = getattr(opened.stream, "close", None)
+            if close is not None:
+                close()  # aborts the request if the caller stopped early
+
+    def chat_with_retries(self, base_url, messages, max_tokens, **params):
+        """POST a chat completion for self.model_path to base_url, retrying like post_with_retries."""
+        return self.post_with_retries(chat_completions_url(base_url), self.chat_payload(messages, max_tokens, **params))
+
     def run_story_agents(self, storyteller_prompt, director_prompt, character_max_tokens=256):
         # Storyteller
-        resp = requests.post(
-            f"{self.storyteller_url}/v1/chat/completions",
-            json={
-                "model": self.model_path,
-                "messages": storyteller_prompt,
-                "max_tokens": 512
-            }
-        )
+        with self.tracer.span("storyteller") as span, request_class("storyteller"), self.backend('storyteller') as storyteller_url:
+            resp = self.client.chat(storyteller_url, self.model_path, storyteller_prompt, 512, **self.sampling)
+            record_response(span, resp)
         if resp.status_code != 200:
             raise RuntimeError(f"Storyteller agent failed: {resp.status_code}")
-        story = resp.json()["choices"][0]["message"].get("content")
+        story = message_content(resp)
         # Director
-        resp_dir = self.post_with_retries(
-            f"{self.director_url}/v1/chat/completions",
-            {
-                "model": self.model_path,
-                "messages": director_prompt,
-                "max_tokens": 2048
-            }
-        )
+        with self.tracer.span("director"):
+            resp_dir = self.director_request(director_prompt, len(bold_names(story)))
         if resp_dir.status_code != 200:
             raise RuntimeError(f"Director agent failed: {resp_dir.status_code}")
-        director_reply = resp_dir.json()["choices"][0]["message"].get("content")
-        import json
-        director_data = json.loads(director_reply)
+        director_reply = message_content(resp_dir)
+        director_data = parse_director_reply(director_reply)
         if not director_data or not director_data[0].get("spawn"):
             raise RuntimeError("Director did not spawn a character agent.")
         character_info = director_data[0]
         character_name = character_info.get("character_name", "Unknown")
         character_system_prompt = character_info.get("character_prompt", "You are a character.")
         # Character
-        self.start_character_manager()
         character_prompt = [
             {"role": "system", "content": character_system_prompt},
             {"role": "user", "content": story}
         ]
-        resp_char = requests.post(
-            f"{self.character_url}/v1/chat/completions",
-            json={
-                "model": self.model_path,
-                "messages": character_prompt,
-                "max_tokens": character_max_tokens
-            }
-        )
+        with self.tracer.span("character", character=character_name) as span, request_class("character"), self.backend('character') as character_url:
+            resp_char = self.client.chat(character_url, self.model_path, character_prompt, character_max_tokens, **self.sampling)
+            record_response(span, resp_char)
         if resp_char.status_code != 200:
             raise RuntimeError(f"Character agent failed: {resp_char.status_code}")
-        character_reply = resp_char.json()["choices"][0]["message"]["content"]
+        character_reply = message_content(resp_char)
         return story, director_reply, character_name, character_reply
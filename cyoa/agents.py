@@ -1,11 +1,10 @@
-
-
-import requests
+from cyoa.llm_client import get_default_client
 
 class OverallAgent:
-    def __init__(self, server_url):
+    def __init__(self, server_url, client=None):
         self.server_url = server_url
         self.max_tokens = 256
+        self.client = client or get_default_client()
 
     def generate_response(self, prompt, character_agents):
         char_names = ', '.join([agent.name for agent in character_agents])
@@ -13,33 +12,22 @@ class OverallAgent:
             {"role": "system", "content": f"You are the narrator of a text adventure. Characters: {char_names}. Respond with dialogue for each character."},
             {"role": "user", "content": prompt}
         ]
-        payload = {
-            "messages": messages,
-            "max_tokens": self.max_tokens
-        }
-        response = requests.post(f"{self.server_url}/v1/chat/completions", json=payload)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        return self.client.chat_content(self.server_url, None, messages, self.max_tokens)
 
 
 class CharacterAgent:
-    def __init__(self, name, server_url):
+    def __init__(self, name, server_url, client=None):
         self.name = name
         self.server_url = server_url
         self.max_tokens = 64
+        self.client = client or get_default_client()
 
     def generate_dialogue(self, context):
         messages = [
             {"role": "system", "content": f"You are {self.name}, a character in a text adventure. Respond in character."},
             {"role": "user", "content": context}
         ]
-        payload = {
-            "messages": messages,
-            "max_tokens": self.max_tokens
-        }
-        response = requests.post(f"{self.server_url}/v1/chat/completions", json=payload)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        return self.client.chat_content(self.server_url, None, messages, self.max_tokens)
 
 
 
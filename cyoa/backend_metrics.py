@@ -0,0 +1,43 @@
+import re
+
+# Prometheus sample line: name{labels} value [timestamp]
+SAMPLE_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)")
+
+
+def parse_prometheus_text(text):
+    """Sum every sample of each metric in a Prometheus text exposition (labels are folded together)."""
+    totals = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE_LINE.match(line)
+        if not match:
+            continue
+        try:
+            value = float(match.group(3))
+        except ValueError:
+            continue
+        totals[match.group(1)] = totals.get(match.group(1), 0.0) + value
+    return totals
+
+
+def prefix_cache_stats(metrics):
+    """
+    Prefix cache counters from parsed vLLM /metrics.
+    Newer vLLM exports token counters (prefix_cache_queries/hits); older versions only a hit-rate gauge.
+    """
+    queries = metrics.get("vllm:prefix_cache_queries_total", metrics.get("vllm:gpu_prefix_cache_queries_total"))
+    hits = metrics.get("vllm:prefix_cache_hits_total", metrics.get("vllm:gpu_prefix_cache_hits_total"))
+    if queries is not None and hits is not None:
+        return {"queries": queries, "hits": hits, "hit_rate": hits / queries if queries else None}
+    gauge = metrics.get("vllm:gpu_prefix_cache_hit_rate")
+    return {"queries": None, "hits": None, "hit_rate": gauge}
+
+
+def prefix_cache_delta(before, after):
+    """Hit rate over the interval between two prefix_cache_stats snapshots (e.g. one turn)."""
+    if before.get("queries") is None or after.get("queries") is None:
+        return {"queries": None, "hits": None, "hit_rate": after.get("hit_rate")}
+    queries = after["queries"] - before["queries"]
+    hits = after["hits"] - before["hits"]
+    return {"queries": queries, "hits": hits, "hit_rate": hits / queries if queries > 0 else None}
@@ -0,0 +1,509 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from cyoa.llm_client import get_default_client
+from cyoa.retry_policy import BackendUnavailable, remaining_time
+from scripts.resource_allocator import Allocation, ResourceExhausted, get_default_allocator
+from scripts.spawn_vllm_server import VLLMServerManager, wait_for_ready
+
+logger = logging.getLogger("cyoa.backend_pool")
+
+
+class BackendTopology:
+    """
+    How an AgentOrchestrator lays out its model servers.
+    By default each role (storyteller, director, characters) gets its own server. With shared_backend
+    all roles share one server, or shared_replicas replicas on GPUs from shared_gpus (None entries run
+    without CUDA_VISIBLE_DEVICES), told apart only by their prompts.
+    backend: "vllm", or "stub" for the CPU-only stand-in (scripts/stub_openai_server.py); backend_args
+    are appended to every server's command line.
+    allocator: scripts.resource_allocator.ResourceAllocator that picks free ports and GPUs (default the
+    process-wide one).
+    server_options: extra VLLMServerManager arguments for every server (gpu_memory_utilization,
+    max_model_len, max_num_seqs).
+    character_autoscale: run characters on a ReplicaSet built with these options, e.g.
+    {"max_replicas": 4, "idle_cooldown": 300}, instead of one server. Ignored with shared_backend.
+    """
+
+    def __init__(self, shared_backend=False, shared_replicas=1, shared_gpus=None, backend="vllm", backend_args=None,
+                 allocator=None, server_options=None, character_autoscale=None):
+        self.shared_backend = shared_backend
+        self.shared_replicas = shared_replicas
+        self.shared_gpus = shared_gpus
+        self.backend = backend
+        self.backend_args = backend_args
+        self.allocator = allocator or get_default_allocator()
+        self.server_options = dict(server_options or {})
+        self.character_autoscale = character_autoscale
+
+
+class CharacterBackendPool:
+    """
+    Long-lived character backend shared by every character agent.
+    The server is launched once on first use and reused across characters and turns;
+    the pool tracks readiness and in-flight requests, and owns shutdown.
+    """
+
+    def __init__(self, model_path, port, host="127.0.0.1", gpu=None, log_file="character_server.log", manager_factory=VLLMServerManager, client=None, manager_kwargs=None, start_timeout=600):
+        self.model_path = model_path
+        self.port = port
+        self.host = host
+        self.gpu = gpu
+        self.log_file = log_file
+        self.manager_factory = manager_factory
+        self.manager_kwargs = manager_kwargs or {}
+        self.client = client or get_default_client()
+        self.start_timeout = start_timeout
+        self.url = f"http://{host}:{port}"
+        self.manager = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._ready = False
+        self._closed = False
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def urls(self):
+        return [self.url]
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def process_alive(self):
+        process = getattr(self.manager, "process", None)
+        return process is not None and process.poll() is None
+
+    def start(self):
+        """Launch the backend if it is not already running. Safe to call every turn."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Character backend pool has been shut down")
+            if self.manager is not None and self.process_alive():
+                return self.manager
+            if self.manager is not None:
+                # Previous process exited; release its log handle before relaunching
+                try:
+                    self.manager.stop()
+                except Exception:
+                    pass
+            self.manager = self.manager_factory(self.model_path, self.port, host=self.host, gpu=self.gpu, log_file=self.log_file, **self.manager_kwargs)
+            self.manager.start()
+            self._ready = False
+            return self.manager
+
+    def is_ready(self):
+        """Probe /v1/models once; readiness is sticky until the process is relaunched."""
+        if self._ready:
+            return True
+        try:
+            resp = self.client.get(f"{self.url}/v1/models", timeout=2)
+        except requests.exceptions.RequestException:
+            return False
+        self._ready = resp.status_code == 200
+        return self._ready
+
+    def check_health(self, timeout=2):
+        """Probe /v1/models now (unlike is_ready, never cached); False if the process has exited."""
+        if not self.process_alive():
+            return False
+        try:
+            return self.client.get(f"{self.url}/v1/models", timeout=timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def wait_until_ready(self, timeout=600):
+        """Launch if needed and block until the backend answers; raises if the process exits first."""
+        self.start()
+        wait_for_ready(self.url, timeout=timeout, is_alive=self.process_alive, get=self.client.get)
+        verify = getattr(self.manager, "verify_identity", None)
+        if verify is not None:
+            verify(get=self.client.get)
+        self._ready = True
+        return True
+
+    @contextmanager
+    def acquire(self):
+        """
+        Reserve the backend for one request; yields its base URL once the server answers. A server that
+        was just launched (or relaunched) is waited for, up to the turn deadline or start_timeout.
+        """
+        self.start()
+        if not self._ready:
+            left = remaining_time()
+            timeout = self.start_timeout if left is None else max(0.0, min(left, self.start_timeout))
+            try:
+                self.wait_until_ready(timeout=timeout)
+            except RuntimeError as e:
+                raise BackendUnavailable(f"Character backend at {self.url} is not ready: {e}") from e
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield self.url
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle.notify_all()
+
+    def shutdown(self, drain_timeout=10):
+        """Refuse new requests, wait for in-flight ones to drain, then stop the server."""
+        with self._lock:
+            self._closed = True
+            deadline = time.time() + drain_timeout
+            while self._in_flight > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            manager, self.manager = self.manager, None
+            self._ready = False
+        if manager is not None:
+            manager.stop()
+
+
+class BackendRouter:
+    """
+    Several CharacterBackendPools serving the same model behind one pool-like interface.
+    Each request goes to the replica with the fewest in-flight requests.
+    """
+
+    def __init__(self, pools):
+        self.pools = list(pools)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return self.pools[0].url
+
+    @property
+    def urls(self):
+        return [pool.url for pool in self.pools]
+
+    @property
+    def manager(self):
+        return self.pools[0].manager
+
+    @property
+    def in_flight(self):
+        return sum(pool.in_flight for pool in self.pools)
+
+    def start(self):
+        for pool in self.pools:
+            pool.start()
+        return self.manager
+
+    def is_ready(self):
+        return all(pool.is_ready() for pool in self.pools)
+
+    def wait_until_ready(self, timeout=600):
+        for pool in self.pools:
+            pool.wait_until_ready(timeout=timeout)
+        return True
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            pool = min(self.pools, key=lambda p: p.in_flight)
+        with pool.acquire() as url:
+            yield url
+
+    def shutdown(self, drain_timeout=10):
+        for pool in self.pools:
+            pool.shutdown(drain_timeout=drain_timeout)
+
+
+class _Replica:
+    def __init__(self, pool, allocation):
+        self.pool = pool
+        self.allocation = allocation
+        self.placed = False
+        self.state = "stopped"  # stopped -> starting -> ready <-> unhealthy -> stopping
+        self.outstanding = 0
+        self.failures = 0
+        self.last_used = None
+
+
+class ReplicaSet:
+    """
+    Autoscaled character backends: between min_replicas and max_replicas servers of model_path, each on
+    a port and device from allocator, behind the same pool-like interface as CharacterBackendPool.
+    Each request goes to the healthy replica with the fewest outstanding requests. When the average
+    outstanding per replica stays at or above scale_up_outstanding for scale_up_after seconds, another
+    replica is launched; one idle for idle_cooldown seconds is stopped (never below min_replicas).
+    maintain(), run every check_interval seconds once started, also probes every replica: after
+    unhealthy_after failed checks it leaves the rotation until a check passes, and a replica whose
+    process exited is replaced.
+    """
+
+    def __init__(self, model_path, min_replicas=1, max_replicas=4, allocator=None, client=None, manager_kwargs=None,
+                 log_file="character_server_{}.log", scale_up_outstanding=4, scale_up_after=2.0, idle_cooldown=300.0,
+                 unhealthy_after=2, check_interval=5.0, health_timeout=2, start_timeout=600,
+                 pool_factory=CharacterBackendPool, clock=time.monotonic):
+        self.model_path = model_path
+        self.min_replicas = min_replicas
+        self.max_replicas = max(max_replicas, min_replicas)
+        self.allocator = allocator or get_default_allocator()
+        self.client = client or get_default_client()
+        self.manager_kwargs = dict(manager_kwargs or {})
+        self.log_file = log_file
+        self.scale_up_outstanding = scale_up_outstanding
+        self.scale_up_after = scale_up_after
+        self.idle_cooldown = idle_cooldown
+        self.unhealthy_after = unhealthy_after
+        self.check_interval = check_interval
+        self.health_timeout = health_timeout
+        self.start_timeout = start_timeout
+        self.pool_factory = pool_factory
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._launched = 0
+        self._busy_since = None
+        self._closed = False
+        self._started = False
+        self._stop_checks = threading.Event()
+        self._counts = {"scale_ups": 0, "scale_downs": 0, "ejections": 0, "replacements": 0}
+        self._replicas = [self._new_replica() for _ in range(min_replicas)]
+
+    def _new_replica(self):
+        port = self.allocator.allocate_port()
+        log_file = self.log_file.format(self._launched) if self.log_file else None
+        self._launched += 1
+        pool = self.pool_factory(self.model_path, port, log_file=log_file, client=self.client, manager_kwargs=dict(self.manager_kwargs))
+        return _Replica(pool, Allocation(port))
+
+    @property
+    def pools(self):
+        return [replica.pool for replica in self._replicas]
+
+    @property
+    def url(self):
+        return self._replicas[0].pool.url if self._replicas else None
+
+    @property
+    def urls(self):
+        return [replica.pool.url for replica in self._replicas]
+
+    @property
+    def manager(self):
+        return self._replicas[0].pool.manager if self._replicas else None
+
+    @property
+    def in_flight(self):
+        return sum(replica.outstanding for replica in self._replicas)
+
+    def _active(self):
+        return [r for r in self._replicas if r.state in ("starting", "ready", "unhealthy")]
+
+    def _routable(self):
+        return [r for r in self._replicas if r.state == "ready"]
+
+    def _launch(self, replica):
+        """Give replica a device and bring it up on a background thread. Called with the lock held."""
+        if not replica.placed:
+            if self.manager_kwargs.get("backend") != "stub":
+                try:
+                    replica.pool.gpu = replica.allocation.device = self.allocator.allocate_device()
+                except ResourceExhausted as e:
+                    logger.warning("Not launching character replica: %s", e)
+                    self._replicas.remove(replica)
+                    self.allocator.release(replica.allocation)
+                    return False
+                fraction = self.allocator.memory_fraction(replica.pool.gpu)
+                if fraction is not None:
+                    replica.pool.manager_kwargs.setdefault("gpu_memory_utilization", fraction)
+            replica.placed = True
+        replica.state = "starting"
+        threading.Thread(target=self._bring_up, args=(replica,), daemon=True, name="replica-start").start()
+        return True
+
+    def _bring_up(self, replica):
+        try:
+            replica.pool.start()
+            replica.pool.wait_until_ready(timeout=self.start_timeout)
+        except Exception as e:
+            logger.warning("Character replica %s failed to start: %s", replica.pool.url, e)
+            with self._changed:
+                retired = replica in self._replicas
+                if retired:
+                    self._retire(replica)
+                self._changed.notify_all()
+            if retired:
+                self._stop(replica)
+            return
+        with self._changed:
+            if replica.state == "starting":
+                replica.state = "ready"
+                replica.last_used = self.clock()
+            self._changed.notify_all()
+
+    def _scale_up(self):
+        """Launch one more replica if below max_replicas. Called with the lock held."""
+        if len(self._active()) >= self.max_replicas:
+            return False
+        replica = self._new_replica()
+        self._replicas.append(replica)
+        return self._launch(replica)
+
+    def _retire(self, replica):
+        """Take replica out of the set; the caller stops it with _stop() after releasing the lock."""
+        replica.state = "stopping"
+        self._replicas.remove(replica)
+        return replica
+
+    def _stop(self, replica, drain_timeout=10):
+        try:
+            replica.pool.shutdown(drain_timeout=drain_timeout)
+        finally:
+            self.allocator.release(replica.allocation)
+
+    def _observe_load(self, now):
+        """Scale up once outstanding requests per routable replica have stayed high for scale_up_after."""
+        routable = self._routable()
+        load = sum(r.outstanding for r in routable) / len(routable) if routable else 0
+        if load < self.scale_up_outstanding:
+            self._busy_since = None
+            return
+        if self._busy_since is None:
+            self._busy_since = now
+        elif now - self._busy_since >= self.scale_up_after and not any(r.state == "starting" for r in self._replicas):
+            if self._scale_up():
+                self._counts["scale_ups"] += 1
+                logger.info("Scaling character replicas up to %d (%.1f outstanding per replica)", len(self._active()), load)
+            self._busy_since = now
+
+    def start(self):
+        """Launch the initial replicas and the health/scaling thread. Safe to call every turn."""
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Character replica set has been shut down")
+            for replica in list(self._replicas):
+                if replica.state == "stopped":
+                    self._launch(replica)
+            if not self._started and self.check_interval:
+                threading.Thread(target=self._check_loop, daemon=True, name="replica-checks").start()
+            self._started = True
+        return self.manager
+
+    def _check_loop(self):
+        while not self._stop_checks.wait(self.check_interval):
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Character replica check failed")
+
+    def is_ready(self):
+        return bool(self._routable())
+
+    def wait_until_ready(self, timeout=600):
+        """Launch if needed and block until no replica is still starting; raises if none came up."""
+        self.start()
+        with self._changed:
+            self._changed.wait_for(lambda: not any(r.state == "starting" for r in self._replicas), timeout=timeout)
+            if self.min_replicas and not self._routable():
+                raise RuntimeError(f"No character replica of {self.model_path} became ready")
+        return True
+
+    def _pick(self):
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Character replica set has been shut down")
+            if not self._routable():
+                if not any(r.state == "starting" for r in self._replicas):
+                    self._scale_up()
+                left = remaining_time()
+                self._changed.wait_for(
+                    lambda: self._closed or self._routable() or not any(r.state == "starting" for r in self._replicas),
+                    timeout=self.start_timeout if left is None else max(0.0, min(left, self.start_timeout)),
+                )
+                if not self._routable():
+                    raise BackendUnavailable(f"No healthy character replica of {self.model_path}")
+            replica = min(self._routable(), key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            replica.last_used = self.clock()
+            self._observe_load(replica.last_used)
+            return replica
+
+    @contextmanager
+    def acquire(self):
+        """Route one request to the least-loaded healthy replica; yields its base URL."""
+        replica = self._pick()
+        try:
+            with replica.pool.acquire() as url:
+                yield url
+        finally:
+            with self._lock:
+                replica.outstanding -= 1
+                replica.last_used = self.clock()
+
+    def maintain(self):
+        """One round of health checks, replacement of dead replicas, load-based scale-up and idle scale-down."""
+        with self._lock:
+            checked = [r for r in self._replicas if r.state in ("ready", "unhealthy")]
+        # Probe outside the lock so routing is never held up by a slow backend
+        results = [(r, r.pool.process_alive(), r.pool.check_health(self.health_timeout)) for r in checked]
+        stopping = []
+        with self._changed:
+            if self._closed:
+                return
+            now = self.clock()
+            for replica, alive, healthy in results:
+                if replica not in self._replicas:
+                    continue
+                if not alive:
+                    logger.warning("Character replica %s exited; replacing it", replica.pool.url)
+                    stopping.append(self._retire(replica))
+                    self._counts["replacements"] += 1
+                elif healthy:
+                    replica.failures = 0
+                    if replica.state == "unhealthy":
+                        logger.info("Character replica %s is healthy again", replica.pool.url)
+                        replica.state = "ready"
+                else:
+                    replica.failures += 1
+                    if replica.state == "ready" and replica.failures >= self.unhealthy_after:
+                        logger.warning("Character replica %s failed %d health checks; taking it out of rotation", replica.pool.url, replica.failures)
+                        replica.state = "unhealthy"
+                        self._counts["ejections"] += 1
+            # Idle replicas go newest first, keeping the first (whose URL is self.url) for last
+            for replica in reversed(list(self._replicas)):
+                idle = replica.outstanding == 0 and replica.last_used is not None and now - replica.last_used >= self.idle_cooldown
+                if not idle:
+                    continue
+                if replica.state == "unhealthy" or (replica.state == "ready" and len(self._active()) > self.min_replicas):
+                    stopping.append(self._retire(replica))
+                    self._counts["scale_downs"] += 1
+                    logger.info("Stopping idle character replica %s", replica.pool.url)
+            while len(self._active()) < self.min_replicas and self._scale_up():
+                pass
+            self._observe_load(now)
+            self._changed.notify_all()
+        for replica in stopping:
+            self._stop(replica)
+
+    def stats(self):
+        """Replica states and outstanding requests, and how often the set scaled or ejected a replica."""
+        with self._lock:
+            replicas = [{"url": r.pool.url, "state": r.state, "outstanding": r.outstanding, "failures": r.failures} for r in self._replicas]
+            return dict(self._counts, replicas=replicas)
+
+    def shutdown(self, drain_timeout=10):
+        """Stop the checks and every replica (each drains its in-flight requests first)."""
+        self._stop_checks.set()
+        with self._changed:
+            self._closed = True
+            replicas, self._replicas = self._replicas, []
+            for replica in replicas:
+                replica.state = "stopping"
+            self._changed.notify_all()
+        for replica in replicas:
+            self._stop(replica, drain_timeout)
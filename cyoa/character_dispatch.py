@@ -0,0 +1,73 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cyoa.story_segmenter import StorySegmenter
+
+
+class CharacterDispatcher:
+    """
+    Starts character requests one director entry at a time, so a character can begin generating as
+    soon as the director has described it (see AgentOrchestrator.run_director's on_entry).
+    Each character sees only the parts of story it appears in; characters absent from the scene, the
+    user, unspawned and repeated entries are answered "" without a request.
+    Requests run in the context the dispatcher was created in (trace parent, turn deadline).
+    """
+
+    def __init__(self, orchestrator, story, user_name, max_workers=None):
+        self.orchestrator = orchestrator
+        self.story = story
+        self.user_name = user_name
+        workers = orchestrator.character_concurrency if max_workers is None else max_workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="character") if workers > 1 else None
+        self._context = contextvars.copy_context()
+        self._futures = {}  # character_name -> Future or reply, in submission order
+        self._lock = threading.Lock()
+
+    def visible_text(self, name):
+        return StorySegmenter(self.story, names=[name]).visible_text(name)
+
+    def submit(self, entry):
+        """Dispatch the character described by a director entry; returns True if a request was started."""
+        name = entry.get("character_name")
+        if not entry.get("spawn") or not name or name == self.user_name:
+            return False
+        with self._lock:
+            if name in self._futures:
+                return False
+            visible = self.visible_text(name)
+            if not visible:
+                self._futures[name] = ""
+                return False
+            prompt = entry.get("character_prompt", "You are a character.")
+            args = (self.orchestrator.ask_character, name, prompt, visible)
+            if self._executor is None:
+                self._futures[name] = None  # reserve the slot; answered below, outside the lock
+            else:
+                self._futures[name] = self._executor.submit(self._context.copy().run, *args, queued_at=time.perf_counter())
+                return True
+        reply = self._context.copy().run(*args, queued_at=time.perf_counter())
+        with self._lock:
+            self._futures[name] = reply
+        return True
+
+    @property
+    def dispatched(self):
+        with self._lock:
+            return list(self._futures)
+
+    def results(self, names=None):
+        """Wait for the replies; returns character_name -> reply for names (default: every dispatched entry)."""
+        with self._lock:
+            futures = dict(self._futures)
+        names = list(futures) if names is None else names
+        responses = {}
+        for name in names:
+            value = futures.get(name, "")
+            responses[name] = value.result() if hasattr(value, "result") else (value or "")
+        return responses
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
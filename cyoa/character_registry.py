@@ -0,0 +1,47 @@
+import threading
+
+from cyoa.story_segmenter import StorySegmenter, bold_names
+
+
+class CharacterRegistry:
+    """
+    Characters seen so far in a story and the character_prompt the director gave each one.
+    Lets a turn skip the director entirely when the storyteller introduced no new **bold** character.
+    """
+
+    def __init__(self, user_name=None):
+        self.user_name = user_name
+        self.characters = {}  # character_name -> character_prompt, in order of appearance
+        self.declined = set()  # bold names the director chose not to spawn
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.characters or name in self.declined
+
+    def new_names(self, text):
+        """Bold names in text that the director has never been asked about."""
+        return [name for name in bold_names(text) if name != self.user_name and name not in self]
+
+    def register(self, asked_names, director_data):
+        """Record the director's answer for asked_names; names it did not spawn are remembered as declined."""
+        with self._lock:
+            spawned = set()
+            for char in director_data:
+                name = char.get("character_name")
+                if not char.get("spawn") or not name or name == self.user_name:
+                    continue
+                self.characters[name] = char.get("character_prompt", self.characters.get(name, "You are a character."))
+                spawned.add(name)
+            self.declined.update(name for name in asked_names if name not in spawned and name not in self.characters)
+
+    def present(self, text):
+        """Director-style entries for known characters who appear in text, in order of appearance."""
+        with self._lock:
+            characters = dict(self.characters)
+        if not characters:
+            return []
+        segmenter = StorySegmenter(text, names=list(characters))
+        return [
+            {"spawn": True, "character_name": name, "character_prompt": prompt}
+            for name, prompt in characters.items() if segmenter.index[name]
+        ]
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from cyoa.llm_client import ClientWrapper
+
+# Payload fields that do not change what the model generates
+TRANSPORT_FIELDS = ("stream", "stream_options", "user")
+
+
+def cache_key(payload):
+    """Content hash of a chat completion request: model, messages and every sampling parameter."""
+    content = {k: v for k, v in payload.items() if k not in TRANSPORT_FIELDS}
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def is_deterministic(payload):
+    """True if the request always yields the same completion: greedy (temperature 0) or seeded sampling."""
+    return payload.get("temperature") == 0 or payload.get("seed") is not None
+
+
+def completion_body(content, finish_reason="stop"):
+    """Chat completion body for text assembled from a stream."""
+    return {"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}]}
+
+
+def cached_response(body):
+    """A 200 requests.Response carrying body, marked with X-Cache: hit."""
+    resp = requests.Response()
+    resp.status_code = 200
+    resp._content = json.dumps(body).encode()
+    resp.headers = CaseInsensitiveDict({"Content-Type": "application/json", "X-Cache": "hit"})
+    resp.encoding = "utf-8"
+    return resp
+
+
+class CompletionCache:
+    """
+    Two-tier memo of chat completion bodies keyed by cache_key: an in-memory LRU of max_entries, backed
+    (when directory is given) by one JSON file per completion, evicted least-recently-used first once
+    the files exceed max_bytes. Only deterministic requests are cached unless cache_all is set.
+    Token usage is not stored, so cache hits never count as generated tokens.
+    """
+
+    def __init__(self, max_entries=256, directory=None, max_bytes=64 * 1024 * 1024, cache_all=False):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache_all = cache_all
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._files = OrderedDict()  # key -> size in bytes, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(found):
+            self._files[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def cacheable(self, payload):
+        return self.cache_all or is_deterministic(payload)
+
+    def get(self, key):
+        """The cached completion body for key, or None."""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return body
+            if key not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(key)
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                body = json.load(f)
+            os.utime(self._path(key))  # file mtimes keep the LRU order across restarts
+        except (OSError, ValueError):
+            with self._lock:
+                self._disk_bytes -= self._files.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, body)
+        return body
+
+    def put(self, key, body):
+        body = {k: v for k, v in body.items() if k != "usage"}
+        with self._lock:
+            self._remember(key, body)
+        if not self.directory:
+            return
+        data = json.dumps(body, ensure_ascii=False).encode()
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)  # readers never see a partial file
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            evicted = []
+            while self._disk_bytes > self.max_bytes and len(self._files) > 1:
+                old, size = self._files.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def _remember(self, key, body):
+        self._memory[key] = body
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory), "disk_entries": len(self._files), "disk_bytes": self._disk_bytes}
+
+
+class CachingClient(ClientWrapper):
+    """
+    Wraps an LLMClient so chat completions (plain and streamed) are answered from a CompletionCache when
+    possible. A streamed hit yields the whole cached text as one delta; a stream is only stored once it
+    has been read to the end, so cancelled or failed completions are never cached. Every other call
+    goes straight to the wrapped client.
+    """
+
+    def __init__(self, client, cache):
+        super().__init__(client)
+        self.cache = cache
+
+    def _key(self, url, payload):
+        if not url.endswith("/chat/completions") or not self.cache.cacheable(payload):
+            return None
+        return cache_key(payload)
+
+    def post(self, url, payload, timeout=None):
+        key = self._key(url, payload)
+        if key is not None:
+            body = self.cache.get(key)
+            if body is not None:
+                return cached_response(body)
+        resp = self.client.post(url, payload, timeout=timeout)
+        if key is not None and resp.status_code == 200:
+            try:
+                self.cache.put(key, resp.json())
+            except ValueError:
+                pass
+        return resp
+
+    def stream(self, url, payload, timeout=None, on_usage=None):
+        key = self._key(url, payload)
+        if key is None:
+            yield from self.client.stream(url, payload, timeout=timeout, on_usage=on_usage)
+            return
+        body = self.cache.get(key)
+        if body is not None:
+            content = body["choices"][0]["message"].get("content")
+            if content:
+                yield content
+            return
+        parts = []
+        for delta in self.client.stream(url, payload, timeout=timeout, on_usage=on_usage):
+            parts.append(delta)
+            yield delta
+        self.cache.put(key, completion_body("".join(parts)))
@@ -0,0 +1,168 @@
+import json
+import re
+
+# Shape of the director's reply; sent as an OpenAI json_schema response_format so vLLM's guided
+# decoding can only produce a valid array
+DIRECTOR_ENTRY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "spawn": {"type": "boolean"},
+        "character_name": {"type": "string"},
+        "character_prompt": {"type": "string"},
+    },
+    "required": ["spawn", "character_name", "character_prompt"],
+    "additionalProperties": False,
+}
+
+DEFAULT_CHARACTER_PROMPT = "You are a character."
+CODE_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+# What a backend's 400 says when it cannot do structured output at all
+STRUCTURED_OUTPUT_ERROR = re.compile(r"response_format|json_schema|guided", re.IGNORECASE)
+
+
+def director_schema(max_items=None):
+    schema = {"type": "array", "items": DIRECTOR_ENTRY_SCHEMA}
+    if max_items:
+        schema["maxItems"] = max_items
+    return schema
+
+
+def director_response_format(max_items=None):
+    """response_format for a chat completion that constrains the reply to the director schema."""
+    return {"type": "json_schema", "json_schema": {"name": "director_spawns", "schema": director_schema(max_items), "strict": True}}
+
+
+def rejects_response_format(resp):
+    """True if resp is a 400 whose error names response_format or guided decoding (unsupported, not a bad request)."""
+    if resp is None or resp.status_code != 400:
+        return False
+    text = getattr(resp, "text", None)
+    return isinstance(text, str) and STRUCTURED_OUTPUT_ERROR.search(text) is not None
+
+
+def director_token_budget(expected_characters, per_character=128, overhead=32, cap=2048):
+    """max_tokens for a director reply describing expected_characters characters."""
+    return min(cap, overhead + per_character * max(1, expected_characters))
+
+
+def _normalize(entry):
+    if not isinstance(entry, dict):
+        return None
+    name = entry.get("character_name") or entry.get("name")
+    if not isinstance(name, str) or not name.strip():
+        return None
+    spawn = entry.get("spawn", True)
+    if isinstance(spawn, str):
+        spawn = spawn.strip().lower() in ("true", "yes", "1")
+    prompt = entry.get("character_prompt") or entry.get("prompt") or DEFAULT_CHARACTER_PROMPT
+    return {"spawn": bool(spawn), "character_name": name.strip().strip("*"), "character_prompt": str(prompt)}
+
+
+def _entries(value):
+    if isinstance(value, dict):
+        # {"characters": [...]} or a single bare object
+        lists = [v for v in value.values() if isinstance(v, list)]
+        value = lists[0] if lists else [value]
+    if not isinstance(value, list):
+        return []
+    return [entry for entry in map(_normalize, value) if entry]
+
+
+def parse_director_reply(text):
+    """
+    Best-effort parse of a director reply into [{"spawn", "character_name", "character_prompt"}, ...].
+    Accepts clean JSON, JSON wrapped in prose or code fences, a wrapping object, and replies cut off
+    by max_tokens (every complete object is kept). Never raises; unusable replies give [].
+    """
+    if not text:
+        return []
+    try:
+        return _entries(json.loads(text))
+    except ValueError:
+        pass
+    fenced = CODE_FENCE.search(text)
+    if fenced:
+        try:
+            return _entries(json.loads(fenced.group(1)))
+        except ValueError:
+            text = fenced.group(1)
+    decoder = json.JSONDecoder()
+    start = text.find("[")
+    if start != -1:
+        try:
+            return _entries(decoder.raw_decode(text, start)[0])
+        except ValueError:
+            pass
+    # Truncated or otherwise broken array: salvage each complete top-level object
+    entries = []
+    i = text.find("{", max(start, 0))
+    while i != -1:
+        try:
+            value, end = decoder.raw_decode(text, i)
+        except ValueError:
+            i = text.find("{", i + 1)
+            continue
+        entries.extend(_entries(value))
+        i = text.find("{", end)
+    return entries
+
+
+class IncrementalEntryParser:
+    """
+    Parses a director reply as it streams in. feed(delta) returns the entries whose JSON object closed
+    in that delta, so each character can be dispatched before the rest of the array is written.
+    Objects are taken from the top-level array (or a bare top-level object); surrounding prose and
+    code fences are skipped.
+    """
+
+    def __init__(self):
+        self.stack = []  # open '[' / '{' outside strings
+        self.in_string = False
+        self.escaped = False
+        self.current = []  # characters of the entry object being read
+        self.text = []
+
+    def feed(self, delta):
+        entries = []
+        self.text.append(delta)
+        for ch in delta:
+            capturing = bool(self.current)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                if capturing:
+                    self.current.append(ch)
+                continue
+            if ch == '"':
+                if self.stack:
+                    self.in_string = True
+            elif ch in "[{":
+                if ch == "{" and self.stack in ([], ["["]):
+                    self.current = []
+                    capturing = True
+                self.stack.append(ch)
+            elif ch in "]}":
+                if self.stack and self.stack[-1] == ("[" if ch == "]" else "{"):
+                    self.stack.pop()
+                if capturing and ch == "}" and self.stack in ([], ["["]):
+                    self.current.append(ch)
+                    entries.extend(self._close())
+                    continue
+            if capturing:
+                self.current.append(ch)
+        return entries
+
+    def _close(self):
+        text, self.current = "".join(self.current), []
+        try:
+            return _entries(json.loads(text))
+        except ValueError:
+            return []
+
+    @property
+    def reply(self):
+        return "".join(self.text)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# ANSI color codes for log coloring
+AGENT_COLORS = {
+    'Storyteller': '\033[95m',  # Magenta
+    'Director': '\033[94m',     # Blue
+    'Character': '\033[92m',    # Green
+    'ENDC': '\033[0m'
+}
+
+
+def agent_event(logger, agent_type, message, payload, agent_name=None, level=logging.DEBUG):
+    """
+    Log one agent prompt/response as a structured record. Nothing is formatted here: the payload
+    (a message list or reply text) travels on the record and is rendered by AgentEventFormatter,
+    on the writer thread when the logger goes through setup_logging's queue.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, "%s %s", agent_type, message, extra={
+        "event": "agent", "agent_type": agent_type, "agent_message": message, "agent_name": agent_name, "payload": payload,
+    })
+
+
+def redact(payload):
+    """Replace prompt/response text with its length and a short hash."""
+    text = payload if isinstance(payload, str) else json.dumps(payload, sort_keys=True, default=str)
+    summary = {"chars": len(text), "sha256": hashlib.sha256(text.encode()).hexdigest()[:16]}
+    if isinstance(payload, list):
+        summary["messages"] = len(payload)
+    return summary
+
+
+class AgentEventFormatter(logging.Formatter):
+    """
+    Renders agent events as the familiar colored "[Character (Kael)] Prompt:" blocks, or as one JSON
+    object per line with json_lines=True. redact=True logs hashes and lengths instead of prompt text.
+    """
+
+    def __init__(self, fmt='[%(levelname)s] %(message)s', color=True, redact=False, json_lines=False):
+        super().__init__(fmt)
+        self.color = color
+        self.redact = redact
+        self.json_lines = json_lines
+
+    def format(self, record):
+        if getattr(record, "event", None) != "agent":
+            if self.json_lines:
+                return json.dumps({"time": record.created, "level": record.levelname, "logger": record.name, "message": record.getMessage()})
+            return super().format(record)
+        payload = redact(record.payload) if self.redact else record.payload
+        if self.json_lines:
+            return json.dumps({
+                "time": record.created, "level": record.levelname, "event": "agent", "agent": record.agent_type,
+                "name": record.agent_name, "message": record.agent_message, "payload": payload,
+            }, default=str)
+        color = AGENT_COLORS.get(record.agent_type, '') if self.color else ''
+        endc = AGENT_COLORS['ENDC'] if self.color else ''
+        name_str = f" ({record.agent_name})" if record.agent_name else ""
+        record.message = f"{color}[{record.agent_type}{name_str}] {record.agent_message}:{endc}\n{payload}\n"
+        return self.formatMessage(record)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as is. The stdlib one formats every record in the calling
+    thread, which is exactly the work this is meant to move off the turn loop. Records that do not
+    fit in a full queue are counted in `dropped` instead of blocking.
+    """
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks cannot cross threads safely; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogSetup:
+    """Handle returned by setup_logging; stop() flushes the queue and closes the handlers."""
+
+    def __init__(self, logger, queue_handler, listener, handlers):
+        self.logger = logger
+        self.queue_handler = queue_handler
+        self.listener = listener
+        self.handlers = handlers
+
+    def stop(self):
+        self.listener.stop()
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(path="cyoa_debug.log", level=logging.DEBUG, console=False, max_bytes=10 * 1024 * 1024, backup_count=3,
+                  redact_prompts=False, json_lines=False, logger_name="cyoa", queue_size=10000):
+    """
+    Route the "cyoa" logger through a queue to a background writer thread that owns a size-capped
+    rotating file and the console (every record with console=True, otherwise warnings only, such as
+    retries). Returns a LogSetup; call stop() on exit. When the queue is full, records are dropped
+    rather than blocking a turn.
+    """
+    handlers = []
+    if path:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(AgentEventFormatter(color=False, redact=redact_prompts, json_lines=json_lines))
+        handlers.append(file_handler)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.NOTSET if console else logging.WARNING)
+    console_handler.setFormatter(AgentEventFormatter(color=True, redact=redact_prompts, json_lines=json_lines))
+    handlers.append(console_handler)
+    records = queue.Queue(maxsize=queue_size)
+    queue_handler = LazyQueueHandler(records)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    listener.start()
+    return LogSetup(logger, queue_handler, listener, handlers)
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 300
+
+
+def chat_completions_url(base_url):
+    return f"{base_url.rstrip('/')}/v1/chat/completions"
+
+
+def build_chat_payload(model, messages, max_tokens, **params):
+    """OpenAI-compatible chat completion request body."""
+    payload = {"messages": messages, "max_tokens": max_tokens}
+    if model:
+        payload["model"] = model
+    payload.update(params)
+    return payload
+
+
+def message_content(resp):
+    """Extract the assistant text from a chat completion response (None if absent)."""
+    return resp.json()["choices"][0]["message"].get("content")
+
+
+class StreamStats:
+    """Time-to-first-token and inter-token latency of one streamed completion."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.chunk_times = []
+        self.end = None
+
+    def record_chunk(self):
+        self.chunk_times.append(time.perf_counter())
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    @property
+    def ttft(self):
+        return self.chunk_times[0] - self.start if self.chunk_times else None
+
+    @property
+    def inter_token_latencies(self):
+        return [b - a for a, b in zip(self.chunk_times, self.chunk_times[1:])]
+
+    def as_dict(self):
+        gaps = self.inter_token_latencies
+        return {
+            "ttft": self.ttft,
+            "mean_inter_token_latency": sum(gaps) / len(gaps) if gaps else None,
+            "max_inter_token_latency": max(gaps) if gaps else None,
+            "chunks": len(self.chunk_times),
+            "total": (self.end or time.perf_counter()) - self.start,
+        }
+
+
+def iter_sse_content(lines, on_usage=None):
+    """
+    Yield content deltas from the `data:` lines of an OpenAI-compatible SSE stream.
+    on_usage(usage) is called with the `usage` token counts of the trailing usage chunk, if any.
+    """
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+        if chunk.get("usage") and on_usage is not None:
+            on_usage(chunk["usage"])
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue  # e.g. the trailing usage-only chunk
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+class LLMClient:
+    """
+    Shared HTTP client for OpenAI-compatible backends.
+    Keeps one keep-alive requests.Session (and connection pool) per endpoint and applies
+    connect/read timeouts to every call so a wedged backend cannot hang a turn forever.
+    """
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, pool_maxsize=16):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def session_for(self, url):
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount(key, adapter)
+                self._sessions[key] = session
+            return session
+
+    def get(self, url, timeout=None):
+        return self.session_for(url).get(url, timeout=timeout or self.timeout)
+
+    def post(self, url, payload, timeout=None):
+        return self.session_for(url).post(url, json=payload, timeout=timeout or self.timeout)
+
+    def stream(self, url, payload, timeout=None, on_usage=None):
+        """
+        POST with stream=true and yield content deltas as they arrive; raises HTTPError on a non-200.
+        The backend is asked for a final usage chunk, which is passed to on_usage(usage).
+        """
+        payload = dict(payload, stream=True)
+        payload.setdefault("stream_options", {"include_usage": True})
+        with self.session_for(url).post(url, json=payload, timeout=timeout or self.timeout, stream=True) as resp:
+            if not resp.ok:
+                resp.content  # read the error body while the connection is still open
+            resp.raise_for_status()
+            yield from iter_sse_content(resp.iter_lines(decode_unicode=True), on_usage=on_usage)
+
+    def chat(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        """POST a chat completion and return the raw response."""
+        payload = build_chat_payload(model, messages, max_tokens, **params)
+        return self.post(chat_completions_url(base_url), payload, timeout=timeout)
+
+    def chat_content(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        """POST a chat completion and return the assistant text, raising on HTTP errors."""
+        resp = self.chat(base_url, model, messages, max_tokens, timeout=timeout, **params)
+        resp.raise_for_status()
+        return message_content(resp)
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+
+class ClientWrapper:
+    """
+    Base for layers over an LLMClient (caching, scheduling): subclasses override post() and stream();
+    chat() and chat_content() go through the overridden post(), everything else to the wrapped client.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def post(self, url, payload, timeout=None):
+        return self.client.post(url, payload, timeout=timeout)
+
+    def stream(self, url, payload, timeout=None, on_usage=None):
+        return self.client.stream(url, payload, timeout=timeout, on_usage=on_usage)
+
+    def chat(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        payload = build_chat_payload(model, messages, max_tokens, **params)
+        return self.post(chat_completions_url(base_url), payload, timeout=timeout)
+
+    def chat_content(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        resp = self.chat(base_url, model, messages, max_tokens, timeout=timeout, **params)
+        resp.raise_for_status()
+        return message_content(resp)
+
+
+class AsyncLLMClient:
+    """asyncio front-end over LLMClient; calls run on a bounded thread pool and share its connection pools."""
+
+    def __init__(self, client=None, max_workers=16):
+        self.client = client or get_default_client()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-client")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def get(self, url, timeout=None):
+        return await self._run(self.client.get, url, timeout=timeout)
+
+    async def post(self, url, payload, timeout=None):
+        return await self._run(self.client.post, url, payload, timeout=timeout)
+
+    async def chat(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        return await self._run(self.client.chat, base_url, model, messages, max_tokens, timeout=timeout, **params)
+
+    async def chat_content(self, base_url, model, messages, max_tokens, timeout=None, **params):
+        return await self._run(self.client.chat_content, base_url, model, messages, max_tokens, timeout=timeout, **params)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_default_client():
+    """Process-wide client shared by every agent that is not given its own."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
@@ -0,0 +1,209 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from cyoa.llm_client import ClientWrapper
+from cyoa.retry_policy import BackendUnavailable, endpoint_key, remaining_time
+
+# Lower runs first. The storyteller segment is what a player is waiting on; speculation and summaries
+# are optional or can wait for a later turn.
+PRIORITY_CLASSES = {"storyteller": 0, "director": 1, "character": 2, "summarizer": 3, "speculation": 3, "default": 2}
+BACKGROUND_PRIORITY = 3
+
+_request_class = contextvars.ContextVar("cyoa_request_class", default="default")
+_request_session = contextvars.ContextVar("cyoa_request_session", default=None)
+
+
+@contextmanager
+def request_class(name):
+    """Schedule requests made inside the block as priority class `name` (see PRIORITY_CLASSES)."""
+    token = _request_class.set(name)
+    try:
+        yield
+    finally:
+        _request_class.reset(token)
+
+
+@contextmanager
+def request_session(session_id):
+    """Attribute requests made inside the block to session_id, for fairness between sessions."""
+    token = _request_session.set(session_id)
+    try:
+        yield
+    finally:
+        _request_session.reset(token)
+
+
+def current_session():
+    return _request_session.get()
+
+
+class SchedulerRejected(BackendUnavailable):
+    """A request was not admitted: the backend's queue is full, or it waited past its deadline."""
+
+
+class _Waiter:
+    def __init__(self, klass, session):
+        self.klass = klass
+        self.session = session
+        self.granted = False
+        self.event = threading.Event()
+
+
+class _Backend:
+    def __init__(self):
+        self.in_flight = 0
+        self.queue = []  # heap of (priority, session_grants, seq, waiter)
+        self.grants = {}  # (priority, session) -> (decaying count of requests granted, as of), for least-served-first fairness
+        self.prune_at = 64
+
+
+class RequestScheduler:
+    """
+    Admits requests to each backend (scheme://host:port) by priority class, so a player's storyteller
+    segment is never stuck behind background work. At most max_in_flight requests run per backend;
+    the rest wait in a priority queue where, within a class, the session that has been served least
+    recently goes first (grant counts halve every grant_half_life seconds; forget_session drops a closed
+    session's counts). Admission control: a request is rejected (SchedulerRejected) when max_queue requests are
+    already waiting, background classes are only queued while fewer than max_background_waiting are,
+    and a queued request gives up at queue_timeout or the current turn deadline, whichever is first.
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=256, max_background_waiting=0, queue_timeout=None, priorities=None, grant_half_life=60.0, clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_background_waiting = max_background_waiting
+        self.queue_timeout = queue_timeout
+        self.grant_half_life = grant_half_life
+        self.priorities = dict(PRIORITY_CLASSES, **(priorities or {}))
+        self.clock = clock
+        self._backends = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {}  # class -> {"admitted", "rejected", "queued", "wait_total", "wait_max"}
+
+    def priority(self, klass):
+        return self.priorities.get(klass, self.priorities["default"])
+
+    def _record(self, klass, key, value=1):
+        stats = self._stats.setdefault(klass, {"admitted": 0, "rejected": 0, "queued": 0, "wait_total": 0.0, "wait_max": 0.0})
+        if key == "wait":
+            stats["wait_total"] += value
+            stats["wait_max"] = max(stats["wait_max"], value)
+        else:
+            stats[key] += value
+
+    def _served(self, backend, priority, session, now):
+        """How much (priority, session) has been served on backend lately: its grant count, decayed to now."""
+        count, at = backend.grants.get((priority, session), (0.0, now))
+        return count * 0.5 ** ((now - at) / self.grant_half_life)
+
+    def _grant(self, backend, priority, session):
+        now = self.clock()
+        backend.in_flight += 1
+        backend.grants[(priority, session)] = (self._served(backend, priority, session, now) + 1, now)
+        if len(backend.grants) >= backend.prune_at:
+            # Drop sessions whose counts have decayed away; amortized over the grants since the last sweep
+            backend.grants = {key: (count, at) for key, (count, at) in backend.grants.items() if self._served(backend, *key, now) >= 0.01}
+            backend.prune_at = max(64, 2 * len(backend.grants))
+
+    def forget_session(self, session):
+        """Drop session's grant counts on every backend (call when the session closes)."""
+        with self._lock:
+            for backend in self._backends.values():
+                for key in [key for key in backend.grants if key[1] == session]:
+                    del backend.grants[key]
+
+    def acquire(self, url, klass=None, session=None):
+        """Block until a request to url may start; returns the seconds spent queued. Pair with release(url)."""
+        klass = klass or _request_class.get()
+        session = session if session is not None else _request_session.get()
+        priority = self.priority(klass)
+        start = self.clock()
+        with self._lock:
+            backend = self._backends.setdefault(endpoint_key(url), _Backend())
+            if backend.in_flight < self.max_in_flight and not backend.queue:
+                self._grant(backend, priority, session)
+                self._record(klass, "admitted")
+                return 0.0
+            waiting = len(backend.queue)
+            if waiting >= self.max_queue or (priority >= BACKGROUND_PRIORITY and waiting >= self.max_background_waiting):
+                self._record(klass, "rejected")
+                raise SchedulerRejected(f"{endpoint_key(url)} is saturated ({backend.in_flight} in flight, {waiting} waiting); {klass} request rejected")
+            waiter = _Waiter(klass, session)
+            heapq.heappush(backend.queue, (priority, self._served(backend, priority, session, start), next(self._seq), waiter))
+            self._record(klass, "queued")
+        timeout = self.queue_timeout
+        left = remaining_time()
+        if left is not None:
+            timeout = left if timeout is None else min(timeout, left)
+        waiter.event.wait(None if timeout is None else max(0.0, timeout))
+        with self._lock:
+            if not waiter.granted:
+                backend.queue = [item for item in backend.queue if item[3] is not waiter]
+                heapq.heapify(backend.queue)
+                self._record(klass, "rejected")
+                raise SchedulerRejected(f"{klass} request waited {self.clock() - start:.2f}s for {endpoint_key(url)} without being admitted")
+            waited = self.clock() - start
+            self._record(klass, "admitted")
+            self._record(klass, "wait", waited)
+        return waited
+
+    def release(self, url):
+        with self._lock:
+            backend = self._backends[endpoint_key(url)]
+            backend.in_flight -= 1
+            while backend.queue and backend.in_flight < self.max_in_flight:
+                priority, _, _, waiter = heapq.heappop(backend.queue)
+                self._grant(backend, priority, waiter.session)
+                waiter.granted = True
+                waiter.event.set()
+
+    @contextmanager
+    def slot(self, url, klass=None, session=None):
+        """Hold one of url's in-flight slots for the block; yields the seconds spent queued."""
+        waited = self.acquire(url, klass, session)
+        try:
+            yield waited
+        finally:
+            self.release(url)
+
+    def stats(self):
+        """Per-class admission counts and queue times, and in-flight/waiting counts per backend."""
+        with self._lock:
+            return {
+                "classes": {klass: dict(stats) for klass, stats in self._stats.items()},
+                "backends": {key: {"in_flight": b.in_flight, "waiting": len(b.queue)} for key, b in self._backends.items()},
+            }
+
+
+class SchedulingClient(ClientWrapper):
+    """
+    Wraps an LLMClient so every chat completion (plain or streamed) runs inside a RequestScheduler slot;
+    a stream holds its slot until it is exhausted or closed. on_wait(seconds) is called for each queued
+    request. Other calls (health checks, /metrics) bypass the scheduler.
+    """
+
+    def __init__(self, client, scheduler, on_wait=None):
+        super().__init__(client)
+        self.scheduler = scheduler
+        self.on_wait = on_wait
+
+    def _waited(self, seconds):
+        if seconds and self.on_wait is not None:
+            self.on_wait(seconds)
+
+    def post(self, url, payload, timeout=None):
+        if not url.endswith("/chat/completions"):
+            return self.client.post(url, payload, timeout=timeout)
+        with self.scheduler.slot(url) as waited:
+            self._waited(waited)
+            return self.client.post(url, payload, timeout=timeout)
+
+    def stream(self, url, payload, timeout=None, on_usage=None):
+        with self.scheduler.slot(url) as waited:
+            self._waited(waited)
+            yield from self.client.stream(url, payload, timeout=timeout, on_usage=on_usage)
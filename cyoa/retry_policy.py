@@ -0,0 +1,228 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+RETRYABLE_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+# Absolute time.monotonic() by which the current turn must finish; None when unbounded.
+# Copied into character fan-out threads along with the tracing context.
+_deadline = contextvars.ContextVar("cyoa_deadline", default=None)
+
+
+class BackendUnavailable(RuntimeError):
+    """A backend could not be reached within the retry budget, or its circuit breaker is open."""
+
+
+class CircuitOpenError(BackendUnavailable):
+    pass
+
+
+@contextmanager
+def deadline(seconds, clock=time.monotonic):
+    """Bound every retry loop run inside the block to `seconds` from now (nested deadlines only tighten)."""
+    if seconds is None:
+        yield None
+        return
+    at = clock() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time(clock=time.monotonic):
+    """Seconds left before the current deadline, or None without one."""
+    at = _deadline.get()
+    return None if at is None else at - clock()
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date); None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+def endpoint_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class RetryPolicy:
+    """
+    When and how long to retry. Connection errors and 408/429/5xx are retried with capped exponential
+    backoff and full jitter; other statuses (e.g. a 400 for context overflow) are returned at once.
+    A Retry-After header sets a floor on the delay. No attempt is started if the delay would run past
+    the current deadline.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.25, max_delay=8.0, retry_statuses=RETRYABLE_STATUSES, rng=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.random = rng or random.Random()
+
+    def is_retryable(self, resp=None, error=None):
+        if error is not None:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        return resp.status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None, base_delay=None):
+        """Sleep before retry number `attempt` (0-based)."""
+        base = self.base_delay if base_delay is None else base_delay
+        cap = min(self.max_delay, base * (2 ** attempt))
+        delay = self.random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker: after failure_threshold consecutive failures it opens and rejects calls for
+    reset_timeout seconds, then lets a single probe through (half-open); success closes it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """Give up a half-open probe slot without judging the backend (the call never reached it)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._probing = False
+
+
+class Retrier:
+    """Runs requests under a RetryPolicy with one CircuitBreaker per backend (scheme://host:port)."""
+
+    def __init__(self, policy=None, failure_threshold=5, reset_timeout=30.0, sleep=time.sleep, clock=time.monotonic):
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        key = endpoint_key(url)
+        with self._lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout, clock=self.clock)
+            return self.breakers[key]
+
+    def call(self, url, send, max_attempts=None, base_delay=None, on_retry=None, wait_ready=None):
+        """
+        Call send(timeout) until it returns a non-retryable response or the attempts, deadline or breaker
+        run out. timeout is the time left before the deadline (None without one). Returns the last
+        response; raises BackendUnavailable if no response was ever received.
+        on_retry(attempt, delay, resp, error) is called before each sleep.
+        wait_ready(timeout) is called when a connection fails (not on timeouts); if it returns True it has
+        waited for a backend that was still starting, and the call is retried at once without using up
+        an attempt or counting against the breaker.
+        """
+        breaker = self.breaker(url)
+        attempts = max_attempts or self.policy.max_attempts
+        resp = error = None
+        attempt = 0
+        while attempt < attempts:
+            if not breaker.allow():
+                if resp is not None:
+                    return resp
+                raise CircuitOpenError(f"Circuit open for {endpoint_key(url)}") from error
+            left = remaining_time(self.clock)
+            if left is not None and left <= 0:
+                break
+            resp = error = None
+            try:
+                resp = send(left)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            except BaseException:
+                # e.g. SchedulerRejected: say nothing about the backend, but never hold the probe slot
+                breaker.release()
+                raise
+            if error is None and not self.policy.is_retryable(resp):
+                breaker.record_success()
+                return resp
+            if wait_ready is not None and error is not None and not isinstance(error, requests.exceptions.Timeout):
+                if wait_ready(remaining_time(self.clock)):
+                    breaker.release()
+                    continue
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                break
+            retry_after = parse_retry_after(resp.headers.get("Retry-After")) if resp is not None else None
+            delay = self.policy.delay(attempt, retry_after, base_delay=base_delay)
+            left = remaining_time(self.clock)
+            if left is not None and delay >= left:
+                break  # the retry could not finish before the deadline
+            if on_retry:
+                on_retry(attempt, delay, resp, error)
+            self.sleep(delay)
+            attempt += 1
+        if resp is not None:
+            return resp
+        if error is None:
+            raise BackendUnavailable(f"Deadline exceeded before calling {endpoint_key(url)}")
+        raise BackendUnavailable(f"{endpoint_key(url)} unreachable: {error}") from error
@@ -0,0 +1,410 @@
+"""
+Multi-player HTTP front-end: many StorySessions in one process, sharing one AgentOrchestrator and so
+one backend pool.
+
+    POST   /sessions                 {"user_name", "user_background"} or {"resume": id} -> 201 {"session_id"}
+    GET    /sessions/<id>            story, cast, choices and turn count
+    POST   /sessions/<id>/turns      {"input": "..."} (omit input for the introduction) -> the turn
+    DELETE /sessions/<id>
+    GET    /health                   open sessions and running turns
+
+A turn request with "Accept: text/event-stream" (or ?stream=1) is answered as server-sent events:
+`token` events carry storyteller text as it is generated, then one `turn` event (or `error`).
+
+Usage:
+    python -m cyoa.session_server --port 8080 --backend stub
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import BackendTopology
+from cyoa.event_log import setup_logging
+from cyoa.request_scheduler import RequestScheduler
+from cyoa.story_session import StorySession
+from cyoa.story_store import StoryStore
+from scripts.resource_allocator import add_server_arguments, allocator_from_args
+
+logger = logging.getLogger("cyoa.server")
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class HostedSession:
+    """A StorySession plus the bookkeeping the server needs: one turn at a time, last use for eviction."""
+
+    def __init__(self, session_id, session, now):
+        self.session_id = session_id
+        self.session = session
+        self.lock = asyncio.Lock()
+        self.last_used = now
+
+    def state(self):
+        session = self.session
+        return {
+            "session_id": self.session_id, "user_name": session.user_name, "turns": len(session.history),
+            "story": session.story, "cast": sorted(session.cast), "choices": session.choices,
+        }
+
+
+class SessionManager:
+    """
+    Sessions of every connected player, kept in memory and sharing one orchestrator. Turns run on a
+    bounded thread pool (StorySession is synchronous); sessions idle for idle_timeout seconds are
+    closed, and with a StoryStore they are resumed from their saved turns on next use. Removing a
+    session also deletes it from the store.
+    """
+
+    def __init__(self, orchestrator, idle_timeout=900.0, max_sessions=None, max_concurrent_turns=32, store=None, clock=time.monotonic):
+        self.orchestrator = orchestrator
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.store = store
+        self.clock = clock
+        self.sessions = {}
+        self.active_turns = 0
+        self.completed_turns = 0
+        self.evicted = 0
+        self._evicted_ids = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_turns, thread_name_prefix="turn")
+
+    def _add(self, session, session_id=None):
+        if self.max_sessions and len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                self._close(session)
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Session limit reached")
+        if session_id is None:
+            session_id = session.session_id or uuid.uuid4().hex[:12]
+        hosted = HostedSession(session_id, session, self.clock())
+        self.sessions[session_id] = hosted
+        self._evicted_ids.discard(session_id)
+        return hosted
+
+    def create(self, user_name, user_background=""):
+        if not user_name:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "user_name is required")
+        return self._add(StorySession(self.orchestrator, user_name, user_background, store=self.store))
+
+    def resume(self, session_id):
+        """The hosted session session_id, reloading it from the store if it was evicted."""
+        if session_id in self.sessions:
+            return self.get(session_id)
+        if self.store is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session {session_id}")
+        try:
+            session = StorySession.resume(self.orchestrator, self.store, session_id)
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session {session_id}")
+        return self._add(session, session_id)
+
+    def get(self, session_id):
+        """The hosted session session_id; one closed for being idle is resumed from the store."""
+        hosted = self.sessions.get(session_id)
+        if hosted is None:
+            if session_id in self._evicted_ids:
+                return self.resume(session_id)
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session {session_id}")
+        hosted.last_used = self.clock()
+        return hosted
+
+    def remove(self, session_id):
+        hosted = self.sessions.pop(session_id, None)
+        if hosted is None and session_id not in self._evicted_ids:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session {session_id}")
+        self._evicted_ids.discard(session_id)
+        if self.store is not None:
+            self.store.delete_session(session_id)
+        if hosted is not None:
+            self._close(hosted.session)
+
+    def evict_idle(self):
+        """Close sessions idle for longer than idle_timeout; returns how many were evicted."""
+        now = self.clock()
+        idle = [sid for sid, hosted in self.sessions.items() if not hosted.lock.locked() and now - hosted.last_used > self.idle_timeout]
+        for session_id in idle:
+            self._close(self.sessions.pop(session_id).session)
+            if self.store is not None:
+                self._evicted_ids.add(session_id)
+        self.evicted += len(idle)
+        return len(idle)
+
+    def _close(self, session):
+        # close() joins speculation threads; keep it off the event loop
+        self._executor.submit(session.close)
+
+    @asynccontextmanager
+    async def turn(self, hosted):
+        """Hold hosted's turn slot; a second concurrent turn for the same session is rejected with 409."""
+        if hosted.lock.locked():
+            raise HTTPError(HTTPStatus.CONFLICT, "A turn is already running for this session")
+        async with hosted.lock:
+            self.active_turns += 1
+            try:
+                yield
+            finally:
+                self.active_turns -= 1
+                hosted.last_used = self.clock()
+
+    async def run_turn(self, hosted, user_input=None, on_token=None):
+        """Run the introduction (no user_input on a new session) or one turn; call inside turn(hosted)."""
+        session = hosted.session
+        if user_input is None:
+            if session.started:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "input is required after the introduction")
+            call = lambda: session.start(on_token=on_token)
+        else:
+            call = lambda: session.advance(user_input, on_token=on_token)
+        text = await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        self.completed_turns += 1
+        return {
+            "session_id": hosted.session_id, "turn": len(session.history) - 1, "text": text,
+            "choices": session.choices, "timings": session.history[-1]["timings"],
+        }
+
+    def stats(self):
+        stats = {"sessions": len(self.sessions), "active_turns": self.active_turns, "completed_turns": self.completed_turns, "evicted": self.evicted}
+        if self.orchestrator.scheduler is not None:
+            stats["scheduler"] = self.orchestrator.scheduler.stats()
+        return stats
+
+    def close(self):
+        for hosted in self.sessions.values():
+            self._close(hosted.session)
+        self.sessions.clear()
+        self._executor.shutdown(wait=True)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class SessionServer:
+    """asyncio HTTP/1.1 server (one request per connection) exposing a SessionManager."""
+
+    def __init__(self, manager, host="127.0.0.1", port=8080, reap_interval=None):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.reap_interval = reap_interval or max(1.0, manager.idle_timeout / 4)
+        self._server = None
+        self._reaper = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._reaper = asyncio.ensure_future(self._reap())
+        logger.info("Serving story sessions on http://%s:%d", self.host, self.port)
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def stop(self):
+        self._reaper.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            evicted = self.manager.evict_idle()
+            if evicted:
+                logger.info("Evicted %d idle sessions", evicted)
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def _handle(self, reader, writer):
+        try:
+            method, target, headers, body = await self._read_request(reader)
+            await self._route(writer, method, target, headers, body)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Request failed")
+            with suppress(ConnectionError):
+                await self._send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error"})
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _route(self, writer, method, target, headers, body):
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["health"] and method == "GET":
+            return await self._send_json(writer, HTTPStatus.OK, dict(self.manager.stats(), status="ok"))
+        if parts == ["sessions"] and method == "POST":
+            data = self._json(body)
+            if data.get("resume"):
+                hosted = self.manager.resume(data["resume"])
+            else:
+                hosted = self.manager.create(data.get("user_name", "").strip(), data.get("user_background", "").strip())
+            return await self._send_json(writer, HTTPStatus.CREATED, hosted.state())
+        if len(parts) == 2 and parts[0] == "sessions":
+            if method == "GET":
+                return await self._send_json(writer, HTTPStatus.OK, self.manager.get(parts[1]).state())
+            if method == "DELETE":
+                self.manager.remove(parts[1])
+                return await self._send(writer, HTTPStatus.NO_CONTENT, b"")
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "turns" and method == "POST":
+            hosted = self.manager.get(parts[1])
+            user_input = self._json(body).get("input")
+            if isinstance(user_input, str):
+                user_input = user_input.strip() or None
+            stream = "text/event-stream" in headers.get("accept", "") or parse_qs(url.query).get("stream") == ["1"]
+            async with self.manager.turn(hosted):
+                if stream:
+                    return await self._stream_turn(writer, hosted, user_input)
+                return await self._send_json(writer, HTTPStatus.OK, await self.manager.run_turn(hosted, user_input))
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}")
+
+    async def _stream_turn(self, writer, hosted, user_input):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        turn = asyncio.ensure_future(self.manager.run_turn(hosted, user_input, on_token=lambda delta: loop.call_soon_threadsafe(queue.put_nowait, delta)))
+        turn.add_done_callback(lambda _: loop.call_soon(queue.put_nowait, None))
+        writer.write(self._head(HTTPStatus.OK, "text/event-stream", extra={"Cache-Control": "no-cache"}))
+        connected = True
+        while True:
+            delta = await queue.get()
+            if delta is None:
+                break
+            if connected:
+                try:
+                    writer.write(sse_event("token", {"text": delta}))
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False  # the turn still finishes, so the session stays consistent
+        if not connected:
+            with suppress(Exception):
+                await turn
+            return
+        try:
+            writer.write(sse_event("turn", turn.result()))
+        except HTTPError as e:
+            writer.write(sse_event("error", {"error": e.message, "status": int(e.status)}))
+        except Exception as e:
+            logger.exception("Turn failed for session %s", hosted.session_id)
+            writer.write(sse_event("error", {"error": str(e) or type(e).__name__, "status": 500}))
+        with suppress(ConnectionError):
+            await writer.drain()
+
+    def _json(self, body):
+        if not body:
+            return {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+        return data
+
+    def _head(self, status, content_type, length=None, extra=None):
+        status = HTTPStatus(status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}", "Connection: close"]
+        if length is not None:
+            lines.append(f"Content-Length: {length}")
+        lines.extend(f"{name}: {value}" for name, value in (extra or {}).items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    async def _send(self, writer, status, data, content_type="application/json"):
+        writer.write(self._head(status, content_type, len(data)) + data)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload):
+        await self._send(writer, status, json.dumps(payload).encode())
+
+
+async def serve(manager, host, port):
+    server = await SessionServer(manager, host, port).start()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many concurrent story sessions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="meta-llama/Llama-3.2-3B-Instruct")
+    parser.add_argument("--backend", choices=["vllm", "stub"], default="vllm", help="Model server to launch ('stub' is a CPU-only stand-in)")
+    parser.add_argument("--backend-port", type=int, help="Port of the first shared backend replica (default: pick free ports)")
+    parser.add_argument("--replicas", type=int, default=1, help="Shared backend replicas serving every session")
+    parser.add_argument("--idle-timeout", type=float, default=900, help="Close sessions idle for this many seconds")
+    parser.add_argument("--max-sessions", type=int, help="Refuse new sessions beyond this many")
+    parser.add_argument("--max-concurrent-turns", type=int, default=32, help="Turns running at once across all sessions")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="Requests running at once per backend; the rest queue by role priority")
+    parser.add_argument("--max-queue", type=int, default=256, help="Requests waiting per backend before new ones are rejected")
+    parser.add_argument("--save", metavar="DB", help="Save every turn to this SQLite story tree so evicted sessions can resume")
+    parser.add_argument("--choices", type=int, default=0, help="Have the storyteller offer this many numbered choices each turn")
+    parser.add_argument("--turn-deadline", type=float, help="Seconds a turn may spend retrying a failing backend")
+    parser.add_argument("--log-file", default="cyoa_server.log")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    allocator, server_options = allocator_from_args(args)
+    log_setup = setup_logging(args.log_file, level=logging.INFO, console=True)
+    orchestrator = AgentOrchestrator(
+        args.model, storyteller_port=args.backend_port,
+        topology=BackendTopology(shared_backend=True, shared_replicas=args.replicas, backend=args.backend, allocator=allocator, server_options=server_options),
+        turn_deadline=args.turn_deadline, story_choices=args.choices,
+        scheduler=RequestScheduler(max_in_flight=args.max_in_flight, max_queue=args.max_queue),
+    )
+    orchestrator.set_logger(log_setup.logger)
+    store = StoryStore(args.save) if args.save else None
+    manager = SessionManager(orchestrator, idle_timeout=args.idle_timeout, max_sessions=args.max_sessions, max_concurrent_turns=args.max_concurrent_turns, store=store)
+    try:
+        orchestrator.start_storyteller_and_director()
+        asyncio.run(serve(manager, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.close()
+        orchestrator.stop_all()
+        if store is not None:
+            store.close()
+        log_setup.stop()
+
+
+if __name__ == "__main__":
+    main()
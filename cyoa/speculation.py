@@ -0,0 +1,116 @@
+import re
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from cyoa.request_scheduler import current_session, request_session
+
+CHOICE_LINE = re.compile(r"^\s*(?:\*\*)?(\d+)[.)](?:\*\*)?\s+(.+?)\s*$")
+CHOICES_INSTRUCTION = (
+    " End every response with exactly {n} numbered choices for what the main character could do next,"
+    " one per line, formatted as '1. <choice>'."
+)
+
+
+def parse_choices(text):
+    """The numbered choices ('1. Follow Kael') the storyteller listed at the end of text, in order."""
+    choices = []
+    for line in reversed(text.strip().splitlines()):
+        match = CHOICE_LINE.match(line)
+        if not match:
+            break
+        choices.append(match.group(2).strip())
+    return list(reversed(choices))
+
+
+def _normalize(text):
+    return re.sub(r"[^a-z0-9 ]", "", text.lower()).strip()
+
+
+def match_choice(user_input, choices):
+    """Index of the choice the player picked ("2", "2.", or the choice's text), or None for free text."""
+    text = user_input.strip().rstrip(".)")
+    if text.isdigit() and 1 <= int(text) <= len(choices):
+        return int(text) - 1
+    normalized = _normalize(user_input)
+    for i, choice in enumerate(choices):
+        if normalized and normalized == _normalize(choice):
+            return i
+    return None
+
+
+class Branch:
+    """One speculative storyteller continuation for a listed choice."""
+
+    def __init__(self, choice, prompt):
+        self.choice = choice
+        self.prompt = prompt
+        self.cancelled = threading.Event()
+        self.future = None
+
+
+class BranchSpeculator:
+    """
+    Pre-generates the storyteller continuation for each listed choice while the player is reading, so a
+    picked choice is served without waiting on the storyteller. At most max_branches run at once, each
+    capped at max_tokens; branches that are not picked are cancelled (their streams are closed, which
+    aborts the request on the backend) and discarded.
+    """
+
+    def __init__(self, orchestrator, max_branches=3, max_tokens=512):
+        self.orchestrator = orchestrator
+        self.max_branches = max_branches
+        self.max_tokens = max_tokens
+        self.branches = []
+        self.hits = 0
+        self.misses = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_branches), thread_name_prefix="speculation")
+
+    def speculate(self, branches):
+        """Start generating [(choice, storyteller_prompt), ...]; earlier speculation is cancelled."""
+        self.cancel()
+        session = current_session()
+        for choice, prompt in branches[:self.max_branches]:
+            branch = Branch(choice, prompt)
+            branch.future = self._executor.submit(self._generate, session, branch)
+            self.branches.append(branch)
+        return self.branches
+
+    def _generate(self, session, branch):
+        # Branches count against their session's share of the backend, not the turn that started them
+        with request_session(session):
+            return self.orchestrator.speculate_story_segment(branch.prompt, branch.cancelled, self.max_tokens)
+
+    def take(self, choice):
+        """
+        The pre-generated segment for choice (waiting if it is still being written), or None if that
+        choice was not speculated or its generation failed. Every other branch is cancelled.
+        """
+        branch = next((b for b in self.branches if b.choice == choice), None)
+        self.cancel(keep=branch)
+        self.branches = []
+        if branch is None:
+            self.misses += 1
+            return None
+        try:
+            segment = branch.future.result()
+        except (CancelledError, Exception):
+            segment = None
+        if segment:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return segment or None
+
+    def cancel(self, keep=None):
+        """Cancel every pending branch except keep."""
+        for branch in self.branches:
+            if branch is keep:
+                continue
+            branch.cancelled.set()
+            branch.future.cancel()
+        if keep is None:
+            self.branches = []
+
+    def close(self):
+        self.cancel()
+        self._executor.shutdown(wait=True)
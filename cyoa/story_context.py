@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Prompt-token budget for the story portion of each role's prompt
+DEFAULT_CONTEXT_BUDGETS = {"storyteller": 3072, "director": 1536, "character": 1024}
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class StoryContext:
+    """
+    Token-budgeted view of a growing story.
+    Recent turns are kept verbatim; older turns are folded into a running summary by a background
+    worker between turns, so rendering a prompt never waits on summarization. Until a summary is
+    ready, turns that do not fit the budget are simply left out.
+    """
+
+    def __init__(self, summarize=None, budgets=None, count_tokens=estimate_tokens, keep_recent=2, summarize_at=0.75):
+        self.summarize = summarize  # summarize(previous_summary, text) -> new summary
+        self.budgets = dict(DEFAULT_CONTEXT_BUDGETS, **(budgets or {}))
+        self.count_tokens = count_tokens
+        self.keep_recent = keep_recent
+        self.summarize_at = summarize_at
+        self.turns = []
+        self.summary = ""
+        self.summarized_turns = 0  # turns[:summarized_turns] are covered by self.summary
+        self._lock = threading.Lock()
+        self._pending = None
+        self._executor = None
+        self._generation = 0  # bumped by restore() so summaries of replaced turns are dropped
+
+    def add_turn(self, text):
+        with self._lock:
+            self.turns.append(text)
+        self._maybe_summarize()
+
+    def _maybe_summarize(self):
+        if self.summarize is None:
+            return
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return
+            end = len(self.turns) - self.keep_recent
+            if end <= self.summarized_turns:
+                return
+            unsummarized = sum(self.count_tokens(t) for t in self.turns[self.summarized_turns:])
+            if unsummarized < self.summarize_at * min(self.budgets.values()):
+                return
+            previous, start = self.summary, self.summarized_turns
+            text = "\n\n".join(self.turns[start:end])
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="story-summary")
+            self._pending = self._executor.submit(self._summarize, previous, text, start, end, self._generation)
+
+    def _summarize(self, previous, text, start, end, generation=0):
+        summary = self.summarize(previous, text)
+        with self._lock:
+            # Only apply if no other summary overtook this one and the turns were not restored
+            if self.summarized_turns == start and generation == self._generation and summary:
+                self.summary = summary.strip()
+                self.summarized_turns = end
+        return summary
+
+    def state(self):
+        """Summary state to save alongside the turns: {"summary", "summarized_turns"}."""
+        with self._lock:
+            return {"summary": self.summary, "summarized_turns": self.summarized_turns}
+
+    def restore(self, turns, summary="", summarized_turns=0):
+        """Replace the turns and summary with saved ones, without summarizing anything."""
+        with self._lock:
+            self.turns = list(turns)
+            self.summary = summary
+            self.summarized_turns = min(summarized_turns, len(self.turns))
+            self._pending = None
+            self._generation += 1
+
+    def wait_idle(self, timeout=None):
+        """Block until any in-flight summarization finishes (tests and shutdown only)."""
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout=timeout)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def clip(self, text, role):
+        """Keep the tail of text that fits in role's budget."""
+        return self._clip(text, self.budgets[role])
+
+    def _clip(self, text, budget):
+        if self.count_tokens(text) <= budget:
+            return text
+        keep = max(0, len(text) * budget // max(1, self.count_tokens(text)))
+        return text[len(text) - keep:] if keep else ""
+
+    def render(self, role, pending=None):
+        """
+        Story text for role's prompt within its budget: summary of old turns, then as many recent
+        turns as fit, then pending (text not yet added as a turn, always included).
+        """
+        budget = self.budgets[role]
+        with self._lock:
+            turns = list(self.turns)
+            summary = self.summary
+            summarized = self.summarized_turns
+        parts = []
+        used = 0
+        if pending:
+            pending = self._clip(pending, budget)
+            used = self.count_tokens(pending)
+        summary_cost = self.count_tokens(summary)
+        first = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            if index < summarized and summary and used + summary_cost <= budget:
+                break  # older turns are covered by the summary
+            cost = self.count_tokens(turns[index])
+            if used + cost > budget:
+                break
+            used += cost
+            first = index
+        if summary and first > 0:
+            summary = self._clip(summary, budget - used)
+            if summary:
+                parts.append(f"Story so far (summary): {summary}")
+        parts.extend(turns[first:])
+        if pending:
+            parts.append(pending)
+        return "\n\n".join(parts)
@@ -0,0 +1,73 @@
+import re
+
+BOLD_NAME = re.compile(r"\*\*(.+?)\*\*")
+REPLY_LINE = re.compile(r"^\[(.+?)\]:")
+# Words that do not identify a character on their own when a multi-word name is shortened
+NAME_FILLERS = {"the", "of", "a", "an", "and", "elder", "old", "young", "lord", "lady", "sir", "dame", "captain", "king", "queen", "master", "mistress"}
+
+
+def bold_names(text):
+    """Names marked as major characters with **bold** in text, in order of first appearance."""
+    names = []
+    for match in BOLD_NAME.finditer(text):
+        name = match.group(1).strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def name_aliases(name):
+    """The full name plus its distinctive parts, e.g. 'Elder Marrow' -> {'Elder Marrow', 'Marrow'}."""
+    aliases = {name}
+    parts = name.split()
+    if len(parts) > 1:
+        aliases.update(p for p in parts if p.lower() not in NAME_FILLERS and len(p) > 2)
+    return aliases
+
+
+def split_segments(story):
+    """Split a story into paragraphs; each integrated '[Name]: reply' line becomes its own segment."""
+    segments = []
+    for paragraph in re.split(r"\n\s*\n", story):
+        prose = []
+        for line in paragraph.split("\n"):
+            if REPLY_LINE.match(line.strip()):
+                if prose:
+                    segments.append("\n".join(prose))
+                    prose = []
+                segments.append(line.strip())
+            elif line.strip():
+                prose.append(line)
+        if prose:
+            segments.append("\n".join(prose))
+    return segments
+
+
+class StorySegmenter:
+    """
+    Index of which characters appear in which segment of a story.
+    A character is present in a segment if it is bolded there, referred to by name (or a distinctive
+    part of it) after being introduced, or speaks in an integrated reply line. Explicitly passed
+    names (e.g. the known cast) count as already introduced.
+    """
+
+    def __init__(self, story, names=None):
+        self.segments = split_segments(story)
+        self.names = list(names) if names else bold_names(story)
+        self.index = {name: [] for name in self.names}
+        patterns = {name: re.compile(r"\b(" + "|".join(re.escape(a) for a in sorted(name_aliases(name), key=len, reverse=True)) + r")\b") for name in self.names}
+        introduced = set(names or ())
+        for i, segment in enumerate(self.segments):
+            reply = REPLY_LINE.match(segment)
+            for name in self.names:
+                if f"**{name}**" in segment:
+                    introduced.add(name)
+                if (reply and reply.group(1) == name) or (name in introduced and patterns[name].search(segment)):
+                    self.index[name].append(i)
+
+    def visible_segments(self, name):
+        return [self.segments[i] for i in self.index.get(name, [])]
+
+    def visible_text(self, name):
+        """The parts of the story the character can perceive ("" if it is not in the scene)."""
+        return "\n\n".join(self.visible_segments(name))
@@ -0,0 +1,279 @@
+import time
+from contextlib import contextmanager
+
+from cyoa.character_dispatch import CharacterDispatcher
+from cyoa.character_registry import CharacterRegistry
+from cyoa.request_scheduler import request_session
+from cyoa.retry_policy import deadline
+from cyoa.speculation import BranchSpeculator, match_choice, parse_choices
+from cyoa.story_context import StoryContext
+
+
+class StorySession:
+    """
+    State of one player's story: the text so far, the known cast and the director's results.
+    start() generates the introduction once; each advance(user_input) runs a single turn that
+    continues from the existing story instead of regenerating it.
+    With a StoryStore every turn is saved as a node of the story tree: resume() and rewind() rebuild
+    the session from stored turns, and an action already taken from the current node is replayed
+    from the store instead of being generated again.
+    """
+
+    def __init__(self, orchestrator, user_name, user_background, store=None, session_id=None):
+        self.orchestrator = orchestrator
+        self.user_name = user_name
+        self.user_background = user_background
+        self.story = ""
+        self.registry = CharacterRegistry(user_name)
+        self.director_results = []  # director_data for every turn the director was consulted, in order
+        self.history = []  # one record per turn, including per-stage wall-clock timings in seconds
+        self._unreviewed = ""  # story text the director has not seen yet
+        # Prompts see a token-budgeted view of the story, not the ever-growing full text
+        self.context = StoryContext(summarize=orchestrator.summarize_story, budgets=orchestrator.context_budgets)
+        self.choices = []  # numbered choices offered at the end of the latest segment
+        self.speculator = None
+        if orchestrator.story_choices and orchestrator.speculative_branches:
+            self.speculator = BranchSpeculator(orchestrator, max_branches=orchestrator.speculative_branches)
+        self.store = store
+        self.session_id = session_id
+        if store is not None and session_id is None:
+            self.session_id = store.create_session(user_name, user_background)
+        self.head = None  # store node of the latest turn
+        self.reuse_stored = True  # replay stored turns for repeated actions instead of regenerating them
+
+    @classmethod
+    def resume(cls, orchestrator, store, session_id, node=None):
+        """Session session_id rebuilt from the store at its head (or at node), without any LLM calls."""
+        saved = store.session(session_id)
+        session = cls(orchestrator, saved["user_name"], saved["user_background"], store=store, session_id=session_id)
+        head = node or saved["head"]
+        if head is not None:
+            session._restore(store.path(head))
+            if node is not None:
+                store.set_head(session_id, head)
+        return session
+
+    @property
+    def cast(self):
+        """Known characters: character_name -> character_prompt."""
+        return self.registry.characters
+
+    @property
+    def started(self):
+        return bool(self.story)
+
+    def start(self, on_token=None):
+        """Generate and return the story introduction."""
+        if self.started:
+            return self.story
+        with self._turn_context(0):
+            return self._start(on_token)
+
+    @property
+    def scheduling_id(self):
+        """Key the request scheduler shares fairly between sessions."""
+        return self.session_id or id(self)
+
+    @contextmanager
+    def _turn_context(self, turn):
+        """Trace span, deadline and scheduler session shared by every request of one turn."""
+        orchestrator = self.orchestrator
+        with orchestrator.tracer.span("turn", turn=turn, user=self.user_name), deadline(orchestrator.turn_deadline), request_session(self.scheduling_id):
+            yield
+
+    def _start(self, on_token):
+        orchestrator = self.orchestrator
+        start = time.perf_counter()
+        storyteller_prompt = orchestrator.build_storyteller_prompt_with_user(self.user_name, self.user_background)
+        orchestrator.log_agent('Storyteller', 'Prompt', storyteller_prompt)
+        timings = {}
+        intro = orchestrator.generate_story_segment(storyteller_prompt, on_token=on_token, timings=timings)
+        orchestrator.log_agent('Storyteller', 'Response', intro)
+        self.story = intro
+        self._unreviewed = intro
+        self.context.add_turn(intro)
+        elapsed = time.perf_counter() - start
+        timings.update(storyteller=elapsed, director=0.0, characters=0.0, integration=0.0, total=elapsed)
+        self.history.append({"user_input": None, "segment": intro, "update": intro, "director_data": [], "responses": {}, "timings": timings})
+        self._save()
+        self._offer_choices(intro)
+        return intro
+
+    def advance(self, user_input, on_token=None):
+        """
+        Run one turn for user_input: storyteller continuation -> director (only for new characters)
+        -> character agents present in the new text -> integration. Returns the text added this turn.
+        """
+        if not self.started:
+            self.start(on_token=on_token)
+        # Retries anywhere in the turn (including character fan-out threads) stop at the turn deadline
+        with self._turn_context(len(self.history)):
+            return self._advance(user_input, on_token)
+
+    def _advance(self, user_input, on_token):
+        orchestrator = self.orchestrator
+        timings = {}
+        turn_start = stage_start = time.perf_counter()
+
+        def lap(stage):
+            nonlocal stage_start
+            now = time.perf_counter()
+            timings[stage] = now - stage_start
+            stage_start = now
+
+        # 1. Storyteller continues from the existing story with the user's action; a listed choice
+        # whose continuation was speculated is served from it
+        picked = match_choice(user_input, self.choices) if self.choices else None
+        if picked is not None:
+            user_input = self.choices[picked]
+        stored = self.store.find_child(self.head, user_input) if self.store is not None and self.reuse_stored else None
+        if stored is not None:
+            return self._replay(stored, on_token)
+        segment = None
+        if self.speculator:
+            if picked is not None:
+                segment = self.speculator.take(user_input)
+            else:
+                self.speculator.cancel()  # free text discards every branch
+        if segment is None:
+            storyteller_prompt = self.storyteller_prompt(user_input)
+            orchestrator.log_agent('Storyteller', 'Prompt', storyteller_prompt)
+            segment = orchestrator.generate_story_segment(storyteller_prompt, on_token=on_token, timings=timings)
+        else:
+            timings["speculated"] = True
+            if on_token is not None:
+                on_token(segment)
+        orchestrator.log_agent('Storyteller', 'Response', segment)
+        lap("storyteller")
+
+        # 2. Director is only consulted about bold characters it has never seen; known characters
+        # present in the new text reuse the prompts it gave them earlier and start right away.
+        # 3. Characters react to the new segment, with as much recent story as their budget allows.
+        # With a streaming director each new character starts as soon as its entry is complete, so the
+        # "director" timing overlaps the characters and "characters" is the wait that remains after it.
+        pending = f"{self._unreviewed}\n\n{segment}" if self._unreviewed else segment
+        new_names = self.registry.new_names(pending)
+        spawned = None
+        dispatcher = CharacterDispatcher(orchestrator, self.context.render('character', pending=segment), self.user_name)
+        try:
+            for entry in self.registry.present(pending):
+                dispatcher.submit(entry)
+            if new_names:
+                on_entry = self._dispatch_new(dispatcher, new_names) if orchestrator.stream_director else None
+                _, spawned = orchestrator.run_director(self.context.clip(pending, 'director'), self.user_name, new_names=new_names, on_entry=on_entry)
+                self.registry.register(new_names, spawned)
+                self.director_results.append(spawned)
+            self._unreviewed = ""
+            director_data = self.registry.present(pending)
+            for entry in director_data:
+                dispatcher.submit(entry)  # known characters and non-streamed director entries
+            lap("director")
+            char_responses = dispatcher.results([entry["character_name"] for entry in director_data])
+        finally:
+            dispatcher.close()
+        lap("characters")
+
+        # 4. Integrate the segment and replies into the running story
+        update = orchestrator.director_integrate_character_responses(segment, char_responses)
+        self.story = f"{self.story}\n\n{update}"
+        self.context.add_turn(update)
+        lap("integration")
+        timings["total"] = time.perf_counter() - turn_start
+        self.history.append({
+            "user_input": user_input, "segment": segment, "update": update, "director_data": director_data,
+            "responses": char_responses, "new_names": new_names, "spawned": spawned, "timings": timings,
+        })
+        self._save()
+        self._offer_choices(segment)
+        return update
+
+    def _save(self):
+        """Store the latest turn as a child of the current head and move the head to it."""
+        if self.store is None:
+            return
+        record = dict(self.history[-1], unreviewed=self._unreviewed, context=self.context.state())
+        record.pop("node", None)
+        self.head = self.history[-1]["node"] = self.store.add_node(self.head, record)
+        self.store.set_head(self.session_id, self.head)
+
+    def _apply(self, node):
+        """Add a stored turn to the in-memory state (story, cast, history); no model calls."""
+        self.story = node["update"] if node["parent"] is None else f"{self.story}\n\n{node['update']}"
+        if node.get("new_names"):
+            self.registry.register(node["new_names"], node.get("spawned") or [])
+            self.director_results.append(node.get("spawned") or [])
+        self._unreviewed = node.get("unreviewed", "")
+        entry = {key: node.get(key) for key in ("user_input", "segment", "update", "director_data", "responses", "new_names", "spawned", "timings")}
+        entry["node"] = self.head = node["hash"]
+        self.history.append(entry)
+
+    def _restore(self, nodes):
+        """Reset the session to the end of nodes (a path from the introduction)."""
+        if self.speculator:
+            self.speculator.cancel()
+        self.story = ""
+        self.registry = CharacterRegistry(self.user_name)
+        self.director_results = []
+        self.history = []
+        for node in nodes:
+            self._apply(node)
+        self._restore_context(nodes[-1])
+        self.choices = parse_choices(nodes[-1]["segment"]) if self.orchestrator.story_choices else []
+
+    def _restore_context(self, node):
+        """Prompt context as saved with node, whose path is now self.history."""
+        saved = node.get("context") or {}
+        self.context.restore([entry["update"] for entry in self.history], saved.get("summary", ""), saved.get("summarized_turns", 0))
+
+    def _replay(self, node, on_token):
+        """Serve a turn that was already generated from the current node."""
+        self.orchestrator.log_agent('Storyteller', 'Replayed', node["segment"])
+        if on_token is not None:
+            on_token(node["segment"])
+        if self.speculator:
+            self.speculator.cancel()
+        self._apply(node)
+        self.history[-1]["replayed"] = True
+        self._restore_context(node)
+        self.store.set_head(self.session_id, self.head)
+        self._offer_choices(node["segment"])
+        return node["update"]
+
+    def rewind(self, node):
+        """
+        Go back to an earlier point of the story: node is a stored node hash (or unique prefix) or a
+        turn number in this session's history (0 is the introduction). The next advance() forks a new
+        branch from there; the turns after it stay in the store.
+        """
+        if self.store is None:
+            raise RuntimeError("rewind needs a StoryStore")
+        if isinstance(node, int):
+            node = self.history[node]["node"]
+        else:
+            node = self.store.resolve(node)
+        self._restore(self.store.path(node))
+        self.store.set_head(self.session_id, self.head)
+        return self.story
+
+    def storyteller_prompt(self, user_input):
+        return self.orchestrator.build_storyteller_continuation_prompt(self.context.render('storyteller'), user_input, self.user_name, self.user_background)
+
+    def _offer_choices(self, segment):
+        """Remember the choices listed in segment and, if enabled, start speculating on them."""
+        self.choices = parse_choices(segment) if self.orchestrator.story_choices else []
+        if self.speculator and self.choices:
+            self.speculator.speculate([(choice, self.storyteller_prompt(choice)) for choice in self.choices])
+
+    def _dispatch_new(self, dispatcher, new_names):
+        """on_entry for a streaming director: start characters the director was asked about and spawned."""
+        def on_entry(entry):
+            if entry.get("character_name") in new_names:
+                dispatcher.submit(entry)
+        return on_entry
+
+    def close(self):
+        if self.speculator:
+            self.speculator.close()
+        self.context.close()
+        if self.orchestrator.scheduler is not None:
+            self.orchestrator.scheduler.forget_session(self.scheduling_id)
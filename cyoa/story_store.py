@@ -0,0 +1,156 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    hash TEXT PRIMARY KEY,
+    parent TEXT REFERENCES nodes(hash),
+    depth INTEGER NOT NULL,
+    user_input TEXT,
+    segment TEXT NOT NULL,
+    update_text TEXT NOT NULL,
+    record TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes(parent, user_input);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_name TEXT NOT NULL,
+    user_background TEXT,
+    head TEXT REFERENCES nodes(hash),
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Record fields that make up a node's identity; metrics and context state do not
+CONTENT_FIELDS = ("user_input", "segment", "update", "director_data", "responses", "new_names", "spawned")
+
+
+def node_hash(parent, record):
+    content = {key: record.get(key) for key in CONTENT_FIELDS}
+    data = json.dumps([parent, content], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class StoryStore:
+    """
+    Persistent tree of story turns in SQLite. Each node is one turn (the storyteller segment, director
+    output, character replies and metrics) whose parent is the turn before it; nodes are keyed by a
+    hash of their content and parent, so replaying the same turn never stores it twice. Sessions are
+    named pointers to a head node; rewinding or forking only moves or copies a pointer.
+    """
+
+    def __init__(self, path):
+        self.db_path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def add_node(self, parent, record):
+        """Store a turn record under parent (None for the introduction); returns its hash."""
+        digest = node_hash(parent, record)
+        with self._lock, self._db:
+            depth = 0
+            if parent is not None:
+                row = self._db.execute("SELECT depth FROM nodes WHERE hash = ?", (parent,)).fetchone()
+                if row is None:
+                    raise KeyError(f"Unknown parent node {parent}")
+                depth = row["depth"] + 1
+            self._db.execute(
+                "INSERT OR IGNORE INTO nodes (hash, parent, depth, user_input, segment, update_text, record, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, parent, depth, record.get("user_input"), record["segment"], record["update"], json.dumps(record, default=str), time.time()),
+            )
+        return digest
+
+    def _row_to_node(self, row):
+        node = json.loads(row["record"])
+        node.update(hash=row["hash"], parent=row["parent"], depth=row["depth"])
+        return node
+
+    def node(self, digest):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM nodes WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown node {digest}")
+        return self._row_to_node(row)
+
+    def resolve(self, prefix):
+        """Full hash for a unique hash prefix."""
+        with self._lock:
+            rows = self._db.execute("SELECT hash FROM nodes WHERE hash LIKE ? LIMIT 2", (prefix + "%",)).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"{'Ambiguous' if rows else 'Unknown'} node prefix {prefix}")
+        return rows[0]["hash"]
+
+    def path(self, digest):
+        """Nodes from the introduction down to digest, in story order."""
+        with self._lock:
+            rows = self._db.execute(
+                "WITH RECURSIVE lineage(hash, parent, depth) AS ("
+                " SELECT hash, parent, depth FROM nodes WHERE hash = ?"
+                " UNION ALL SELECT n.hash, n.parent, n.depth FROM nodes n JOIN lineage l ON n.hash = l.parent)"
+                " SELECT nodes.* FROM nodes JOIN lineage USING (hash) ORDER BY nodes.depth",
+                (digest,),
+            ).fetchall()
+        if not rows:
+            raise KeyError(f"Unknown node {digest}")
+        return [self._row_to_node(row) for row in rows]
+
+    def children(self, digest):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM nodes WHERE parent IS ? ORDER BY created", (digest,)).fetchall()
+        return [self._row_to_node(row) for row in rows]
+
+    def find_child(self, parent, user_input):
+        """The most recent stored turn that answered user_input after parent, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM nodes WHERE parent IS ? AND user_input = ? ORDER BY created DESC LIMIT 1", (parent, user_input)
+            ).fetchone()
+        return self._row_to_node(row) if row else None
+
+    def create_session(self, user_name, user_background, head=None):
+        session_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO sessions (id, user_name, user_background, head, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, user_name, user_background, head, now, now),
+            )
+        return session_id
+
+    def set_head(self, session_id, head):
+        with self._lock, self._db:
+            self._db.execute("UPDATE sessions SET head = ?, updated = ? WHERE id = ?", (head, time.time(), session_id))
+
+    def session(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown session {session_id}")
+        return dict(row)
+
+    def delete_session(self, session_id):
+        """Forget session_id; its turns stay in the tree (other sessions may share them)."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sessions(self):
+        with self._lock:
+            return [dict(row) for row in self._db.execute("SELECT * FROM sessions ORDER BY updated DESC")]
+
+    def fork(self, session_id, head=None):
+        """New session starting at head (default: session_id's head); returns its id."""
+        source = self.session(session_id)
+        return self.create_session(source["user_name"], source["user_background"], head or source["head"])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
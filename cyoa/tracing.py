@@ -0,0 +1,247 @@
+import contextvars
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Span of the agent call or turn running in the current thread/context. ThreadPoolExecutor does not copy
+# context, so fan-outs submit through contextvars.copy_context().run to keep parent links.
+_current_span = contextvars.ContextVar("cyoa_current_span", default=None)
+_span_ids = itertools.count(1)
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Span:
+    """One timed unit of work (a turn, a stage or an agent call) with free-form attributes."""
+
+    def __init__(self, name, parent=None, attributes=None, queued_at=None):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+        self.error = None
+        if queued_at is not None:
+            self.attributes["queue_time"] = max(0.0, self._start - queued_at)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key, amount=1):
+        """Increment a numeric attribute (e.g. retries)."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+
+    def as_dict(self):
+        return {
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "start_time": self.start_time, "duration": self.duration, "status": self.status, "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Creates spans and hands every finished span to its exporters. With no exporters spans are
+    still timed (cheap) but dropped, so instrumented code never has to check whether tracing is on.
+    """
+
+    def __init__(self, exporters=None):
+        self.exporters = list(exporters or [])
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def current(self):
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name, queued_at=None, **attributes):
+        """Run the body inside a child span of the current one; yields the Span."""
+        span = Span(name, parent=_current_span.get(), attributes=attributes, queued_at=queued_at)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+        else:
+            span.finish()
+        finally:
+            _current_span.reset(token)
+            self._export(span)
+
+    def annotate(self, **attributes):
+        """Set attributes on the current span, if any."""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                pass  # instrumentation must never break a turn
+
+
+def record_response(span, resp):
+    """Copy the HTTP status, the OpenAI `usage` token counts and completion cache hits of resp onto span."""
+    if span is None or resp is None:
+        return
+    span.set(status_code=resp.status_code)
+    if resp.status_code != 200:
+        return
+    if (getattr(resp, "headers", None) or {}).get("X-Cache") == "hit":
+        span.set(completion_cache="hit")
+    try:
+        usage = resp.json().get("usage") or {}
+    except ValueError:
+        return
+    record_usage(span, usage)
+
+
+def record_usage(span, usage):
+    """Copy the token counts of an OpenAI `usage` object (e.g. a stream's final usage chunk) onto span."""
+    if span is None:
+        return
+    if "prompt_tokens" in usage:
+        span.set(prompt_tokens=usage["prompt_tokens"], completion_tokens=usage.get("completion_tokens", 0))
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached is not None:
+            span.set(cached_tokens=cached)
+
+
+class InMemoryExporter:
+    """Keeps finished spans in a list; meant for tests and ad-hoc inspection."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name, **attributes):
+        with self._lock:
+            spans = list(self.spans)
+        return [s for s in spans if s.name == name and all(s.attributes.get(k) == v for k, v in attributes.items())]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per finished span to path."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, span):
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusExporter:
+    """
+    Aggregates spans into Prometheus metrics labelled by span name and status: a duration histogram,
+    queue time, scheduler wait, retries and prompt/completion tokens. render() returns the text
+    exposition; serve() exposes it on /metrics.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="cyoa"):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, status) -> [bucket counts..., count, sum]
+        self._counters = {}  # (metric, name) -> value
+        self.server = None
+
+    def export(self, span):
+        key = (span.name, span.status)
+        with self._lock:
+            hist = self._histograms.setdefault(key, [0] * (len(self.buckets) + 2) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    hist[i] += 1
+            hist[len(self.buckets)] += 1  # +Inf
+            hist[len(self.buckets) + 1] += 1  # count
+            hist[len(self.buckets) + 2] += span.duration
+            for metric, attribute in [("retries_total", "retries"), ("queue_seconds_total", "queue_time"),
+                                      ("prompt_tokens_total", "prompt_tokens"), ("completion_tokens_total", "completion_tokens"),
+                                      ("cached_tokens_total", "cached_tokens"), ("scheduler_wait_seconds_total", "scheduler_wait")]:
+                value = span.attributes.get(attribute)
+                if value:
+                    self._counters[(metric, span.name)] = self._counters.get((metric, span.name), 0) + value
+
+    def render(self):
+        p = self.prefix
+        with self._lock:
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = [f"# HELP {p}_span_duration_seconds Duration of turns, stages and agent calls", f"# TYPE {p}_span_duration_seconds histogram"]
+        for (name, status), hist in sorted(histograms.items()):
+            labels = f'span="{name}",status="{status}"'
+            for i, bound in enumerate(self.buckets):
+                lines.append(f'{p}_span_duration_seconds_bucket{{{labels},le="{bound}"}} {hist[i]}')
+            lines.append(f'{p}_span_duration_seconds_bucket{{{labels},le="+Inf"}} {hist[len(self.buckets)]}')
+            lines.append(f"{p}_span_duration_seconds_count{{{labels}}} {hist[len(self.buckets) + 1]}")
+            lines.append(f"{p}_span_duration_seconds_sum{{{labels}}} {hist[len(self.buckets) + 2]}")
+        for metric in sorted({metric for metric, _ in counters}):
+            lines.append(f"# TYPE {p}_{metric} counter")
+            for (m, name), value in sorted(counters.items()):
+                if m == metric:
+                    lines.append(f'{p}_{metric}{{span="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve render() on http://host:port/metrics from a daemon thread; returns the server."""
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
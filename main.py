@@ -13,12 +13,11 @@ def main():
     # Use Hugging Face repo path directly for vllm
     model_path = "NousResearch/Meta-Llama-3-8B-Instruct"
 
-    # Spawn vllm servers for overall agent and each character
+    # All agents use the same model, so one shared vllm server serves them all; roles differ only by prompt
     names = ['Alice', 'Bob', 'Eve']
-    num_servers = 1 + len(names)
-    managers, urls = spawn_vllm_servers(model_path, num_servers)
+    managers, urls = spawn_vllm_servers(model_path, 1)
     overall_agent = OverallAgent(server_url=urls[0])
-    character_agents = [CharacterAgent(name, server_url=urls[i+1]) for i, name in enumerate(names)]
+    character_agents = [CharacterAgent(name, server_url=urls[0]) for name in names]
     allocator = ResponseAllocator()
 
     # Example adventure prompt
@@ -1,98 +1,191 @@
 
 
 import sys
-import logging
 import argparse
+import logging
 from cyoa.agent_orchestrator import AgentOrchestrator, get_user_character_info
+from cyoa.backend_pool import BackendTopology
+from cyoa.backend_metrics import prefix_cache_delta
+from cyoa.completion_cache import CompletionCache, is_deterministic
+from cyoa.event_log import setup_logging
+from cyoa.request_scheduler import RequestScheduler
+from cyoa.story_session import StorySession
+from cyoa.story_store import StoryStore
+from cyoa.tracing import JsonLinesExporter, PrometheusExporter, Tracer
+from scripts.resource_allocator import add_server_arguments, allocator_from_args
+
+
+def make_stream_printer():
+    """Return (on_token, streamed) where on_token writes storyteller prose to the terminal as it arrives."""
+    streamed = []
+
+    def on_token(delta):
+        # Write straight to stdout so the prose appears as it arrives
+        if not streamed:
+            sys.stdout.write("\n[Story Update]\n")
+        streamed.append(delta)
+        sys.stdout.write(delta)
+        sys.stdout.flush()
+
+    return on_token, streamed
+
+
+def show_story(story, streamed):
+    """Print whatever part of the story was not already streamed (e.g. integrated character replies)."""
+    streamed_text = "".join(streamed)
+    if streamed_text and story.startswith(streamed_text):
+        print(f"{story[len(streamed_text):]}\n")
+    else:
+        print(f"\n[Story Update]\n{story}\n")
 
 
 def main():
 
     parser = argparse.ArgumentParser(description="LLM CYOA")
     parser.add_argument('--debug', action='store_true', help='Print debug info to console as well as log')
+    parser.add_argument('--no-stream', action='store_true', help='Wait for the full storyteller response instead of streaming it')
+    parser.add_argument('--shared-backend', action='store_true', help='Serve storyteller, director and characters from one shared server')
+    parser.add_argument('--replicas', type=int, default=1, help='Number of shared server replicas (with --shared-backend)')
+    parser.add_argument('--character-replicas', type=int, default=1, help='Scale character servers up to this many under load (without --shared-backend)')
+    parser.add_argument('--replica-idle-timeout', type=float, default=300, help='Stop a character replica idle for this many seconds')
+    parser.add_argument('--backend', choices=['vllm', 'stub'], default='vllm', help="Model server to launch ('stub' is a CPU-only stand-in)")
+    parser.add_argument('--trace-file', help='Append a JSON line per turn and agent call span to this file')
+    parser.add_argument('--metrics-port', type=int, help='Serve per-stage Prometheus metrics on this port')
+    parser.add_argument('--choices', type=int, default=0, help='Have the storyteller offer this many numbered choices each turn')
+    parser.add_argument('--speculate', type=int, default=0, help='Pre-generate up to this many offered choices while you decide (with --choices)')
+    parser.add_argument('--save', metavar='DB', help='Save every turn to this SQLite story tree (resume and rewind need it)')
+    parser.add_argument('--resume', metavar='SESSION', help='Continue a session saved in --save instead of starting a new one')
+    parser.add_argument('--cache-dir', help='Keep completions of repeated deterministic requests in this directory')
+    parser.add_argument('--cache-all', action='store_true', help='Cache every completion, not only deterministic ones (replays and demos)')
+    parser.add_argument('--temperature', type=float, help='Sampling temperature for every agent (0 = greedy, so --cache-dir can reuse replies)')
+    parser.add_argument('--seed', type=int, help='Sampling seed for every agent (makes replies repeatable and cacheable)')
+    parser.add_argument('--max-in-flight', type=int, help='Cap concurrent requests per backend and run them by role priority')
+    parser.add_argument('--turn-deadline', type=float, help='Seconds a turn may spend retrying a failing backend')
+    parser.add_argument('--log-file', default='cyoa_debug.log', help='Debug log file (rotated at --log-max-bytes)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], default='DEBUG', help='Log file level (above DEBUG skips the per-turn prefix cache scrape)')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help='Rotate the log file at this size')
+    parser.add_argument('--log-json', action='store_true', help='Write the log as JSON lines')
+    parser.add_argument('--redact-prompts', action='store_true', help='Log prompt/response hashes and lengths instead of their text')
+    add_server_arguments(parser)
     args = parser.parse_args()
+    if args.resume and not args.save:
+        parser.error('--resume needs --save')
+    sampling = {key: value for key, value in (('temperature', args.temperature), ('seed', args.seed)) if value is not None}
+    if args.cache_dir and not args.cache_all and not is_deterministic(sampling):
+        parser.error('--cache-dir only stores deterministic replies; add --temperature 0 or --seed N (or --cache-all)')
 
-    handlers = [logging.FileHandler("cyoa_debug.log")]
-    if args.debug:
-        handlers.append(logging.StreamHandler(sys.stdout))
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='[%(levelname)s] %(message)s',
-        handlers=handlers
-    )
-    logger = logging.getLogger("cyoa")
-    logger.setLevel(logging.DEBUG)
+    # Log records are formatted and written on a background thread, off the turn loop
+    log_setup = setup_logging(args.log_file, level=getattr(logging, args.log_level), console=args.debug, max_bytes=args.log_max_bytes, redact_prompts=args.redact_prompts, json_lines=args.log_json)
+    logger = log_setup.logger
 
     print("Welcome to LLM CYOA!")
     print("Type your actions or dialogue. Type 'quit' to exit.")
+    if args.save:
+        print("Type '/rewind N' to go back to turn N (0 is the introduction) and try something else.")
     print("Example: 'Astra Vey asks Kael about the city.' or 'Astra Vey draws her sword.'\n")
 
-    # Get user character info interactively
-    user_name, user_background = get_user_character_info()
+    store = StoryStore(args.save) if args.save else None
+    if args.resume:
+        saved = store.session(args.resume)
+        user_name, user_background = saved["user_name"], saved["user_background"]
+    else:
+        # Get user character info interactively
+        user_name, user_background = get_user_character_info()
     print(f"\nYour character: {user_name}\nBackground: {user_background}\n")
 
-    # Model and GPU config (adjust as needed)
+    tracer = Tracer()
+    if args.trace_file:
+        tracer.add_exporter(JsonLinesExporter(args.trace_file))
+    if args.metrics_port:
+        tracer.add_exporter(PrometheusExporter()).serve(args.metrics_port)
+
+    # Ports are picked free; each backend gets a GPU from --devices (adjust the model as needed)
     model_path = "meta-llama/Llama-3.2-3B-Instruct"
+    allocator, server_options = allocator_from_args(args)
     orchestrator = AgentOrchestrator(
         model_path,
-        storyteller_gpu=0,
-        director_gpu=1,
-        character_gpu=2
+        topology=BackendTopology(
+            shared_backend=args.shared_backend,
+            shared_replicas=args.replicas,
+            backend=args.backend,
+            allocator=allocator,
+            server_options=server_options,
+            character_autoscale={"max_replicas": args.character_replicas, "idle_cooldown": args.replica_idle_timeout} if args.character_replicas > 1 else None,
+        ),
+        tracer=tracer,
+        turn_deadline=args.turn_deadline,
+        story_choices=args.choices,
+        speculative_branches=args.speculate,
+        scheduler=RequestScheduler(max_in_flight=args.max_in_flight) if args.max_in_flight else None,
+        sampling=sampling,
+        completion_cache=CompletionCache(directory=args.cache_dir, cache_all=args.cache_all) if args.cache_dir or args.cache_all else None
     )
     orchestrator.set_logger(logger)
-    orchestrator.start_storyteller_and_director()
-
-    user_inputs = []
+    session = None
     turn = 0
     max_turns = 5
     try:
-        # Generate and display the story introduction before prompting the user
-        print("\n[Progress] Generating story introduction...")
-        if args.debug:
-            orig_print = __builtins__.print
-            def debug_print(*args, **kwargs):
-                logger.debug(' '.join(str(a) for a in args))
-            __builtins__.print = debug_print
-        try:
-            story = orchestrator.interactive_story_loop(
-                user_name,
-                user_background,
-                [],  # No user input for the intro
-                max_turns=1
-            )
-        finally:
-            if args.debug:
-                __builtins__.print = orig_print
-        print(f"\n[Story Update]\n{story}\n")
+        # Inside the try so a backend that fails to start does not leave the others running
+        print("[Progress] Starting model servers...")
+        orchestrator.start_storyteller_and_director()
+
+        if args.resume:
+            # Rebuilt from the saved turns; nothing is regenerated
+            session = StorySession.resume(orchestrator, store, args.resume)
+        else:
+            session = StorySession(orchestrator, user_name, user_background, store=store)
+        if store is not None:
+            print(f"[Progress] Saving to {args.save} as session {session.session_id}")
+        if session.started:
+            show_story(session.story, [])
+        else:
+            # Generate and display the story introduction before prompting the user
+            print("\n[Progress] Generating story introduction...")
+            on_token, streamed = (None, []) if args.no_stream else make_stream_printer()
+            story = session.start(on_token=on_token)
+            show_story(story, streamed)
+            logger.debug("Turn timings: %s", session.history[-1]['timings'])
         # Now enter the user input loop
         while turn < max_turns:
-            user_input = input(f"\n--- Turn {turn+1} ---\nWhat does {user_name} do or say? ").strip()
+            hint = f" (1-{len(session.choices)} or your own action)" if session.choices else ""
+            user_input = input(f"\n--- Turn {turn+1} ---\nWhat does {user_name} do or say?{hint} ").strip()
             if user_input.lower() == 'quit':
                 print("Exiting story.")
                 break
-            user_inputs.append(user_input)
+            if user_input.startswith('/rewind'):
+                target = user_input[len('/rewind'):].strip()
+                try:
+                    session.rewind(int(target) if target.isdigit() else target)
+                except (IndexError, KeyError, RuntimeError) as e:
+                    print(f"Cannot rewind to {target!r}: {e}")
+                    continue
+                # Turn numbers follow the story: rewinding to turn N makes the next one N+1
+                turn = len(session.history) - 1
+                show_story(session.story, [])
+                continue
             print("\n[Progress] Generating story...")
-            if args.debug:
-                orig_print = __builtins__.print
-                def debug_print(*args, **kwargs):
-                    logger.debug(' '.join(str(a) for a in args))
-                __builtins__.print = debug_print
-            try:
-                story = orchestrator.interactive_story_loop(
-                    user_name,
-                    user_background,
-                    user_inputs[-1:],  # Only the latest input for this turn
-                    max_turns=1
-                )
-            finally:
-                if args.debug:
-                    __builtins__.print = orig_print
-            print(f"\n[Story Update]\n{story}\n")
+            on_token, streamed = (None, []) if args.no_stream else make_stream_printer()
+            # Scraping every backend's /metrics is only worth it when the deltas are logged
+            debug = logger.isEnabledFor(logging.DEBUG)
+            cache_before = orchestrator.prefix_cache_stats() if debug else None
+            # Continue from the session's story; only this turn's text is returned
+            story = session.advance(user_input, on_token=on_token)
+            show_story(story, streamed)
+            # Replayed and speculated turns make no storyteller call, so read the turn's own record
+            logger.debug("Turn timings: %s", session.history[-1]['timings'])
+            if debug:
+                for url, after in orchestrator.prefix_cache_stats().items():
+                    logger.debug("Prefix cache %s: %s", url, prefix_cache_delta(cache_before.get(url, {}), after))
             turn += 1
     except KeyboardInterrupt:
         print("\nSession interrupted. Exiting gracefully...")
     finally:
+        if session is not None:
+            session.close()
         orchestrator.stop_all()
+        if store is not None:
+            store.close()
+        log_setup.stop()
         print("\nThanks for playing!")
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+import os
+import socket
+import subprocess
+import threading
+
+
+class ResourceExhausted(RuntimeError):
+    """No device (or port in the configured range) is left to give a new server."""
+
+
+class PortInUse(RuntimeError):
+    """Something is already listening on the port a server was meant to bind."""
+
+
+def port_in_use(port, host="127.0.0.1"):
+    """True if a process accepts connections on host:port."""
+    try:
+        with socket.create_connection((host, port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def find_free_port(host="127.0.0.1"):
+    """A port the OS reports free right now (it can still be taken before the server binds it)."""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def detect_devices():
+    """GPU ids from CUDA_VISIBLE_DEVICES or `nvidia-smi -L`; [None] (CPU only) when there are none."""
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        devices = [d.strip() for d in visible.split(",") if d.strip() and d.strip() != "-1"]
+        return [int(d) if d.isdigit() else d for d in devices] or [None]
+    try:
+        out = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return [None]
+    count = sum(1 for line in out.splitlines() if line.startswith("GPU "))
+    return list(range(count)) or [None]
+
+
+def parse_devices(text):
+    """--devices value: "0,1,2", or "cpu" for servers without a GPU."""
+    if text.strip().lower() in ("", "cpu", "none"):
+        return [None]
+    return [int(d) if d.strip().isdigit() else d.strip() for d in text.split(",") if d.strip()]
+
+
+def listening_pids(port):
+    """
+    Pids of processes with a socket listening on port (Linux /proc); None when that cannot be
+    determined on this platform.
+    """
+    inodes = set()
+    readable = False
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                lines = f.read().splitlines()[1:]
+        except OSError:
+            continue
+        readable = True
+        for line in lines:
+            fields = line.split()
+            if len(fields) > 9 and fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                inodes.add(fields[9])
+    if not readable:
+        return None
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    pids = set()
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(f"/proc/{pid}/fd/{fd}") in targets:
+                    pids.add(int(pid))
+                    break
+            except OSError:
+                continue
+    return pids
+
+
+def process_group_pids(pgid):
+    """Pids in process group pgid (the launched server and any workers it forked)."""
+    pids = set()
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            if os.getpgid(int(pid)) == pgid:
+                pids.add(int(pid))
+        except OSError:
+            continue
+    return pids
+
+
+class Allocation:
+    """Port and device handed to one server; memory_fraction is its share of the device (None on CPU)."""
+
+    def __init__(self, port, device=None, memory_fraction=None):
+        self.port = port
+        self.device = device
+        self.memory_fraction = memory_fraction
+
+    def __repr__(self):
+        return f"Allocation(port={self.port}, device={self.device}, memory_fraction={self.memory_fraction})"
+
+
+class ResourceAllocator:
+    """
+    Hands out ports and devices to managed backend servers so several deployments can share a host.
+    Ports come from the OS (or port_range) and are never given out twice by one allocator. Devices
+    come from an inventory (default: detect_devices()); each GPU takes up to servers_per_device servers,
+    least-loaded first, and each gets memory_budget / servers_per_device of its memory. A None entry in
+    the inventory is a CPU slot with no limit (for the stub backend), loaded like any other entry.
+    """
+
+    def __init__(self, devices=None, servers_per_device=1, memory_budget=0.9, host="127.0.0.1", port_range=None):
+        self.devices = list(devices) if devices is not None else detect_devices()
+        self.servers_per_device = servers_per_device
+        self.memory_budget = memory_budget
+        self.host = host
+        self.port_range = port_range
+        self._ports = set()
+        self._load = {device: 0 for device in self.devices}
+        self._lock = threading.Lock()
+
+    def allocate_port(self):
+        with self._lock:
+            if self.port_range is not None:
+                for port in range(*self.port_range):
+                    if port not in self._ports and not port_in_use(port, self.host):
+                        self._ports.add(port)
+                        return port
+                raise ResourceExhausted(f"No free port in {self.port_range[0]}-{self.port_range[1] - 1}")
+            while True:
+                port = find_free_port(self.host)
+                if port not in self._ports:
+                    self._ports.add(port)
+                    return port
+
+    def allocate_device(self):
+        with self._lock:
+            open_slots = [d for d in self._load if d is None or self._load[d] < self.servers_per_device]
+            if not open_slots:
+                raise ResourceExhausted(
+                    f"All {len(self.devices)} devices already run {self.servers_per_device} server(s) each; "
+                    "raise servers_per_device or use a shared backend"
+                )
+            # Least-loaded first; a GPU wins a tie with the CPU slot
+            device = min(open_slots, key=lambda d: (self._load[d], d is None))
+            self._load[device] += 1
+            return device
+
+    def memory_fraction(self, device):
+        return None if device is None else round(self.memory_budget / self.servers_per_device, 3)
+
+    def allocate(self, device=False):
+        """A port plus a device (pass device=None for a CPU-only server)."""
+        port = self.allocate_port()
+        if device is False:
+            device = self.allocate_device()
+        return Allocation(port, device, self.memory_fraction(device))
+
+    def release(self, allocation):
+        with self._lock:
+            self._ports.discard(allocation.port)
+            if allocation.device in self._load:
+                self._load[allocation.device] = max(0, self._load[allocation.device] - 1)
+
+
+_default_allocator = None
+_default_lock = threading.Lock()
+
+
+def get_default_allocator():
+    """Process-wide allocator, so orchestrators created in one process never pick the same port."""
+    global _default_allocator
+    with _default_lock:
+        if _default_allocator is None:
+            _default_allocator = ResourceAllocator()
+        return _default_allocator
+
+
+def add_server_arguments(parser):
+    """Device inventory and vLLM tuning flags shared by the command-line entry points."""
+    parser.add_argument("--devices", type=parse_devices, help="GPUs backends may use, e.g. '0,1,2', or 'cpu' (default: detect)")
+    parser.add_argument("--servers-per-device", type=int, default=1, help="Backends packed onto one GPU; each gets an equal memory share")
+    parser.add_argument("--gpu-memory-utilization", type=float, help="Fraction of its GPU each vLLM backend may use (default: an equal share of 0.9)")
+    parser.add_argument("--max-model-len", type=int, help="vLLM context length")
+    parser.add_argument("--max-num-seqs", type=int, help="Sequences a backend runs at once")
+
+
+def allocator_from_args(args):
+    """(ResourceAllocator, server_options) for the flags added by add_server_arguments()."""
+    allocator = ResourceAllocator(devices=args.devices, servers_per_device=args.servers_per_device)
+    options = {"gpu_memory_utilization": args.gpu_memory_utilization, "max_model_len": args.max_model_len, "max_num_seqs": args.max_num_seqs}
+    return allocator, {key: value for key, value in options.items() if value is not None}
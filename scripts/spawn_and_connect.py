@@ -1,21 +1,79 @@
-import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from scripts.resource_allocator import Allocation, get_default_allocator
 from scripts.spawn_vllm_server import VLLMServerManager
-import time
+
+
+class StartupCoordinator:
+    """
+    Launch several servers at once and expose one readiness future per server.
+    Anything with start() and wait_until_ready(timeout) works (VLLMServerManager, CharacterBackendPool).
+    Total startup time is that of the slowest server, not the sum.
+    """
+
+    def __init__(self, servers, timeout=600):
+        self.servers = list(servers)
+        self.timeout = timeout
+        self.futures = []
+        self._executor = None
+
+    def start(self):
+        """Launch every server and return their readiness futures (same order as servers)."""
+        for server in self.servers:
+            server.start()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.servers)), thread_name_prefix="startup")
+        self.futures = [self._executor.submit(server.wait_until_ready, self.timeout) for server in self.servers]
+        self._executor.shutdown(wait=False)
+        return self.futures
+
+    def wait(self):
+        """Block until every server is ready; on the first failure, raise it without waiting for the rest."""
+        done, _ = wait(self.futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            future.result()
+        for future in self.futures:
+            future.result()
+        return True
+
+    async def wait_async(self):
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in self.futures))
+        return True
+
 
 # Utility to spawn N vllm servers and return their URLs
 
-def spawn_vllm_servers(model_path, num_servers, base_port=8000):
+def spawn_vllm_servers(model_path, num_servers, base_port=None, timeout=600, allocator=None, **manager_kwargs):
+    """
+    Launch num_servers copies of model_path and wait for all of them. Ports are base_port,
+    base_port + 1, ... if base_port is given, otherwise free ones from allocator; every server gets its
+    own device (and gpu_memory_utilization share) from the allocator's inventory.
+    """
+    allocator = allocator or get_default_allocator()
+    allocations = []
     managers = []
-    urls = []
-    for i in range(num_servers):
-        port = base_port + i
-        manager = VLLMServerManager(model_path, port)
-        started = manager.start()
-        if not started:
-            raise RuntimeError(f"Failed to start vllm server on port {port}")
-        managers.append(manager)
-        urls.append(f"http://127.0.0.1:{port}")
-        time.sleep(2)  # Give server time to warm up
+    try:
+        for i in range(num_servers):
+            if base_port is None:
+                allocation = allocator.allocate()
+            else:
+                device = allocator.allocate_device()
+                allocation = Allocation(None, device, allocator.memory_fraction(device))
+            allocations.append(allocation)
+            kwargs = dict(manager_kwargs)
+            if allocation.memory_fraction is not None:
+                kwargs.setdefault("gpu_memory_utilization", allocation.memory_fraction)
+            port = allocation.port if base_port is None else base_port + i
+            managers.append(VLLMServerManager(model_path, port, gpu=allocation.device, **kwargs))
+        urls = [manager.url for manager in managers]
+        coordinator = StartupCoordinator(managers, timeout=timeout)
+        coordinator.start()
+        coordinator.wait()
+    except Exception as e:
+        for manager in managers:
+            manager.stop()
+        for allocation in allocations:
+            allocator.release(allocation)
+        raise RuntimeError(f"Failed to start vllm servers on ports {[manager.port for manager in managers]}") from e
     return managers, urls
 
 # Usage example:
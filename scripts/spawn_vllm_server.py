@@ -1,14 +1,61 @@
+import os
 import subprocess
 import time
 import socket
 
+from scripts.resource_allocator import PortInUse, listening_pids, port_in_use, process_group_pids
+
+
+class BackendMismatch(RuntimeError):
+    """The server answering on a manager's port is not the one it launched (or serves another model)."""
+
+
+def wait_for_ready(url, timeout=600, is_alive=None, get=None, initial_interval=0.25, max_interval=5):
+    """
+    Probe {url}/v1/models with exponential backoff until it answers 200.
+    Fails early if is_alive() reports that the server process has exited.
+    """
+    import requests
+    get = get or requests.get
+    deadline = time.time() + timeout
+    interval = initial_interval
+    while True:
+        if is_alive is not None and not is_alive():
+            raise RuntimeError(f"Server at {url} exited before becoming ready")
+        try:
+            if get(f"{url}/v1/models", timeout=2).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise RuntimeError(f"Server not available at {url} after {timeout}s")
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
 class VLLMServerManager:
-    def __init__(self, model_path, port, host="127.0.0.1", gpu=None, log_file=None):
+    def __init__(self, model_path, port, host="127.0.0.1", gpu=None, log_file=None, enable_prefix_caching=False, backend="vllm", backend_args=None,
+                 gpu_memory_utilization=None, max_model_len=None, max_num_seqs=None):
+        """
+        backend: "vllm" runs `vllm serve`; "stub" runs scripts/stub_openai_server.py, a CPU-only
+        OpenAI-compatible stand-in. backend_args are appended to the command line.
+        gpu_memory_utilization, max_model_len, max_num_seqs: vLLM tuning flags (None = vLLM's default);
+        the stub honours max_num_seqs as its concurrency limit. Several servers packed on one GPU
+        each need a gpu_memory_utilization share that sums to less than 1.
+        """
         self.model_path = model_path
+        self.backend = backend
+        self.backend_args = list(backend_args or [])
         self.port = port
         self.host = host
         self.gpu = gpu
         self.log_file = log_file
+        # Reuse KV cache across requests sharing a prompt prefix (system prompts, the story so far)
+        self.enable_prefix_caching = enable_prefix_caching
+        self.gpu_memory_utilization = gpu_memory_utilization
+        self.max_model_len = max_model_len
+        self.max_num_seqs = max_num_seqs
         self.process = None
 
     def start(self):
@@ -19,11 +66,10 @@ class VLLMServerManager:
                 os.remove(self.log_file)
             except Exception:
                 pass
-        cmd = [
-            "vllm", "serve", self.model_path,
-            "--host", self.host,
-            "--port", str(self.port)
-        ]
+        if port_in_use(self.port, self.host):
+            # A stale server from an earlier run would otherwise answer our readiness probe
+            raise PortInUse(f"Port {self.port} on {self.host} is already in use; refusing to start {self.model_path} there")
+        cmd = self.build_command()
         env = os.environ.copy()
         if self.gpu is not None:
             env["CUDA_VISIBLE_DEVICES"] = str(self.gpu)
@@ -40,6 +86,61 @@ class VLLMServerManager:
         # Do not block waiting for server to start
         return True
 
+    def build_command(self):
+        if self.backend == "stub":
+            import sys
+            stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_openai_server.py")
+            cmd = [sys.executable, stub, self.model_path, "--host", self.host, "--port", str(self.port)]
+            if self.max_num_seqs:
+                cmd += ["--max-concurrency", str(self.max_num_seqs)]
+        elif self.backend == "vllm":
+            cmd = [
+                "vllm", "serve", self.model_path,
+                "--host", self.host,
+                "--port", str(self.port)
+            ]
+            if self.enable_prefix_caching:
+                cmd.append("--enable-prefix-caching")
+            for flag, value in (("--gpu-memory-utilization", self.gpu_memory_utilization), ("--max-model-len", self.max_model_len), ("--max-num-seqs", self.max_num_seqs)):
+                if value is not None:
+                    cmd += [flag, str(value)]
+        else:
+            raise ValueError(f"Unknown backend: {self.backend}")
+        return cmd + self.backend_args
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def process_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def wait_until_ready(self, timeout=600):
+        """Block until the server answers /v1/models, then verify_identity(); raises if the process exits first."""
+        wait_for_ready(self.url, timeout=timeout, is_alive=self.process_alive)
+        self.verify_identity()
+        return True
+
+    def verify_identity(self, get=None):
+        """
+        Check that the server on our port is the one we launched: /v1/models must list model_path and,
+        where /proc is available, the listening socket must belong to our process group.
+        Raises BackendMismatch otherwise.
+        """
+        import requests
+        get = get or requests.get
+        served = [model.get("id") for model in get(f"{self.url}/v1/models", timeout=5).json().get("data", [])]
+        if self.model_path not in served:
+            raise BackendMismatch(f"{self.url} serves {served}, not {self.model_path}")
+        if self.process is None:
+            return True
+        # The server is started in its own process group (setpgrp), so its pgid is its pid. An empty
+        # owner set means other processes' sockets are not visible to us; that is not a mismatch.
+        owners = listening_pids(self.port)
+        if owners and not owners & process_group_pids(self.process.pid):
+            raise BackendMismatch(f"{self.url} is answered by pid(s) {sorted(owners)}, not the server we launched (pid {self.process.pid})")
+        return True
+
     def is_running(self):
         try:
             with socket.create_connection((self.host, self.port), timeout=2):
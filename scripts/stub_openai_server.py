@@ -0,0 +1,353 @@
+"""
+Lightweight OpenAI-compatible stand-in for vLLM, for CPU-only tests and benchmarks.
+
+Implements /v1/models, /v1/chat/completions (with streaming and usage) and /metrics. Latency is
+simulated from a prefill cost per uncached prompt token plus a per-token decode latency, with a
+simple prompt-prefix cache so prefix-caching work can be measured. Output is scripted from the
+prompt: the storyteller writes prose with **bold** characters, the director answers with the
+spawn JSON for the bold names it is shown, characters answer in character.
+
+Usage:
+    python scripts/stub_openai_server.py --port 8999 --token-latency 0.01 --prefill-latency 0.0005
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOLD_NAME = re.compile(r"\*\*(.+?)\*\*")
+DEFAULT_CAST = ["Kael Darkhaven", "Elder Marrow", "Mira Quill", "Oren Vale", "Sable Finch", "Tamsin Reed"]
+
+
+class StubConfig:
+    def __init__(self, model="stub-model", token_latency=0.0, prefill_latency=0.0, max_concurrency=0, reject_when_busy=False,
+                 failure_rate=0.0, fail_first=0, failure_status=500, cast=None, cast_size=2, new_per_segment=0, story_tokens=120, seed=0, responses=None):
+        self.model = model
+        self.token_latency = token_latency  # seconds per generated token
+        self.prefill_latency = prefill_latency  # seconds per uncached prompt token
+        self.max_concurrency = max_concurrency  # 0 = unlimited
+        self.reject_when_busy = reject_when_busy  # 429 instead of queueing when at max_concurrency
+        self.failure_rate = failure_rate
+        self.fail_first = fail_first
+        self.failure_status = failure_status
+        self.cast = list(cast or DEFAULT_CAST)
+        self.cast_size = cast_size  # bold characters present in every storyteller segment
+        self.new_per_segment = new_per_segment  # extra characters introduced by each segment after the first
+        self.story_tokens = story_tokens  # length of a storyteller segment
+        self.seed = seed
+        self.responses = responses or {}  # role -> list of scripted replies, used in order
+
+
+def count_tokens(text):
+    return len(text.split())
+
+
+def message_text(messages):
+    return "\n".join(str(m.get("content") or "") for m in messages)
+
+
+def detect_role(messages):
+    system = " ".join(str(m.get("content") or "") for m in messages if m.get("role") == "system")
+    if "story director" in system:
+        return "director"
+    if "summarize stories" in system:
+        return "summarizer"
+    if "storyteller" in system:
+        return "storyteller"
+    return "character"
+
+
+class StubBackend:
+    """Response generation, latency model and counters shared by all request threads."""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(config.max_concurrency) if config.max_concurrency else None
+        self.random = random.Random(config.seed)
+        self.requests = 0
+        self.running = 0
+        self.peak_running = 0
+        self.prefix_queries = 0
+        self.prefix_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.introduced = 0
+        self.scripted = {role: list(replies) for role, replies in self.config.responses.items()}
+        self._recent_prompts = []
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.requests <= self.config.fail_first:
+                return True
+            return self.config.failure_rate > 0 and self.random.random() < self.config.failure_rate
+
+    def cached_tokens(self, prompt):
+        """Tokens of prompt covered by the longest common prefix with a recent prompt."""
+        with self.lock:
+            best = 0
+            for previous in self._recent_prompts:
+                n = 0
+                for a, b in zip(previous, prompt):
+                    if a != b:
+                        break
+                    n += 1
+                best = max(best, n)
+            self._recent_prompts.append(prompt)
+            del self._recent_prompts[:-64]
+            cached = count_tokens(prompt[:best]) if best else 0
+            total = count_tokens(prompt)
+            self.prefix_queries += total
+            self.prefix_hits += cached
+            self.prompt_tokens += total
+            return min(cached, total)
+
+    def generate(self, messages, max_tokens):
+        role = detect_role(messages)
+        with self.lock:
+            scripted = self.scripted.get(role)
+            if scripted:
+                return role, scripted.pop(0)
+        text = message_text(messages)
+        if role == "director":
+            return role, self._director(messages)
+        if role == "summarizer":
+            names = list(dict.fromkeys(BOLD_NAME.findall(text)))
+            return role, "In summary, " + ", ".join(f"**{n}**" for n in names) + " continue their journey."
+        if role == "storyteller":
+            story = self._story(text, max_tokens)
+            choices = re.search(r"exactly (\d+) numbered choices", text)
+            if choices:
+                story += "\n" + "\n".join(f"{i}. Take path {i}." for i in range(1, int(choices.group(1)) + 1))
+            return role, story
+        name = re.search(r"You are ([^.\n,]+)", text)
+        return role, f"{name.group(1) if name else 'I'} considers the scene and answers: I am with you."
+
+    def _director(self, messages):
+        text = message_text(messages)
+        user = re.search(r"The main character is (.+?)\.", text)
+        user = user.group(1) if user else None
+        only = re.search(r"Only consider these new characters: (.+?)\.", text)
+        story = text.rsplit("Story:", 1)[-1]  # the system prompt's own **examples** are not characters
+        names = [n.strip() for n in only.group(1).split(",")] if only else list(dict.fromkeys(BOLD_NAME.findall(story)))
+        return json.dumps([
+            {"spawn": True, "character_name": n, "character_prompt": f"You are {n}, a character in this story. Respond in character."}
+            for n in names if n != user
+        ])
+
+    def _story(self, text, max_tokens):
+        user = re.search(r"user character: \*\*(.+?)\*\*", text)
+        cast = self.config.cast
+        added = self.config.new_per_segment if "Story so far" in text else 0
+        with self.lock:
+            first_new = self.introduced
+            self.introduced += added
+        names = cast[:self.config.cast_size] + [cast[(self.config.cast_size + first_new + i) % len(cast)] for i in range(added)]
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        words = [f"**{user.group(1)}**" if user else "The traveler", "walks", "on."]
+        words += [f"**{name}** appears." for name in dict.fromkeys(names)]
+        filler = ["The", "wind", "carries", "rumors", "of", "the", "city", "of", "mirrors", "and", "old", "roads."]
+        i = int(digest[:8], 16)
+        while count_tokens(" ".join(words)) < min(self.config.story_tokens, max_tokens):
+            words.append(filler[i % len(filler)])
+            i += 1
+        return " ".join(words)
+
+    def metrics_text(self):
+        with self.lock:
+            lines = [
+                "# TYPE vllm:prefix_cache_queries_total counter",
+                f'vllm:prefix_cache_queries_total{{model_name="{self.config.model}"}} {float(self.prefix_queries)}',
+                "# TYPE vllm:prefix_cache_hits_total counter",
+                f'vllm:prefix_cache_hits_total{{model_name="{self.config.model}"}} {float(self.prefix_hits)}',
+                "# TYPE vllm:num_requests_running gauge",
+                f'vllm:num_requests_running{{model_name="{self.config.model}"}} {float(self.running)}',
+                "# TYPE vllm:prompt_tokens_total counter",
+                f'vllm:prompt_tokens_total{{model_name="{self.config.model}"}} {float(self.prompt_tokens)}',
+                "# TYPE vllm:generation_tokens_total counter",
+                f'vllm:generation_tokens_total{{model_name="{self.config.model}"}} {float(self.completion_tokens)}',
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend = None  # set on the subclass created by make_server
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": self.backend.config.model, "object": "model", "owned_by": "stub"}]})
+        elif self.path == "/metrics":
+            data = self.backend.metrics_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": {"message": f"Not found: {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        if self.path != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Not found: {self.path}"}})
+            return
+        backend = self.backend
+        if backend.should_fail():
+            self._send_json(backend.config.failure_status, {"error": {"message": "Injected failure"}})
+            return
+        slots = backend.slots
+        if slots is not None and not slots.acquire(blocking=not backend.config.reject_when_busy):
+            self._send_json(429, {"error": {"message": "Server busy"}}, headers={"Retry-After": "1"})
+            return
+        with backend.lock:
+            backend.running += 1
+            backend.peak_running = max(backend.peak_running, backend.running)
+        try:
+            self._complete(body)
+        finally:
+            with backend.lock:
+                backend.running -= 1
+            if slots is not None:
+                slots.release()
+
+    def _complete(self, body):
+        backend = self.backend
+        config = backend.config
+        messages = body.get("messages") or []
+        max_tokens = int(body.get("max_tokens") or 256)
+        prompt = message_text(messages)
+        prompt_tokens = count_tokens(prompt)
+        cached = backend.cached_tokens(prompt)
+        _, text = backend.generate(messages, max_tokens)
+        tokens = text.split(" ")[:max_tokens]
+        finish_reason = "length" if len(text.split(" ")) > max_tokens else "stop"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        with backend.lock:
+            backend.completion_tokens += len(tokens)
+        time.sleep(config.prefill_latency * (prompt_tokens - cached))
+        created = int(time.time())
+        completion_id = f"chatcmpl-stub-{backend.requests}"
+        if not body.get("stream"):
+            time.sleep(config.token_latency * len(tokens))
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": config.model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(payload):
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": config.model}
+        event(dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]))
+        for i, token in enumerate(tokens):
+            time.sleep(config.token_latency)
+            event(dict(base, choices=[{"index": 0, "delta": {"content": token if i == 0 else " " + token}, "finish_reason": None}]))
+        event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event(dict(base, choices=[], usage=usage))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up mid-stream are expected in tests
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    """Build (but do not start) a stub server; port=0 picks a free port."""
+    backend = StubBackend(config)
+    handler = type("BoundStubHandler", (StubHandler,), {"backend": backend})
+    server = StubServer((host, port), handler)
+    server.backend = backend
+    return server
+
+
+def start_in_thread(config=None, host="127.0.0.1", port=0):
+    """Start a stub server on a daemon thread; returns (server, base_url). Stop with server.shutdown()."""
+    server = make_server(config or StubConfig(), host=host, port=port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in backend for CPU-only testing and benchmarking")
+    parser.add_argument("model", nargs="?", default="stub-model", help="Model id reported by /v1/models")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="Seconds per uncached prompt token")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests served at once (0 = unlimited)")
+    parser.add_argument("--reject-when-busy", action="store_true", help="Answer 429 instead of queueing at max concurrency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability of an injected error response")
+    parser.add_argument("--fail-first", type=int, default=0, help="Fail the first N requests")
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--cast", default=",".join(DEFAULT_CAST), help="Comma-separated character names the storyteller introduces")
+    parser.add_argument("--cast-size", type=int, default=2, help="Bold characters present in every storyteller segment")
+    parser.add_argument("--new-per-segment", type=int, default=0, help="New characters introduced by each continuation")
+    parser.add_argument("--story-tokens", type=int, default=120, help="Length of a storyteller segment")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--responses", help="JSON file mapping role (storyteller/director/character/summarizer) to a list of scripted replies")
+    args = parser.parse_args(argv)
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    config = StubConfig(
+        model=args.model, token_latency=args.token_latency, prefill_latency=args.prefill_latency,
+        max_concurrency=args.max_concurrency, reject_when_busy=args.reject_when_busy, failure_rate=args.failure_rate,
+        fail_first=args.fail_first, failure_status=args.failure_status, cast=[c.strip() for c in args.cast.split(",") if c.strip()],
+        cast_size=args.cast_size, new_per_segment=args.new_per_segment, story_tokens=args.story_tokens, seed=args.seed, responses=responses,
+    )
+    server = make_server(config, host=args.host, port=args.port)
+    print(f"Stub OpenAI server for {args.model} running on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
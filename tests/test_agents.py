@@ -10,7 +10,7 @@ class TestAgents(unittest.TestCase):
         self.character_agents = [CharacterAgent(name, server_url=self.mock_url) for name in ['Alice', 'Bob', 'Eve']]
         self.allocator = ResponseAllocator()
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_generate_response(self, mock_post):
         mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
@@ -22,7 +22,7 @@ class TestAgents(unittest.TestCase):
         self.assertIn("Bob says something.", response)
         self.assertIn("Eve says something.", response)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_generate_dialogue(self, mock_post):
         mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {
@@ -0,0 +1,29 @@
+import unittest
+from cyoa.backend_metrics import parse_prometheus_text, prefix_cache_delta, prefix_cache_stats
+
+METRICS_V1 = """# HELP vllm:prefix_cache_queries_total Prefix cache queries, in terms of number of queried tokens.
+# TYPE vllm:prefix_cache_queries_total counter
+vllm:prefix_cache_queries_total{engine="0",model_name="m"} 1000.0
+vllm:prefix_cache_hits_total{engine="0",model_name="m"} 600.0
+vllm:num_requests_running{model_name="m"} 2.0
+"""
+
+
+class TestBackendMetrics(unittest.TestCase):
+    def test_parse_and_hit_rate(self):
+        metrics = parse_prometheus_text(METRICS_V1)
+        self.assertEqual(metrics["vllm:num_requests_running"], 2.0)
+        self.assertEqual(prefix_cache_stats(metrics), {"queries": 1000.0, "hits": 600.0, "hit_rate": 0.6})
+
+    def test_legacy_gauge(self):
+        metrics = parse_prometheus_text('vllm:gpu_prefix_cache_hit_rate{model_name="m"} 0.25\n')
+        self.assertEqual(prefix_cache_stats(metrics)["hit_rate"], 0.25)
+
+    def test_delta(self):
+        before = {"queries": 1000.0, "hits": 600.0, "hit_rate": 0.6}
+        after = {"queries": 1500.0, "hits": 1050.0, "hit_rate": 0.7}
+        self.assertEqual(prefix_cache_delta(before, after), {"queries": 500.0, "hits": 450.0, "hit_rate": 0.9})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+import threading
+import unittest
+from contextlib import ExitStack, contextmanager
+from unittest.mock import MagicMock
+import requests
+from cyoa.backend_pool import CharacterBackendPool, ReplicaSet
+from cyoa.retry_policy import BackendUnavailable, deadline
+from scripts.resource_allocator import ResourceAllocator, port_in_use
+
+
+class FakeProcess:
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+class FakeManager:
+    instances = []
+
+    def __init__(self, model_path, port, host="127.0.0.1", gpu=None, log_file=None, **kwargs):
+        self.model_path = model_path
+        self.port = port
+        self.process = None
+        self.stopped = False
+        FakeManager.instances.append(self)
+
+    def start(self):
+        self.process = FakeProcess()
+        return True
+
+    def stop(self):
+        self.stopped = True
+        self.process = None
+
+
+class FakeClient:
+    """Answers /v1/models with 200 once `up` is set."""
+
+    def __init__(self, up=True):
+        self.up = up
+        self.probes = 0
+
+    def get(self, url, timeout=None):
+        self.probes += 1
+        if not self.up:
+            raise requests.exceptions.ConnectionError("refused")
+        resp = MagicMock()
+        resp.status_code = 200
+        return resp
+
+
+class TestCharacterBackendPool(unittest.TestCase):
+    def setUp(self):
+        FakeManager.instances = []
+        self.client = FakeClient()
+        self.pool = CharacterBackendPool("model", 9001, log_file=None, manager_factory=FakeManager, client=self.client)
+
+    def test_start_is_reused_across_calls(self):
+        first = self.pool.start()
+        for _ in range(3):
+            with self.pool.acquire() as url:
+                self.assertEqual(url, "http://127.0.0.1:9001")
+        self.assertIs(self.pool.start(), first)
+        self.assertEqual(len(FakeManager.instances), 1)
+
+    def test_restarts_when_process_exited(self):
+        first = self.pool.start()
+        first.process.returncode = 1
+        second = self.pool.start()
+        self.assertIsNot(first, second)
+        self.assertTrue(first.stopped)
+
+    def test_acquire_waits_for_a_launched_server(self):
+        self.client.up = False
+        threading.Timer(0.3, lambda: setattr(self.client, "up", True)).start()
+        with self.pool.acquire() as url:
+            self.assertEqual(url, "http://127.0.0.1:9001")
+            self.assertTrue(self.pool.is_ready())
+        probes = self.client.probes
+        with self.pool.acquire():
+            pass
+        self.assertEqual(self.client.probes, probes)  # readiness is only checked after a launch
+        FakeManager.instances[0].process.returncode = 1
+        self.client.up = False
+        with deadline(0.3), self.assertRaises(BackendUnavailable):
+            with self.pool.acquire():
+                pass
+        self.assertEqual(self.pool.in_flight, 0)
+
+    def test_in_flight_tracking_and_shutdown(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with self.pool.acquire():
+                entered.set()
+                release.wait(5)
+
+        worker = threading.Thread(target=hold)
+        worker.start()
+        entered.wait(5)
+        self.assertEqual(self.pool.in_flight, 1)
+        threading.Timer(0.1, release.set).start()
+        self.pool.shutdown(drain_timeout=5)
+        worker.join(5)
+        self.assertEqual(self.pool.in_flight, 0)
+        self.assertTrue(FakeManager.instances[0].stopped)
+        with self.assertRaises(RuntimeError):
+            self.pool.start()
+
+
+class FakePool:
+    """CharacterBackendPool stand-in whose health and process liveness the test controls."""
+
+    def __init__(self, model_path, port, host="127.0.0.1", gpu=None, log_file=None, client=None, manager_kwargs=None):
+        self.port = port
+        self.gpu = gpu
+        self.manager_kwargs = manager_kwargs or {}
+        self.url = f"http://{host}:{port}"
+        self.manager = None
+        self.healthy = True
+        self.alive = True
+        self.stopped = False
+
+    def start(self):
+        return None
+
+    def wait_until_ready(self, timeout=600):
+        return True
+
+    def process_alive(self):
+        return self.alive
+
+    def check_health(self, timeout=2):
+        return self.healthy
+
+    @contextmanager
+    def acquire(self):
+        yield self.url
+
+    def shutdown(self, drain_timeout=10):
+        self.stopped = True
+
+
+class TestReplicaSet(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.allocator = ResourceAllocator(devices=[None])
+
+    def make(self, **kwargs):
+        options = dict(min_replicas=1, max_replicas=2, scale_up_outstanding=2, scale_up_after=5, idle_cooldown=60,
+                       unhealthy_after=2, check_interval=None, start_timeout=5)
+        options.update(kwargs)
+        replicas = ReplicaSet("model", allocator=self.allocator, log_file=None, pool_factory=FakePool, clock=lambda: self.now, **options)
+        self.addCleanup(replicas.shutdown)
+        replicas.wait_until_ready()
+        return replicas
+
+    def settle(self, replicas):
+        """Wait for replicas launched in the background to come up."""
+        replicas.wait_until_ready(timeout=5)
+
+    def test_routes_to_least_outstanding_replica(self):
+        replicas = self.make(min_replicas=2)
+        with ExitStack() as held:
+            first = held.enter_context(replicas.acquire())
+            second = held.enter_context(replicas.acquire())
+            self.assertNotEqual(first, second)
+            self.assertEqual(replicas.in_flight, 2)
+        self.assertEqual(replicas.in_flight, 0)
+
+    def test_scales_up_on_sustained_load_and_down_when_idle(self):
+        replicas = self.make()
+        first_url = replicas.url
+        with ExitStack() as held:
+            held.enter_context(replicas.acquire())
+            held.enter_context(replicas.acquire())  # 2 outstanding: the load threshold
+            self.assertEqual(len(replicas.urls), 1)  # not sustained yet
+            self.now = 6
+            held.enter_context(replicas.acquire())
+            self.settle(replicas)
+            self.assertEqual(len(replicas.urls), 2)
+            self.assertEqual(replicas.stats()["scale_ups"], 1)
+            self.now = 30
+            replicas.maintain()
+            self.assertEqual(len(replicas.urls), 2)  # busy replicas are never stopped
+        added = replicas.pools[1]
+        self.now = 100
+        replicas.maintain()
+        self.assertEqual(replicas.urls, [first_url])
+        self.assertTrue(added.stopped)
+        self.assertEqual(replicas.stats()["scale_downs"], 1)
+        self.assertNotIn(added.port, self.allocator._ports)
+
+    def test_failed_health_checks_take_replica_out_of_rotation(self):
+        replicas = self.make(min_replicas=2)
+        sick, well = replicas.pools
+        sick.healthy = False
+        replicas.maintain()
+        self.assertEqual(replicas.stats()["replicas"][0]["state"], "ready")  # one failure is tolerated
+        replicas.maintain()
+        self.assertEqual(replicas.stats()["ejections"], 1)
+        for _ in range(3):
+            with replicas.acquire() as url:
+                self.assertEqual(url, well.url)
+        sick.healthy = True
+        replicas.maintain()
+        self.assertEqual({r["state"] for r in replicas.stats()["replicas"]}, {"ready"})
+
+    def test_exited_replica_is_replaced(self):
+        replicas = self.make()
+        dead = replicas.pools[0]
+        dead.alive = False
+        replicas.maintain()
+        self.settle(replicas)
+        self.assertTrue(dead.stopped)
+        self.assertEqual(len(replicas.pools), 1)
+        self.assertNotEqual(replicas.url, dead.url)
+        self.assertEqual(replicas.stats()["replacements"], 1)
+
+    def test_no_healthy_replica_is_unavailable(self):
+        replicas = self.make(max_replicas=1)
+        replicas.pools[0].healthy = False
+        replicas.maintain()
+        replicas.maintain()
+        with self.assertRaises(BackendUnavailable):
+            with replicas.acquire():
+                pass
+
+    def test_replicas_get_devices_and_memory_share(self):
+        self.allocator = ResourceAllocator(devices=[0, 1], servers_per_device=2, memory_budget=0.8)
+        replicas = self.make(min_replicas=3, max_replicas=3)
+        self.assertEqual(sorted(pool.gpu for pool in replicas.pools), [0, 0, 1])
+        self.assertEqual({pool.manager_kwargs["gpu_memory_utilization"] for pool in replicas.pools}, {0.4})
+
+
+class TestStubReplicaSet(unittest.TestCase):
+    def test_launches_and_stops_stub_replicas(self):
+        replicas = ReplicaSet("stub-model", min_replicas=1, max_replicas=2, manager_kwargs={"backend": "stub"}, log_file=None,
+                              allocator=ResourceAllocator(devices=[None]), check_interval=None, start_timeout=30)
+        try:
+            replicas.wait_until_ready(timeout=30)
+            pool = replicas.pools[0]
+            self.assertTrue(pool.check_health())
+            with replicas.acquire() as url:
+                self.assertEqual(url, pool.url)
+        finally:
+            replicas.shutdown()
+        self.assertFalse(port_in_use(pool.port))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from cyoa.character_registry import CharacterRegistry
+
+
+class TestCharacterRegistry(unittest.TestCase):
+    def test_new_names_and_register(self):
+        registry = CharacterRegistry("Astra Vey")
+        text = "**Astra Vey** meets **Kael** and **Old Tom** the baker."
+        self.assertEqual(registry.new_names(text), ["Kael", "Old Tom"])
+        registry.register(["Kael", "Old Tom"], [{"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."}])
+        self.assertEqual(registry.characters, {"Kael": "You are Kael."})
+        self.assertIn("Old Tom", registry)
+        self.assertEqual(registry.new_names(text + " **Kael** waves."), [])
+
+    def test_present_uses_stored_prompts(self):
+        registry = CharacterRegistry("Astra Vey")
+        registry.register(["Kael", "Mira"], [
+            {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."},
+            {"spawn": True, "character_name": "Mira", "character_prompt": "You are Mira."},
+        ])
+        self.assertEqual(registry.present("Kael draws his sword."), [{"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."}])
+        self.assertEqual(registry.present("Nobody is here."), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.completion_cache import CachingClient, CompletionCache, cache_key, is_deterministic
+from cyoa.llm_client import LLMClient, build_chat_payload, chat_completions_url, message_content
+from cyoa.tracing import InMemoryExporter, Tracer, record_response
+from scripts.stub_openai_server import StubConfig, start_in_thread
+
+MESSAGES = [{"role": "user", "content": "Tell me about **Kael**."}]
+
+
+def body(text):
+    return {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": {"prompt_tokens": 5, "completion_tokens": 3}}
+
+
+class TestCompletionCache(unittest.TestCase):
+    def test_key_covers_sampling_but_not_transport(self):
+        payload = build_chat_payload("model", MESSAGES, 64, temperature=0)
+        self.assertEqual(cache_key(payload), cache_key(dict(payload, stream=True)))
+        self.assertNotEqual(cache_key(payload), cache_key(dict(payload, temperature=0.7)))
+        self.assertNotEqual(cache_key(payload), cache_key(dict(payload, model="other")))
+        self.assertTrue(is_deterministic(payload))
+        self.assertTrue(is_deterministic({"temperature": 0.8, "seed": 7}))
+        self.assertFalse(is_deterministic({}))
+        self.assertFalse(CompletionCache().cacheable({}))
+        self.assertTrue(CompletionCache(cache_all=True).cacheable({}))
+
+    def test_memory_lru(self):
+        cache = CompletionCache(max_entries=2)
+        cache.put("a", body("A"))
+        cache.put("b", body("B"))
+        cache.get("a")
+        cache.put("c", body("C"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a")["choices"][0]["message"]["content"], "A")
+        self.assertNotIn("usage", cache.get("c"))
+
+    def test_disk_tier_survives_restart_and_evicts_by_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CompletionCache(max_entries=1, directory=directory)
+            cache.put("a", body("A"))
+            cache.put("b", body("B"))
+            self.assertEqual(cache.get("a")["choices"][0]["message"]["content"], "A")  # from disk
+            size = cache.stats()["disk_bytes"] // 2
+
+            reopened = CompletionCache(directory=directory, max_bytes=2 * size)
+            self.assertEqual(reopened.stats()["disk_entries"], 2)
+            reopened.get("a")
+            reopened.put("c", body("C"))  # over budget: "b" is least recently used
+            self.assertEqual(sorted(os.listdir(directory)), ["a.json", "c.json"])
+            self.assertIsNone(reopened.get("b"))
+            self.assertLessEqual(reopened.stats()["disk_bytes"], 2 * size)
+
+
+class TestCachingClient(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = start_in_thread(StubConfig())
+        self.client = CachingClient(LLMClient(read_timeout=10), CompletionCache())
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_repeated_deterministic_requests_hit_the_cache(self):
+        first = self.client.chat(self.url, "stub-model", MESSAGES, 64, temperature=0)
+        second = self.client.chat(self.url, "stub-model", MESSAGES, 64, temperature=0)
+        self.assertEqual(self.server.backend.requests, 1)
+        self.assertEqual(message_content(second), message_content(first))
+        self.assertEqual(second.headers["X-Cache"], "hit")
+
+        tracer = Tracer([InMemoryExporter()])
+        with tracer.span("storyteller") as span:
+            record_response(span, second)
+        self.assertEqual(span.attributes["completion_cache"], "hit")
+        self.assertNotIn("completion_tokens", span.attributes)
+
+        # Sampled requests always reach the backend
+        self.client.chat(self.url, "stub-model", MESSAGES, 64)
+        self.client.chat(self.url, "stub-model", MESSAGES, 64)
+        self.assertEqual(self.server.backend.requests, 3)
+
+    def test_streams_are_cached_only_when_complete(self):
+        url = chat_completions_url(self.url)
+        payload = build_chat_payload("stub-model", MESSAGES, 64, seed=1)
+        stream = self.client.stream(url, payload)
+        next(stream)
+        stream.close()  # cancelled part-way: nothing is stored
+        self.assertEqual(self.client.cache.stats()["memory_entries"], 0)
+
+        text = "".join(self.client.stream(url, payload))
+        self.assertEqual(list(self.client.stream(url, payload)), [text])
+        self.assertEqual(message_content(self.client.post(url, payload)), text)
+        self.assertEqual(self.server.backend.requests, 2)
+
+
+class TestOrchestratorCaching(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = start_in_thread(StubConfig())
+        port = self.server.server_address[1]
+        self.make = lambda **kwargs: AgentOrchestrator("stub-model", storyteller_port=port, director_port=port, completion_cache=CompletionCache(), **kwargs)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sampling_setting_makes_turns_cacheable(self):
+        orchestrator = self.make(sampling={"temperature": 0})
+        streamed = []
+        first = orchestrator.generate_story_segment(MESSAGES, on_token=streamed.append)
+        second = orchestrator.generate_story_segment(MESSAGES)
+        self.assertEqual(second, first)
+        self.assertEqual(self.server.backend.requests, 1)
+        self.assertEqual(orchestrator.completion_cache.stats()["memory_entries"], 1)
+
+    def test_sampled_requests_are_not_cached(self):
+        with self.assertLogs("cyoa.orchestrator", "WARNING"):
+            orchestrator = self.make()
+        orchestrator.generate_story_segment(MESSAGES)
+        orchestrator.generate_story_segment(MESSAGES)
+        self.assertEqual(self.server.backend.requests, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import json
+import unittest
+import requests
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.director_output import IncrementalEntryParser, director_response_format, director_token_budget, parse_director_reply
+from tests.test_orchestrator import fake_response
+
+KAEL = {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."}
+MIRA = {"spawn": False, "character_name": "Mira", "character_prompt": "You are Mira."}
+
+
+class TestParseDirectorReply(unittest.TestCase):
+    def test_clean_and_wrapped_json(self):
+        self.assertEqual(parse_director_reply(json.dumps([KAEL, MIRA])), [KAEL, MIRA])
+        self.assertEqual(parse_director_reply(json.dumps({"characters": [KAEL]})), [KAEL])
+        self.assertEqual(parse_director_reply(json.dumps(KAEL)), [KAEL])
+        self.assertEqual(parse_director_reply("[]"), [])
+
+    def test_prose_and_code_fences(self):
+        self.assertEqual(parse_director_reply(f"Here you go:\n```json\n{json.dumps([KAEL])}\n```\nEnjoy!"), [KAEL])
+        self.assertEqual(parse_director_reply(f"Sure! {json.dumps([KAEL])} Let me know."), [KAEL])
+
+    def test_truncated_and_sloppy_entries(self):
+        truncated = json.dumps([KAEL, MIRA])[:-20]
+        self.assertEqual(parse_director_reply(truncated), [KAEL])
+        sloppy = '[{"spawn": "true", "name": "**Oren**"}, {"spawn": true}, "Kael"]'
+        self.assertEqual(parse_director_reply(sloppy), [{"spawn": True, "character_name": "Oren", "character_prompt": "You are a character."}])
+        self.assertEqual(parse_director_reply("No characters this time."), [])
+        self.assertEqual(parse_director_reply(None), [])
+
+    def test_budget_and_schema(self):
+        self.assertEqual(director_token_budget(0), director_token_budget(1))
+        self.assertLess(director_token_budget(2), director_token_budget(4))
+        self.assertLessEqual(director_token_budget(100), 2048)
+        response_format = director_response_format(3)
+        self.assertEqual(response_format["type"], "json_schema")
+        self.assertEqual(response_format["json_schema"]["schema"]["maxItems"], 3)
+
+
+class TestIncrementalEntryParser(unittest.TestCase):
+    def test_entries_emitted_as_objects_close(self):
+        tricky = {"spawn": True, "character_name": "Kael", "character_prompt": 'Say "}" and [wait] {ok}\\'}
+        reply = "Here:\n```json\n" + json.dumps([tricky, MIRA]) + "\n```"
+        parser = IncrementalEntryParser()
+        emitted = []
+        for i, ch in enumerate(reply):
+            for entry in parser.feed(ch):
+                emitted.append((i, entry))
+        self.assertEqual([entry for _, entry in emitted], [tricky, MIRA])
+        self.assertLess(emitted[0][0], reply.index("Mira"))
+        self.assertEqual(parser.reply, reply)
+
+    def test_bare_object_and_garbage(self):
+        self.assertEqual(IncrementalEntryParser().feed(json.dumps(KAEL)), [KAEL])
+        self.assertEqual(IncrementalEntryParser().feed('[{"spawn": true, oops}]'), [])
+
+
+class TestRunDirector(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model")
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        self.calls = []
+
+    def reply_with(self, *responses):
+        responses = list(responses)
+
+        def chat(base_url, messages, max_tokens, **params):
+            self.calls.append((max_tokens, params))
+            return responses.pop(0)
+
+        self.orchestrator.chat_with_retries = chat
+
+    def test_structured_request_with_budget(self):
+        self.reply_with(fake_response(200, "Spawning: " + json.dumps([KAEL])))
+        _, data = self.orchestrator.run_director("**Astra** meets **Kael** and **Mira**.", "Astra")
+        self.assertEqual(data, [KAEL])
+        max_tokens, params = self.calls[0]
+        self.assertEqual(max_tokens, director_token_budget(2))
+        self.assertEqual(params["response_format"]["json_schema"]["schema"]["maxItems"], 2)
+
+    def test_falls_back_when_response_format_is_rejected(self):
+        rejected = fake_response(400)
+        rejected.text = '{"error": "response_format json_schema is not supported"}'
+        self.reply_with(rejected, fake_response(200, json.dumps([KAEL])))
+        _, data = self.orchestrator.run_director("**Kael** waves.", "Astra", new_names=["Kael"])
+        self.assertEqual(data, [KAEL])
+        self.assertEqual([("response_format" in params) for _, params in self.calls], [True, False])
+        self.assertFalse(self.orchestrator.structured_director)
+
+    def test_other_bad_requests_keep_structured_output(self):
+        bad = fake_response(400)
+        bad.text = '{"error": "prompt is too long"}'
+        self.reply_with(bad, fake_response(200, json.dumps([KAEL])))
+        _, data = self.orchestrator.run_director("**Kael** waves.", "Astra", new_names=["Kael"])
+        self.assertEqual(data, [KAEL])
+        self.assertEqual([("response_format" in params) for _, params in self.calls], [True, False])
+        self.assertTrue(self.orchestrator.structured_director)
+
+    def test_streamed_bad_request_retries_once_without_response_format(self):
+        streamed_params = []
+
+        def chat_stream(base_url, messages, max_tokens, **params):
+            streamed_params.append("response_format" in params)
+            if "response_format" in params:
+                bad = requests.Response()
+                bad.status_code = 400
+                bad._content = b'{"error": "prompt is too long"}'
+                raise requests.exceptions.HTTPError(response=bad)
+            yield json.dumps([KAEL])
+
+        self.orchestrator.chat_stream = chat_stream
+        _, data = self.orchestrator.run_director("**Kael** waves.", "Astra", on_entry=lambda entry: None)
+        self.assertEqual(data, [KAEL])
+        self.assertEqual(streamed_params, [True, False])
+        self.assertTrue(self.orchestrator.structured_director)
+
+    def test_streamed_entries_are_dispatched_before_the_reply_ends(self):
+        reply = json.dumps([KAEL, MIRA, {"spawn": True, "character_name": "Oren", "character_prompt": "You are Oren."}])
+        progress = []
+
+        def chat_stream(base_url, messages, max_tokens, **params):
+            for i in range(0, len(reply), 5):
+                progress.append(i)
+                yield reply[i:i + 5]
+
+        seen = []
+        self.orchestrator.chat_stream = chat_stream
+        _, data = self.orchestrator.run_director("**Kael**, **Mira** and **Oren**.", "Astra", on_entry=lambda entry: seen.append((entry["character_name"], len(progress))))
+        self.assertEqual([entry["character_name"] for entry in data], ["Kael", "Mira", "Oren"])
+        first_dispatch = seen[0]
+        self.assertEqual(first_dispatch[0], "Kael")
+        self.assertLess(first_dispatch[1], len(progress))  # before the director finished
+
+    def test_stream_failure_falls_back_to_a_plain_request(self):
+        def chat_stream(base_url, messages, max_tokens, **params):
+            raise requests.exceptions.ConnectionError()
+            yield
+
+        self.orchestrator.chat_stream = chat_stream
+        self.reply_with(fake_response(200, json.dumps([KAEL])))
+        seen = []
+        _, data = self.orchestrator.run_director("**Kael** waves.", "Astra", on_entry=seen.append)
+        self.assertEqual(data, [KAEL])
+        self.assertEqual(seen, [KAEL])
+
+    def test_malformed_reply_does_not_fail_the_turn(self):
+        self.reply_with(fake_response(200, "I think Kael should appear"))
+        self.assertEqual(self.orchestrator.run_director("**Kael** waves.", "Astra")[1], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.event_log import agent_event, redact, setup_logging
+
+
+class Payload:
+    """Records which thread rendered it."""
+
+    def __init__(self):
+        self.rendered_in = []
+
+    def __str__(self):
+        self.rendered_in.append(threading.current_thread().name)
+        return "PROMPT TEXT"
+
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cyoa.log")
+        self.setup = None
+
+    def tearDown(self):
+        if self.setup:
+            self.setup.stop()
+        self.tmp.cleanup()
+
+    def read(self):
+        self.setup.stop()
+        self.setup = None
+        with open(self.path) as f:
+            return f.read()
+
+    def test_skipped_below_debug(self):
+        logger = logging.getLogger("cyoa.test.quiet")
+        logger.setLevel(logging.INFO)
+        payload = Payload()
+        agent_event(logger, "Character", "Prompt", payload, agent_name="Kael")
+        self.assertEqual(payload.rendered_in, [])
+
+    def test_formatted_on_writer_thread(self):
+        self.setup = setup_logging(self.path, logger_name="cyoa.test.lazy")
+        payload = Payload()
+        agent_event(self.setup.logger, "Character", "Prompt", payload, agent_name="Kael")
+        text = self.read()
+        self.assertIn("[Character (Kael)] Prompt:\nPROMPT TEXT", text)
+        self.assertNotIn("\033[", text)
+        self.assertNotIn(threading.current_thread().name, payload.rendered_in)
+
+    def test_redacted_json_lines(self):
+        self.setup = setup_logging(self.path, logger_name="cyoa.test.json", redact_prompts=True, json_lines=True)
+        messages = [{"role": "user", "content": "secret plan"}]
+        agent_event(self.setup.logger, "Director", "Prompt", messages)
+        self.setup.logger.info("plain %s", "record")
+        lines = [json.loads(line) for line in self.read().splitlines()]
+        self.assertEqual(lines[0]["payload"], redact(messages))
+        self.assertEqual(lines[0]["payload"]["messages"], 1)
+        self.assertNotIn("secret", json.dumps(lines[0]))
+        self.assertEqual(lines[1]["message"], "plain record")
+
+    def test_rotation(self):
+        self.setup = setup_logging(self.path, logger_name="cyoa.test.rotate", max_bytes=200, backup_count=2)
+        for i in range(20):
+            self.setup.logger.debug("line %d %s", i, "x" * 40)
+        self.read()
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertLessEqual(os.path.getsize(self.path), 200)
+
+    def test_orchestrator_logs_through_configured_logger(self):
+        self.setup = setup_logging(self.path, logger_name="cyoa.test.orchestrator")
+        orchestrator = AgentOrchestrator("model")
+        orchestrator.set_logger(self.setup.logger)
+        orchestrator.log_agent("Storyteller", "Response", "Once upon a time")
+        self.assertIn("[Storyteller] Response:\nOnce upon a time", self.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
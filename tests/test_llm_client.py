@@ -0,0 +1,124 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from cyoa.llm_client import AsyncLLMClient, LLMClient, StreamStats, build_chat_payload
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    peers = set()
+    delay = 0
+    bodies = []
+
+    def do_POST(self):
+        ChatHandler.peers.add(self.client_address)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        ChatHandler.bodies.append(body)
+        time.sleep(ChatHandler.delay)
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for word in body["messages"][-1]["content"].split():
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self.wfile.write(b'data: {"choices": [], "usage": {"prompt_tokens": 4, "completion_tokens": 3}}\n\n')
+            self.wfile.write(b'data: [DONE]\n\n')
+            return
+        data = json.dumps({"choices": [{"message": {"content": body["messages"][-1]["content"].upper()}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # The timeout test hangs up before the reply is written
+
+
+class TestLLMClient(unittest.TestCase):
+    def setUp(self):
+        ChatHandler.peers = set()
+        ChatHandler.delay = 0
+        ChatHandler.bodies = []
+        self.server = QuietServer(("127.0.0.1", 0), ChatHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = LLMClient(connect_timeout=1, read_timeout=0.5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_build_chat_payload(self):
+        payload = build_chat_payload("m", [{"role": "user", "content": "x"}], 8, temperature=0)
+        self.assertEqual(payload, {"model": "m", "messages": [{"role": "user", "content": "x"}], "max_tokens": 8, "temperature": 0})
+        self.assertNotIn("model", build_chat_payload(None, [], 8))
+
+    def test_keep_alive_reuses_connection(self):
+        for i in range(5):
+            reply = self.client.chat_content(self.url, "m", [{"role": "user", "content": f"hi {i}"}], 8)
+            self.assertEqual(reply, f"HI {i}")
+        self.assertEqual(len(ChatHandler.peers), 1)
+        self.assertIs(self.client.session_for(self.url + "/v1/models"), self.client.session_for(self.url))
+
+    def test_read_timeout(self):
+        ChatHandler.delay = 1
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.client.chat(self.url, "m", [{"role": "user", "content": "slow"}], 8)
+
+    def test_stream(self):
+        url = f"{self.url}/v1/chat/completions"
+        deltas = list(self.client.stream(url, build_chat_payload("m", [{"role": "user", "content": "once upon time"}], 8)))
+        self.assertEqual(deltas, ["once ", "upon ", "time "])
+
+    def test_stream_reports_usage(self):
+        url = f"{self.url}/v1/chat/completions"
+        usages = []
+        deltas = list(self.client.stream(url, build_chat_payload("m", [{"role": "user", "content": "once upon time"}], 8), on_usage=usages.append))
+        self.assertEqual(len(deltas), 3)
+        self.assertEqual(ChatHandler.bodies[-1]["stream_options"], {"include_usage": True})
+        self.assertEqual(usages, [{"prompt_tokens": 4, "completion_tokens": 3}])
+
+    def test_stream_stats(self):
+        stats = StreamStats()
+        for _ in range(3):
+            time.sleep(0.01)
+            stats.record_chunk()
+        stats.finish()
+        summary = stats.as_dict()
+        self.assertEqual(summary["chunks"], 3)
+        self.assertGreaterEqual(summary["ttft"], 0.01)
+        self.assertEqual(len(stats.inter_token_latencies), 2)
+        self.assertGreaterEqual(summary["total"], summary["ttft"])
+
+    def test_async_client(self):
+        async_client = AsyncLLMClient(self.client, max_workers=4)
+
+        async def run():
+            messages = [[{"role": "user", "content": name}] for name in ("a", "b", "c")]
+            return await asyncio.gather(*(async_client.chat_content(self.url, "m", m, 8) for m in messages))
+
+        try:
+            self.assertEqual(asyncio.run(run()), ["A", "B", "C"])
+        finally:
+            async_client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
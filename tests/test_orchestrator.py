@@ -0,0 +1,145 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import BackendTopology, CharacterBackendPool
+from cyoa.tracing import InMemoryExporter, Tracer
+from tests.test_backend_pool import FakeClient, FakeManager
+
+
+def fake_response(status_code, content=""):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = {"choices": [{"message": {"content": content}}]}
+    return resp
+
+
+class TestCharacterFanOut(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model", character_concurrency=4)
+        self.orchestrator.character_pool = CharacterBackendPool("model", 9001, log_file=None, manager_factory=FakeManager, client=FakeClient())
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        self.director_data = [
+            {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."},
+            {"spawn": True, "character_name": "Astra Vey", "character_prompt": "The user."},
+            {"spawn": True, "character_name": "Mira", "character_prompt": "You are Mira."},
+            {"spawn": False, "character_name": "Ghost"},
+            {"spawn": True, "character_name": "Oren", "character_prompt": "You are Oren."},
+        ]
+        self.story = "**Astra Vey** meets **Kael**, **Mira** and **Oren** at the gate."
+
+    def test_requests_run_concurrently_and_keep_order(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def post(url, payload):
+            name = payload["messages"][1]["content"].split(".")[0].replace("You are ", "")
+            with lock:
+                active.append(name)
+                peak.append(len(active))
+            # Finish in reverse order of submission
+            time.sleep({"Kael": 0.3, "Mira": 0.2, "Oren": 0.1}[name])
+            with lock:
+                active.remove(name)
+            if name == "Mira":
+                return fake_response(500)
+            return fake_response(200, f"{name} speaks.")
+
+        self.orchestrator.post_with_retries = post
+        responses = self.orchestrator.director_distribute_and_collect(self.story, self.director_data, "Astra Vey")
+        self.assertEqual(list(responses), ["Kael", "Mira", "Oren"])
+        self.assertEqual(responses["Kael"], "Kael speaks.")
+        self.assertEqual(responses["Mira"], "")
+        self.assertEqual(max(peak), 3)
+
+    def test_sequential_mode(self):
+        self.orchestrator.post_with_retries = MagicMock(return_value=fake_response(200, "hi"))
+        responses = self.orchestrator.director_distribute_and_collect(self.story, self.director_data, "Astra Vey", max_workers=1)
+        self.assertEqual(list(responses), ["Kael", "Mira", "Oren"])
+        self.assertEqual(self.orchestrator.post_with_retries.call_count, 3)
+
+    def test_characters_only_see_their_segments(self):
+        self.orchestrator.post_with_retries = MagicMock(return_value=fake_response(200, "hi"))
+        story = "**Kael** waits at the gate.\n\n**Mira** reads in the tower.\n\nKael opens the gate."
+        responses = self.orchestrator.director_distribute_and_collect(story, self.director_data, "Astra Vey")
+        # Oren is not in the scene: no request, empty reply
+        self.assertEqual(responses, {"Kael": "hi", "Mira": "hi", "Oren": ""})
+        seen = {call.args[1]["messages"][1]["content"]: call.args[1]["messages"][-1]["content"] for call in self.orchestrator.post_with_retries.call_args_list}
+        kael_view = next(v for k, v in seen.items() if k.startswith("You are Kael."))
+        self.assertEqual(kael_view, "**Kael** waits at the gate.\n\nKael opens the gate.")
+
+
+class TestStorytellerStreaming(unittest.TestCase):
+    def test_streamed_segment_is_forwarded_and_collected(self):
+        client = MagicMock()
+        client.stream.return_value = iter(["Once ", "**Kael** ", "waits."])
+        orchestrator = AgentOrchestrator("model", client=client)
+        exporter = InMemoryExporter()
+        orchestrator.tracer = Tracer([exporter])
+        seen = []
+        timings = {}
+        story = orchestrator.generate_story_segment([{"role": "user", "content": "go"}], on_token=seen.append, timings=timings)
+        self.assertEqual(story, "Once **Kael** waits.")
+        self.assertEqual(seen, ["Once ", "**Kael** ", "waits."])
+        self.assertIsNotNone(timings["ttft"])
+        self.assertIn("max_inter_token_latency", timings)
+        span = exporter.spans[-1]
+        self.assertEqual(span.attributes["completion_chunks"], 3)
+        self.assertEqual(span.attributes["ttft"], timings["ttft"])
+        self.assertFalse(hasattr(orchestrator, "turn_stats"))
+
+
+class TestPromptLayout(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model")
+
+    def assertSharedPrefix(self, first, second, static_messages):
+        self.assertEqual(first[:static_messages], second[:static_messages])
+
+    def test_static_content_leads_every_prompt(self):
+        o = self.orchestrator
+        intro = o.build_storyteller_prompt_with_user("Astra Vey", "A wanderer.")
+        turn1 = o.build_storyteller_continuation_prompt("Once.", "Look around.", "Astra Vey", "A wanderer.")
+        turn2 = o.build_storyteller_continuation_prompt("Once. Twice.", "Run.", "Astra Vey", "A wanderer.")
+        self.assertSharedPrefix(intro, turn1, 2)
+        self.assertTrue(turn2[-1]["content"].startswith("Story so far:\nOnce."))
+        self.assertTrue(turn2[-1]["content"].endswith("The user says: Run."))
+
+        director_a = o.build_director_prompt("Story A", "Astra Vey")
+        director_b = o.build_director_prompt("Story B", "Kael", new_names=["Mira"])
+        self.assertSharedPrefix(director_a, director_b, 1)
+        self.assertTrue(director_b[-1]["content"].endswith("Only consider these new characters: Mira."))
+
+        kael = o.build_character_prompt("Kael", "You are Kael.", "scene")
+        mira = o.build_character_prompt("Mira", "You are Mira.", "scene")
+        self.assertSharedPrefix(kael, mira, 1)
+
+
+class TestSharedBackend(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model", storyteller_port=8100, topology=BackendTopology(shared_backend=True, shared_replicas=2, shared_gpus=[None]))
+        for pool in self.orchestrator.character_pool.pools:
+            pool.manager_factory = FakeManager
+            pool.client = FakeClient()
+
+    def test_options_are_keyword_only(self):
+        with self.assertRaises(TypeError):
+            AgentOrchestrator("model", 8100)
+
+    def test_all_roles_share_replicas(self):
+        o = self.orchestrator
+        self.assertEqual(o.storyteller_url, o.director_url)
+        self.assertEqual(o.director_url, o.character_url)
+        self.assertEqual(o.character_pool.urls, ["http://127.0.0.1:8100", "http://127.0.0.1:8101"])
+        self.assertIsNone(o.storyteller_manager)
+        with o.backend('storyteller') as first, o.backend('character') as second:
+            # Least in-flight routing spreads concurrent requests across replicas
+            self.assertNotEqual(first, second)
+        o.stop_all()
+        self.assertTrue(all(m.stopped for m in FakeManager.instances[-2:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import threading
+import time
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.request_scheduler import RequestScheduler, SchedulerRejected, SchedulingClient, request_class, request_session
+from cyoa.retry_policy import deadline
+from cyoa.story_session import StorySession
+from cyoa.tracing import InMemoryExporter, Tracer
+from scripts.stub_openai_server import StubConfig, start_in_thread
+from tests.test_backend_pool import FakeManager
+
+URL = "http://127.0.0.1:9000/v1/chat/completions"
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RequestScheduler(max_in_flight=1, max_queue=4)
+        self.order = []
+        self.threads = []
+
+    def waiting(self):
+        return self.scheduler.stats()["backends"]["http://127.0.0.1:9000"]["waiting"]
+
+    def enqueue(self, klass, session):
+        """Queue a request from another thread and wait until it is in the queue."""
+        before = self.waiting()
+
+        def run():
+            with self.scheduler.slot(URL, klass, session):
+                self.order.append((klass, session))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        while self.waiting() == before:
+            time.sleep(0.001)
+
+    def drain(self):
+        self.scheduler.release(URL)
+        for thread in self.threads:
+            thread.join(5)
+
+    def test_priority_then_least_served_session(self):
+        self.scheduler.acquire(URL, "character", "a")
+        self.enqueue("character", "a")
+        self.enqueue("character", "b")
+        self.enqueue("director", "a")
+        self.enqueue("storyteller", "b")
+        self.drain()
+        # Within the character class, b (never served) goes ahead of a (served once)
+        self.assertEqual(self.order, [("storyteller", "b"), ("director", "a"), ("character", "b"), ("character", "a")])
+        stats = self.scheduler.stats()
+        self.assertEqual(stats["classes"]["character"]["admitted"], 3)
+        self.assertGreater(stats["classes"]["storyteller"]["wait_max"], 0)
+        self.assertEqual(stats["backends"]["http://127.0.0.1:9000"], {"in_flight": 0, "waiting": 0})
+
+    def test_grants_decay_and_closed_sessions_are_forgotten(self):
+        now = [0.0]
+        self.scheduler = RequestScheduler(max_in_flight=1, max_queue=4, grant_half_life=10, clock=lambda: now[0])
+        for _ in range(3):
+            with self.scheduler.slot(URL, "character", "a"):
+                pass
+        now[0] = 1000.0  # a's three grants have long decayed; b's one is recent
+        with self.scheduler.slot(URL, "character", "b"):
+            pass
+        self.scheduler.acquire(URL, "character", "c")
+        self.enqueue("character", "a")
+        self.enqueue("character", "b")
+        self.drain()
+        self.assertEqual(self.order, [("character", "a"), ("character", "b")])
+        self.scheduler.forget_session("a")
+        self.assertNotIn("a", [session for backend in self.scheduler._backends.values() for _, session in backend.grants])
+
+    def test_admission_control(self):
+        self.scheduler.acquire(URL, "storyteller", "a")
+        with self.assertRaises(SchedulerRejected):
+            self.scheduler.acquire(URL, "speculation", "a")  # background work is shed when saturated
+        for session in "bcde":
+            self.enqueue("character", session)
+        with self.assertRaises(SchedulerRejected):
+            self.scheduler.acquire(URL, "storyteller", "f")  # queue full
+        self.drain()
+        self.assertEqual(self.scheduler.stats()["classes"]["speculation"]["rejected"], 1)
+
+    def test_queued_request_gives_up_at_deadline(self):
+        self.scheduler.acquire(URL, "storyteller", "a")
+        with deadline(0.05), self.assertRaises(SchedulerRejected):
+            self.scheduler.acquire(URL, "character", "b")
+        self.assertEqual(self.waiting(), 0)
+        self.scheduler.release(URL)
+        self.assertEqual(self.scheduler.acquire(URL, "character", "b"), 0.0)
+
+    def test_context_supplies_class_and_session(self):
+        self.scheduler.acquire(URL)
+        with request_class("summarizer"), request_session("a"), self.assertRaises(SchedulerRejected):
+            self.scheduler.acquire(URL)
+        self.assertEqual(self.scheduler.stats()["classes"]["summarizer"]["rejected"], 1)
+
+
+class TestScheduledOrchestrator(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = start_in_thread(StubConfig(cast=["Kael", "Mira"], cast_size=2, token_latency=0.001, story_tokens=30))
+        port = self.server.server_address[1]
+        self.scheduler = RequestScheduler(max_in_flight=1)
+        self.exporter = InMemoryExporter()
+        self.orchestrator = AgentOrchestrator(
+            "stub-model", storyteller_port=port, director_port=port, character_port=port,
+            scheduler=self.scheduler, tracer=Tracer([self.exporter]),
+        )
+        self.orchestrator.character_pool = CharacterBackendPool("stub-model", port, log_file=None, manager_factory=FakeManager)
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_turns_run_through_the_scheduler(self):
+        self.assertIsInstance(self.orchestrator.client, SchedulingClient)
+        session = StorySession(self.orchestrator, "Astra Vey", "")
+        try:
+            session.start(on_token=lambda delta: None)
+            session.advance("Astra greets everyone.")
+        finally:
+            session.close()
+        classes = self.scheduler.stats()["classes"]
+        self.assertEqual(set(classes) & {"storyteller", "director", "character"}, {"storyteller", "director", "character"})
+        self.assertLessEqual(self.server.backend.peak_running, 1)
+        # The two characters queue behind each other; their waits are recorded on their spans
+        waits = [span.attributes.get("scheduler_wait", 0) for span in self.exporter.spans if span.name == "character"]
+        self.assertTrue(any(waits))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import socket
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import BackendTopology
+from scripts.resource_allocator import (
+    PortInUse, ResourceAllocator, ResourceExhausted, detect_devices, listening_pids, parse_devices, port_in_use,
+)
+from scripts.spawn_vllm_server import BackendMismatch, VLLMServerManager
+from scripts.stub_openai_server import StubConfig, start_in_thread
+
+
+class TestResourceAllocator(unittest.TestCase):
+    def test_ports_are_free_and_never_repeated(self):
+        allocator = ResourceAllocator(devices=[None])
+        ports = [allocator.allocate_port() for _ in range(5)]
+        self.assertEqual(len(set(ports)), 5)
+        self.assertFalse(any(port_in_use(port) for port in ports))
+
+    def test_port_range_skips_ports_in_use(self):
+        with socket.socket() as taken:
+            taken.bind(("127.0.0.1", 0))
+            taken.listen()
+            port = taken.getsockname()[1]
+            allocator = ResourceAllocator(devices=[None], port_range=(port, port + 2))
+            self.assertEqual(allocator.allocate_port(), port + 1)
+            with self.assertRaises(ResourceExhausted):
+                allocator.allocate_port()
+
+    def test_devices_are_packed_least_loaded_first(self):
+        allocator = ResourceAllocator(devices=[0, 1], servers_per_device=2, memory_budget=0.9)
+        allocations = [allocator.allocate() for _ in range(4)]
+        self.assertEqual([a.device for a in allocations], [0, 1, 0, 1])
+        self.assertEqual({a.memory_fraction for a in allocations}, {0.45})
+        with self.assertRaises(ResourceExhausted):
+            allocator.allocate_device()
+        allocator.release(allocations[1])
+        self.assertEqual(allocator.allocate_device(), 1)
+
+    def test_cpu_inventory_is_unlimited(self):
+        allocator = ResourceAllocator(devices=[None])
+        allocation = allocator.allocate()
+        self.assertIsNone(allocation.device)
+        self.assertIsNone(allocation.memory_fraction)
+        self.assertIsNone(allocator.allocate_device())
+
+    def test_mixed_inventory_uses_the_gpu_and_overflows_to_cpu(self):
+        allocator = ResourceAllocator(devices=[0, None])
+        self.assertEqual([allocator.allocate_device() for _ in range(4)], [0, None, None, None])
+        allocator = ResourceAllocator(devices=[0, None], servers_per_device=2)
+        self.assertEqual([allocator.allocate_device() for _ in range(4)], [0, None, 0, None])
+
+    def test_device_inventory_sources(self):
+        self.assertEqual(parse_devices("0, 2"), [0, 2])
+        self.assertEqual(parse_devices("cpu"), [None])
+        with mock.patch.dict(os.environ, {"CUDA_VISIBLE_DEVICES": "1,3"}):
+            self.assertEqual(detect_devices(), [1, 3])
+        with mock.patch.dict(os.environ, {"CUDA_VISIBLE_DEVICES": ""}):
+            self.assertEqual(detect_devices(), [None])
+
+    def test_listening_pids_finds_this_process(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            pids = listening_pids(sock.getsockname()[1])
+        if pids is None:
+            self.skipTest("/proc is not available")
+        self.assertIn(os.getpid(), pids)
+
+
+class TestServerIdentity(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = start_in_thread(StubConfig(model="stub-model"))
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_build_command_passes_tuning_flags(self):
+        manager = VLLMServerManager("model", 8100, gpu_memory_utilization=0.3, max_model_len=4096, max_num_seqs=8)
+        command = manager.build_command()
+        for flag, value in (("--gpu-memory-utilization", "0.3"), ("--max-model-len", "4096"), ("--max-num-seqs", "8")):
+            self.assertEqual(command[command.index(flag) + 1], value)
+        stub = VLLMServerManager("model", 8100, backend="stub", max_num_seqs=8).build_command()
+        self.assertEqual(stub[stub.index("--max-concurrency") + 1], "8")
+
+    def test_refuses_to_start_on_a_port_in_use(self):
+        manager = VLLMServerManager("stub-model", self.port, backend="stub")
+        with self.assertRaises(PortInUse):
+            manager.start()
+        self.assertIsNone(manager.process)
+
+    def test_rejects_a_server_for_another_model(self):
+        with self.assertRaises(BackendMismatch):
+            VLLMServerManager("other-model", self.port).verify_identity()
+        self.assertTrue(VLLMServerManager("stub-model", self.port).verify_identity())
+
+    def test_rejects_a_port_answered_by_another_process(self):
+        if listening_pids(self.port) is None:
+            self.skipTest("/proc is not available")
+        manager = VLLMServerManager("stub-model", self.port)
+        # Stands in for a launched server that never bound the port (this process did)
+        manager.process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"], preexec_fn=os.setpgrp)
+        try:
+            with self.assertRaises(BackendMismatch):
+                manager.verify_identity()
+        finally:
+            manager.process.kill()
+            manager.process.wait()
+
+    def test_launched_stub_passes_identity_check(self):
+        allocator = ResourceAllocator(devices=[None])
+        manager = VLLMServerManager("stub-model", allocator.allocate_port(), backend="stub")
+        manager.start()
+        try:
+            self.assertTrue(manager.wait_until_ready(timeout=30))
+        finally:
+            manager.stop()
+
+
+class TestOrchestratorAllocation(unittest.TestCase):
+    def test_orchestrators_get_distinct_ports_and_devices(self):
+        allocator = ResourceAllocator(devices=[0, 1, 2, 3, 4, 5])
+        first = AgentOrchestrator("model", topology=BackendTopology(allocator=allocator))
+        second = AgentOrchestrator("model", topology=BackendTopology(allocator=allocator))
+        ports = [o.storyteller_port for o in (first, second)] + [o.director_port for o in (first, second)] + [o.character_port for o in (first, second)]
+        self.assertEqual(len(set(ports)), 6)
+        first.place_servers()
+        second.place_servers()
+        devices = [first.storyteller_manager.gpu, first.director_manager.gpu, first.character_pool.gpu,
+                   second.storyteller_manager.gpu, second.director_manager.gpu, second.character_pool.gpu]
+        self.assertEqual(sorted(devices), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(first.storyteller_manager.gpu_memory_utilization, 0.9)
+        self.assertEqual(first.character_pool.manager_kwargs["gpu_memory_utilization"], 0.9)
+        first.stop_all()
+        self.assertEqual(len({allocator.allocate_device() for _ in range(3)}), 3)
+
+    def test_explicit_ports_and_options_are_kept(self):
+        allocator = ResourceAllocator(devices=[0], servers_per_device=3)
+        orchestrator = AgentOrchestrator("model", storyteller_port=8100, topology=BackendTopology(allocator=allocator, server_options={"gpu_memory_utilization": 0.2}))
+        self.assertEqual(orchestrator.storyteller_url, "http://127.0.0.1:8100")
+        orchestrator.place_servers()
+        self.assertEqual({orchestrator.storyteller_manager.gpu, orchestrator.director_manager.gpu}, {0})
+        self.assertEqual(orchestrator.director_manager.gpu_memory_utilization, 0.2)
+
+    def test_stub_backend_needs_no_device(self):
+        orchestrator = AgentOrchestrator("model", topology=BackendTopology(shared_backend=True, shared_replicas=2, backend="stub", allocator=ResourceAllocator(devices=[0])))
+        orchestrator.place_servers()
+        self.assertEqual([pool.gpu for pool in orchestrator.character_pool.pools], [None, None])
+        self.assertNotEqual(orchestrator.character_pool.pools[0].port, orchestrator.character_pool.pools[1].port)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import random
+import time
+import unittest
+from unittest.mock import MagicMock
+import requests
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.llm_client import chat_completions_url
+from cyoa.retry_policy import BackendUnavailable, CircuitBreaker, CircuitOpenError, Retrier, RetryPolicy, deadline, parse_retry_after
+from scripts.spawn_and_connect import StartupCoordinator
+from scripts.stub_openai_server import StubConfig, start_in_thread
+from tests.test_stub_server import free_port
+
+URL = "http://127.0.0.1:9001/v1/chat/completions"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def response(status, retry_after=None):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return resp
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.retrier = Retrier(RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=4, rng=random.Random(1)), failure_threshold=3, reset_timeout=10, sleep=self.clock.sleep, clock=self.clock)
+
+    def run_responses(self, responses, **kwargs):
+        calls = []
+
+        def send(timeout):
+            calls.append(timeout)
+            item = responses.pop(0)
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+        return self.retrier.call(URL, send, **kwargs), calls
+
+    def test_retry_after_and_backoff(self):
+        self.assertEqual(parse_retry_after("2"), 2.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470.0), 10.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        policy = RetryPolicy(base_delay=1, max_delay=3, rng=random.Random(0))
+        self.assertTrue(all(0 <= policy.delay(10) <= 3 for _ in range(50)))
+        self.assertEqual(policy.delay(0, retry_after=2.5), 2.5)
+
+    def test_permanent_errors_are_not_retried(self):
+        resp, calls = self.run_responses([response(400), response(200)])
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(len(calls), 1)
+
+    def test_transient_errors_are_retried(self):
+        resp, calls = self.run_responses([requests.exceptions.ConnectionError(), response(429, "1"), response(200)])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(calls), 3)
+        self.assertGreaterEqual(self.clock.now, 1.0)  # the Retry-After floor
+        self.assertEqual(self.retrier.breaker(URL).state, CircuitBreaker.CLOSED)
+
+    def test_deadline_bounds_retries(self):
+        with deadline(1.0, clock=self.clock):
+            resp, calls = self.run_responses([response(503)] * 5, base_delay=0.6)
+        self.assertEqual(resp.status_code, 503)
+        self.assertLess(self.clock.now, 1.0)
+        self.assertLess(len(calls), 5)
+        self.assertTrue(all(timeout <= 1.0 for timeout in calls))
+
+    def test_unreachable_and_circuit_breaker(self):
+        with self.assertRaises(BackendUnavailable):
+            self.run_responses([requests.exceptions.ConnectionError()] * 3, max_attempts=3)
+        self.assertEqual(self.retrier.breaker(URL).state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.run_responses([response(200)])
+        self.clock.now += 10
+        resp, _ = self.run_responses([response(200)])  # half-open probe succeeds
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.retrier.breaker(URL).state, CircuitBreaker.CLOSED)
+        # Other backends have their own breaker
+        self.assertEqual(self.retrier.breaker("http://127.0.0.1:9002/v1").state, CircuitBreaker.CLOSED)
+
+    def test_probe_is_released_when_send_raises(self):
+        with self.assertRaises(BackendUnavailable):
+            self.run_responses([requests.exceptions.ConnectionError()] * 3, max_attempts=3)
+        self.clock.now += 10
+        # The half-open probe never reaches the backend (send raises before the request is made)
+        with self.assertRaises(RuntimeError):
+            self.run_responses([RuntimeError("request not sent")])
+        for _ in range(3):
+            self.clock.now += 100
+            resp, _ = self.run_responses([response(200)])
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.retrier.breaker(URL).state, CircuitBreaker.CLOSED)
+
+    def test_waiting_for_startup_uses_no_attempts(self):
+        waits = [True, True, True]
+        refused = [requests.exceptions.ConnectionError()] * 3
+        resp, calls = self.run_responses(refused + [response(200)], max_attempts=2, wait_ready=lambda timeout: waits.pop(0) if waits else False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(self.clock.now, 0.0)  # no backoff sleeps
+        self.assertEqual(self.retrier.breaker(URL).failures, 0)
+
+
+class SlowServer:
+    """Comes up on port a little after its readiness check starts, like a model server loading weights."""
+
+    def __init__(self, port):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = None
+
+    def start(self):
+        return True
+
+    def wait_until_ready(self, timeout=600):
+        time.sleep(0.3)
+        self.server, _ = start_in_thread(port=self.port)
+        return True
+
+
+class TestOrchestratorRetries(unittest.TestCase):
+    def test_context_overflow_is_not_retried(self):
+        server, url = start_in_thread(StubConfig(fail_first=1, failure_status=400))
+        try:
+            orchestrator = AgentOrchestrator("stub-model")
+            resp = orchestrator.post_with_retries(chat_completions_url(url), {"messages": [{"role": "user", "content": "hi"}]}, wait=0)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(server.backend.requests, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_refused_request_waits_for_starting_server(self):
+        port = free_port()
+        orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, retrier=Retrier(RetryPolicy(max_attempts=2, base_delay=0)))
+        starting = SlowServer(port)
+        orchestrator.startup = StartupCoordinator([starting])
+        orchestrator.startup.start()
+        try:
+            resp = orchestrator.chat_with_retries(orchestrator.storyteller_url, [{"role": "user", "content": "hi"}], 16)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(orchestrator.retrier.breaker(orchestrator.storyteller_url).failures, 0)
+        finally:
+            orchestrator.startup.wait()
+            starting.server.shutdown()
+            starting.server.server_close()
+
+    def test_unreachable_character_is_skipped(self):
+        port = free_port()
+        orchestrator = AgentOrchestrator("stub-model", character_port=port, retrier=Retrier(RetryPolicy(max_attempts=2, base_delay=0)))
+        orchestrator.log_agent = lambda *args, **kwargs: None
+        orchestrator.character_pool.start = lambda: None
+        self.assertEqual(orchestrator.ask_character("Kael", "You are Kael.", "**Kael** waves."), "")
+
+    def streaming_orchestrator(self, **config):
+        server, url = start_in_thread(StubConfig(**config))
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+        orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, director_port=port, retrier=Retrier(RetryPolicy(max_attempts=3, base_delay=0)))
+        orchestrator.log_agent = lambda *args, **kwargs: None
+        return server, orchestrator
+
+    def test_streamed_storyteller_retries_before_first_token(self):
+        server, orchestrator = self.streaming_orchestrator(fail_first=1, failure_status=503)
+        streamed = []
+        story = orchestrator.generate_story_segment([{"role": "user", "content": "Begin."}], on_token=streamed.append)
+        self.assertTrue(story)
+        self.assertEqual("".join(streamed), story)
+        self.assertEqual(server.backend.requests, 2)
+
+    def test_streamed_storyteller_gives_up_with_status(self):
+        _, orchestrator = self.streaming_orchestrator(fail_first=5, failure_status=503)
+        with self.assertRaisesRegex(RuntimeError, "503"):
+            orchestrator.generate_story_segment([{"role": "user", "content": "Begin."}], on_token=lambda delta: None)
+
+    def test_streamed_director_retries_before_first_entry(self):
+        server, orchestrator = self.streaming_orchestrator(fail_first=1, failure_status=429)
+        entries = []
+        reply, data = orchestrator.run_director("**Astra Vey** meets **Kael**.", "Astra Vey", on_entry=entries.append)
+        self.assertTrue(data)
+        self.assertTrue(entries)
+        self.assertEqual(server.backend.requests, 2)
+
+    def test_streamed_open_respects_circuit_breaker(self):
+        _, orchestrator = self.streaming_orchestrator()
+        url = orchestrator.storyteller_url + "/v1/chat/completions"
+        breaker = orchestrator.retrier.breaker(url)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            orchestrator.generate_story_segment([{"role": "user", "content": "Begin."}], on_token=lambda delta: None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.session_server import SessionManager, SessionServer
+from cyoa.story_store import StoryStore
+from scripts.stub_openai_server import StubConfig, start_in_thread
+from tests.test_backend_pool import FakeManager
+
+
+def read_events(resp):
+    """(event, data) pairs of a server-sent event stream."""
+    events, event = [], None
+    for line in resp.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            events.append((event, json.loads(line[len("data:"):])))
+    return events
+
+
+class TestSessionServer(unittest.TestCase):
+    def setUp(self):
+        self.backend, _ = start_in_thread(StubConfig(cast=["Kael"], cast_size=1, token_latency=0.001, story_tokens=40))
+        port = self.backend.server_address[1]
+        self.orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, director_port=port, character_port=port)
+        self.orchestrator.character_pool = CharacterBackendPool("stub-model", port, log_file=None, manager_factory=FakeManager)
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        self.now = [0.0]
+        self.store = StoryStore(":memory:")
+        self.manager = SessionManager(self.orchestrator, idle_timeout=60, store=self.store, clock=lambda: self.now[0])
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = asyncio.run_coroutine_threadsafe(SessionServer(self.manager, port=0).start(), self.loop).result(5)
+        self.url = f"http://127.0.0.1:{self.server.port}"
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.manager.close()
+        self.store.close()
+        self.backend.shutdown()
+        self.backend.server_close()
+
+    def create(self, name="Astra Vey"):
+        resp = requests.post(f"{self.url}/sessions", json={"user_name": name}, timeout=10)
+        self.assertEqual(resp.status_code, 201)
+        return resp.json()["session_id"]
+
+    def test_turns_stream_and_share_the_backend(self):
+        session_id = self.create()
+        resp = requests.post(f"{self.url}/sessions/{session_id}/turns", headers={"Accept": "text/event-stream"}, stream=True, timeout=10)
+        self.assertEqual(resp.headers["Content-Type"], "text/event-stream")
+        events = read_events(resp)
+        tokens = "".join(data["text"] for event, data in events if event == "token")
+        self.assertEqual(events[-1][0], "turn")
+        self.assertEqual(events[-1][1]["turn"], 0)
+        self.assertEqual(events[-1][1]["text"], tokens)
+
+        resp = requests.post(f"{self.url}/sessions/{session_id}/turns", json={"input": "Astra asks Kael for help."}, timeout=10)
+        self.assertEqual(resp.json()["turn"], 1)
+        state = requests.get(f"{self.url}/sessions/{session_id}", timeout=10).json()
+        self.assertEqual(state["turns"], 2)
+        self.assertEqual(state["cast"], ["Kael"])
+
+        # Several players at once, all on the one backend
+        ids = [self.create(f"Player {i}") for i in range(4)]
+        with ThreadPoolExecutor(4) as pool:
+            replies = list(pool.map(lambda sid: requests.post(f"{self.url}/sessions/{sid}/turns", json={}, timeout=10), ids))
+        self.assertEqual([r.status_code for r in replies], [200] * 4)
+        health = requests.get(f"{self.url}/health", timeout=10).json()
+        self.assertEqual((health["sessions"], health["active_turns"], health["completed_turns"]), (5, 0, 6))
+
+    def test_errors(self):
+        self.assertEqual(requests.post(f"{self.url}/sessions", json={}, timeout=10).status_code, 400)
+        self.assertEqual(requests.get(f"{self.url}/sessions/nope", timeout=10).status_code, 404)
+        self.assertEqual(requests.get(f"{self.url}/nowhere", timeout=10).status_code, 404)
+        session_id = self.create()
+        self.assertEqual(requests.post(f"{self.url}/sessions/{session_id}/turns", data="not json", timeout=10).status_code, 400)
+        requests.post(f"{self.url}/sessions/{session_id}/turns", json={}, timeout=10)
+        resp = requests.post(f"{self.url}/sessions/{session_id}/turns", json={}, timeout=10)
+        self.assertEqual((resp.status_code, resp.json()["error"]), (400, "input is required after the introduction"))
+        self.assertEqual(requests.delete(f"{self.url}/sessions/{session_id}", timeout=10).status_code, 204)
+
+    def test_idle_sessions_are_evicted_and_resumed_from_the_store(self):
+        session_id = self.create()
+        requests.post(f"{self.url}/sessions/{session_id}/turns", json={}, timeout=10)
+        story = requests.get(f"{self.url}/sessions/{session_id}", timeout=10).json()["story"]
+        self.now[0] += 61
+        self.assertEqual(self.manager.evict_idle(), 1)
+        self.assertNotIn(session_id, self.manager.sessions)
+        requests_before = self.backend.backend.requests
+        state = requests.get(f"{self.url}/sessions/{session_id}", timeout=10).json()
+        self.assertEqual(state["story"], story)
+        self.assertEqual(self.backend.backend.requests, requests_before)
+
+    def test_deleted_sessions_are_not_resumed(self):
+        session_id = self.create()
+        requests.post(f"{self.url}/sessions/{session_id}/turns", json={}, timeout=10)
+        self.assertEqual(requests.delete(f"{self.url}/sessions/{session_id}", timeout=10).status_code, 204)
+        self.assertEqual(requests.get(f"{self.url}/sessions/{session_id}", timeout=10).status_code, 404)
+        self.assertEqual(requests.post(f"{self.url}/sessions", json={"resume": session_id}, timeout=10).status_code, 404)
+        # An evicted session can be deleted too, and then stays gone
+        evicted = self.create("Player 2")
+        self.now[0] += 61
+        self.manager.evict_idle()
+        self.assertEqual(requests.delete(f"{self.url}/sessions/{evicted}", timeout=10).status_code, 204)
+        self.assertEqual(requests.get(f"{self.url}/sessions/{evicted}", timeout=10).status_code, 404)
+        self.assertEqual(self.store.sessions(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
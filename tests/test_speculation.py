@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.speculation import match_choice, parse_choices
+from cyoa.story_session import StorySession
+from scripts.stub_openai_server import StubConfig, start_in_thread
+from tests.test_backend_pool import FakeManager
+
+SEGMENT = "**Kael** points at the gate.\n\n1. Follow Kael.\n2. **Search** the ruins.\n3) Wait for nightfall"
+
+
+class TestChoices(unittest.TestCase):
+    def test_parse_choices(self):
+        self.assertEqual(parse_choices(SEGMENT), ["Follow Kael.", "**Search** the ruins.", "Wait for nightfall"])
+        self.assertEqual(parse_choices("No choices here.\n1. Not at the end.\nThe end."), [])
+        self.assertEqual(parse_choices(""), [])
+
+    def test_match_choice(self):
+        choices = parse_choices(SEGMENT)
+        self.assertEqual(match_choice("2", choices), 1)
+        self.assertEqual(match_choice(" 3. ", choices), 2)
+        self.assertEqual(match_choice("follow kael", choices), 0)
+        self.assertIsNone(match_choice("4", choices))
+        self.assertIsNone(match_choice("Astra climbs the wall.", choices))
+
+
+class TestSpeculativeBranches(unittest.TestCase):
+    def setUp(self):
+        self.server, _ = start_in_thread(StubConfig(cast=["Kael"], cast_size=1, token_latency=0.002, story_tokens=60))
+        port = self.server.server_address[1]
+        self.orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, director_port=port, character_port=port, story_choices=3, speculative_branches=3)
+        self.orchestrator.character_pool = CharacterBackendPool("stub-model", port, log_file=None, manager_factory=FakeManager)
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        self.session = StorySession(self.orchestrator, "Astra Vey", "")
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_picked_choice_is_served_from_its_branch(self):
+        self.session.start()
+        self.assertEqual(self.session.choices, ["Take path 1.", "Take path 2.", "Take path 3."])
+        for branch in self.session.speculator.branches:
+            branch.future.result(10)
+        streamed = []
+        self.session.advance("2", on_token=streamed.append)
+        timings = self.session.history[-1]["timings"]
+        self.assertTrue(timings["speculated"])
+        self.assertLess(timings["storyteller"], 0.05)
+        self.assertEqual(self.session.history[-1]["user_input"], "Take path 2.")
+        self.assertEqual(streamed, [self.session.history[-1]["segment"]])
+        self.assertEqual(self.session.speculator.hits, 1)
+        self.assertEqual(len(self.session.speculator.branches), 3)  # the next turn's choices
+
+    def test_free_text_cancels_branches(self):
+        self.session.start()
+        branches = list(self.session.speculator.branches)
+        self.session.advance("Astra climbs the wall.")
+        self.assertNotIn("speculated", self.session.history[-1]["timings"])
+        self.assertTrue(all(branch.cancelled.is_set() for branch in branches))
+        for branch in branches:
+            if not branch.future.cancelled():
+                result = branch.future.result(10)
+                self.assertTrue(result is None or result.startswith("**Astra Vey**"))
+
+    def test_cancel_stops_a_running_branch(self):
+        cancelled = threading.Event()
+        self.server.backend.config.token_latency = 0.05
+        self.orchestrator.client.read_timeout = 10
+        worker = threading.Thread(target=lambda: setattr(self, "result", self.orchestrator.speculate_story_segment(
+            self.orchestrator.build_storyteller_prompt_with_user("Astra Vey", ""), cancelled)))
+        worker.start()
+        time.sleep(0.3)
+        cancelled.set()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertIsNone(self.result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scripts.spawn_and_connect import StartupCoordinator
+from scripts.spawn_vllm_server import VLLMServerManager, wait_for_ready
+
+
+class WarmingUpHandler(BaseHTTPRequestHandler):
+    """Answers 503 until `ready_after` probes have been made."""
+    probes = 0
+    ready_after = 3
+
+    def do_GET(self):
+        WarmingUpHandler.probes += 1
+        self.send_response(200 if WarmingUpHandler.probes > WarmingUpHandler.ready_after else 503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SlowServer:
+    def __init__(self, delay, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def wait_until_ready(self, timeout):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("exited")
+        return True
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestStartup(unittest.TestCase):
+    def test_backoff_on_non_200(self):
+        WarmingUpHandler.probes = 0
+        server = ThreadingHTTPServer(("127.0.0.1", 0), WarmingUpHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            start = time.time()
+            self.assertTrue(wait_for_ready(f"http://127.0.0.1:{server.server_address[1]}", timeout=10, initial_interval=0.05))
+            # 3 refusals with 0.05 + 0.1 + 0.2s backoff, not a busy loop
+            self.assertEqual(WarmingUpHandler.probes, 4)
+            self.assertGreaterEqual(time.time() - start, 0.3)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_fails_early_when_process_exits(self):
+        manager = VLLMServerManager("model", free_port())
+        manager.process = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+        manager.process.wait()
+        start = time.time()
+        with self.assertRaises(RuntimeError):
+            manager.wait_until_ready(timeout=30)
+        self.assertLess(time.time() - start, 5)
+
+    def test_parallel_startup(self):
+        servers = [SlowServer(0.3) for _ in range(3)]
+        coordinator = StartupCoordinator(servers)
+        start = time.time()
+        futures = coordinator.start()
+        self.assertTrue(all(s.started for s in servers))
+        self.assertTrue(coordinator.wait())
+        self.assertLess(time.time() - start, 0.8)
+        self.assertTrue(all(f.result() for f in futures))
+
+    def test_first_failure_is_raised(self):
+        coordinator = StartupCoordinator([SlowServer(2), SlowServer(0.05, fail=True)])
+        coordinator.start()
+        start = time.time()
+        with self.assertRaises(RuntimeError):
+            coordinator.wait()
+        self.assertLess(time.time() - start, 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import threading
+import unittest
+from cyoa.story_context import StoryContext
+
+
+def count_words(text):
+    return len(text.split())
+
+
+class TestStoryContext(unittest.TestCase):
+    def test_recent_turns_fit_budget(self):
+        context = StoryContext(budgets={"storyteller": 10}, count_tokens=count_words)
+        for i in range(5):
+            context.add_turn(f"turn {i} happens")
+        rendered = context.render("storyteller")
+        self.assertEqual(rendered, "turn 2 happens\n\nturn 3 happens\n\nturn 4 happens")
+        self.assertLessEqual(count_words(rendered), 10)
+
+    def test_pending_is_always_included(self):
+        context = StoryContext(budgets={"character": 6}, count_tokens=count_words)
+        context.add_turn("old turn here")
+        self.assertEqual(context.render("character", pending="new segment now"), "old turn here\n\nnew segment now")
+        self.assertEqual(context.clip("a b c d e f g h", "character"), "c d e f g h")
+
+    def test_background_summary_replaces_old_turns(self):
+        release = threading.Event()
+        calls = []
+
+        def summarize(previous, text):
+            calls.append(text)
+            release.wait(5)
+            return "**Kael** joined."
+
+        budgets = {"storyteller": 12, "director": 12, "character": 12}
+        context = StoryContext(summarize=summarize, budgets=budgets, count_tokens=count_words, keep_recent=1)
+        for i in range(4):
+            context.add_turn(f"turn {i} goes on")
+        # Summary still running: render does not block and falls back to recent turns
+        self.assertNotIn("summary", context.render("storyteller"))
+        release.set()
+        context.wait_idle(5)
+        # Triggered once the third turn crossed 75% of the budget; one job in flight at a time
+        self.assertEqual(calls, ["turn 0 goes on\n\nturn 1 goes on"])
+        self.assertEqual(context.summarized_turns, 2)
+        rendered = context.render("storyteller")
+        self.assertEqual(rendered, "Story so far (summary): **Kael** joined.\n\nturn 2 goes on\n\nturn 3 goes on")
+        context.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from cyoa.story_segmenter import StorySegmenter, bold_names, name_aliases, split_segments
+
+
+class TestStorySegmenter(unittest.TestCase):
+    def setUp(self):
+        self.story = (
+            "**Astra Vey** enters the market where **Elder Marrow** sells maps.\n\n"
+            "Far away, **Kael Darkhaven** sharpens his blade.\n\n"
+            "Marrow hands Astra a silver map.\n"
+            "[Elder Marrow]: Take it, child.\n"
+            "[Kael Darkhaven]: Someone is coming."
+        )
+
+    def test_helpers(self):
+        self.assertEqual(bold_names(self.story), ["Astra Vey", "Elder Marrow", "Kael Darkhaven"])
+        self.assertEqual(name_aliases("Elder Marrow"), {"Elder Marrow", "Marrow"})
+        self.assertEqual(len(split_segments(self.story)), 5)
+
+    def test_visibility(self):
+        segmenter = StorySegmenter(self.story)
+        self.assertEqual(segmenter.index["Elder Marrow"], [0, 2, 3])
+        self.assertEqual(segmenter.index["Kael Darkhaven"], [1, 4])
+        self.assertNotIn("market", segmenter.visible_text("Kael Darkhaven"))
+        self.assertEqual(segmenter.visible_text("Nobody"), "")
+
+    def test_known_names_count_as_introduced(self):
+        segmenter = StorySegmenter("Story so far (summary): the map was sold.\n\nMarrow counts coins.", names=["Elder Marrow"])
+        self.assertEqual(segmenter.visible_text("Elder Marrow"), "Marrow counts coins.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.story_session import StorySession
+from tests.test_backend_pool import FakeClient, FakeManager
+from tests.test_orchestrator import fake_response
+
+
+class ScriptedBackend:
+    """Stands in for chat_with_retries, answering per role and recording every prompt."""
+
+    def __init__(self, orchestrator, segments, director_replies):
+        self.orchestrator = orchestrator
+        self.segments = list(segments)
+        self.director_replies = list(director_replies)
+        self.calls = []
+
+    def __call__(self, base_url, messages, max_tokens, **params):
+        if base_url == self.orchestrator.storyteller_url:
+            role, content = "storyteller", self.segments.pop(0)
+        elif base_url == self.orchestrator.director_url:
+            role, content = "director", json.dumps(self.director_replies.pop(0))
+        else:
+            role, content = "character", "I nod."
+        self.calls.append((role, messages))
+        return fake_response(200, content)
+
+    def stream(self, base_url, messages, max_tokens, **params):
+        """Stands in for chat_stream: the director reply arrives a few characters at a time."""
+        self.streamed = getattr(self, "streamed", 0) + 1
+        content = self(base_url, messages, max_tokens, **params).json()["choices"][0]["message"]["content"]
+        for i in range(0, len(content), 7):
+            yield content[i:i + 7]
+
+    def prompts(self, role):
+        return [messages for r, messages in self.calls if r == role]
+
+
+class TestStorySession(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model")
+        self.orchestrator.character_pool = CharacterBackendPool("model", 9001, log_file=None, manager_factory=FakeManager, client=FakeClient())
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        kael = {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."}
+        self.backend = ScriptedBackend(
+            self.orchestrator,
+            ["**Astra Vey** meets **Kael**.", "Kael leads them north.", "A storm breaks. **Mira** appears."],
+            [[kael], [{"spawn": False, "character_name": "Mira"}]],
+        )
+        self.orchestrator.chat_with_retries = self.backend
+        self.orchestrator.chat_stream = self.backend.stream
+        self.session = StorySession(self.orchestrator, "Astra Vey", "A wanderer.")
+
+    def test_turns_continue_the_story(self):
+        intro = self.session.start()
+        self.assertEqual(intro, "**Astra Vey** meets **Kael**.")
+        self.assertEqual(self.backend.prompts("director"), [])
+        update = self.session.advance("Astra follows Kael.")
+        self.assertEqual(update, "Kael leads them north.\n[Kael]: I nod.")
+        self.session.advance("Astra looks up.")
+
+        storyteller_prompts = self.backend.prompts("storyteller")
+        self.assertEqual(len(storyteller_prompts), 3)
+        continuation = storyteller_prompts[2]
+        self.assertIn("Astra looks up.", continuation[-1]["content"])
+        self.assertIn("Kael leads them north.", continuation[-1]["content"])
+        self.assertTrue(self.session.story.startswith(intro))
+        # Kael is not in the new segment, so he does not react
+        self.assertTrue(self.session.story.endswith("A storm breaks. **Mira** appears."))
+
+        director_prompts = self.backend.prompts("director")
+        self.assertEqual(len(director_prompts), 2)
+        self.assertIn("meets **Kael**", director_prompts[0][-1]["content"])
+        self.assertIn("new characters: Mira", director_prompts[1][-1]["content"])
+        self.assertEqual(self.session.cast, {"Kael": "You are Kael."})
+        self.assertIn("Mira", self.session.registry.declined)
+        self.assertEqual(len(self.session.history), 3)
+        timings = self.session.history[1]["timings"]
+        self.assertEqual(set(timings), {"storyteller", "director", "characters", "integration", "total"})
+        self.assertGreaterEqual(timings["total"], timings["storyteller"] + timings["characters"])
+
+    def test_director_skipped_without_new_characters(self):
+        self.backend.segments[1:] = ["Kael leads them north.", "Kael stops at the river."]
+        self.session.start()
+        self.session.advance("Follow.")
+        update = self.session.advance("Wait.")
+        self.assertEqual(len(self.backend.prompts("director")), 1)
+        self.assertEqual(update, "Kael stops at the river.\n[Kael]: I nod.")
+
+    def test_interactive_story_loop_uses_session(self):
+        story = self.orchestrator.interactive_story_loop("Astra Vey", "A wanderer.", ["Go.", "Wait."], max_turns=1)
+        self.assertIn("Kael leads them north.", story)
+        self.assertEqual(len(self.backend.prompts("storyteller")), 2)
+
+    def test_streamed_director_starts_characters_early(self):
+        started = []
+        ask_character = self.orchestrator.ask_character
+
+        def ask(name, prompt, visible, queued_at=None):
+            started.append(name)
+            return ask_character(name, prompt, visible, queued_at=queued_at)
+
+        self.orchestrator.ask_character = ask
+        self.backend.segments[0] = "**Astra Vey** meets **Kael** and **Oren**."
+        self.backend.director_replies[0] = [
+            {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."},
+            {"spawn": True, "character_name": "Oren", "character_prompt": "You are Oren."},
+        ]
+        self.backend.segments[1] = "Kael and Oren lead them north."
+        self.session.start()
+        update = self.session.advance("Follow.")
+        self.assertEqual(self.backend.streamed, 1)
+        self.assertEqual(sorted(started), ["Kael", "Oren"])
+        self.assertEqual(update, "Kael and Oren lead them north.\n[Kael]: I nod.\n[Oren]: I nod.")
+
+    def test_plain_director_when_streaming_is_off(self):
+        self.orchestrator.stream_director = False
+        self.session.start()
+        self.session.advance("Follow.")
+        self.assertFalse(hasattr(self.backend, "streamed"))
+        self.assertEqual(self.session.cast, {"Kael": "You are Kael."})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.story_session import StorySession
+from cyoa.story_store import StoryStore
+from tests.test_backend_pool import FakeClient, FakeManager
+from tests.test_story_session import ScriptedBackend
+
+
+def record(segment, user_input=None):
+    return {"user_input": user_input, "segment": segment, "update": segment, "director_data": [], "responses": {}, "timings": {}}
+
+
+class TestStoryStore(unittest.TestCase):
+    def setUp(self):
+        self.store = StoryStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_tree_paths_and_dedup(self):
+        intro = self.store.add_node(None, record("Intro."))
+        left = self.store.add_node(intro, record("Left.", "go left"))
+        right = self.store.add_node(intro, record("Right.", "go right"))
+        again = self.store.add_node(intro, dict(record("Left.", "go left"), timings={"total": 9.0}))
+        self.assertEqual(again, left)  # timings are not part of a node's identity
+        self.assertEqual([n["segment"] for n in self.store.path(right)], ["Intro.", "Right."])
+        self.assertEqual([n["hash"] for n in self.store.children(intro)], [left, right])
+        self.assertEqual(self.store.node(left)["depth"], 1)
+        self.assertEqual(self.store.find_child(intro, "go right")["hash"], right)
+        self.assertIsNone(self.store.find_child(intro, "wait"))
+        self.assertEqual(self.store.resolve(right[:12]), right)
+        with self.assertRaises(KeyError):
+            self.store.add_node("missing", record("Orphan."))
+
+    def test_sessions_and_fork(self):
+        intro = self.store.add_node(None, record("Intro."))
+        session_id = self.store.create_session("Astra Vey", "A wanderer.", intro)
+        fork = self.store.fork(session_id)
+        self.assertNotEqual(fork, session_id)
+        self.assertEqual(self.store.session(fork)["head"], intro)
+        self.store.set_head(session_id, None)
+        self.assertIsNone(self.store.session(session_id)["head"])
+        self.assertEqual({s["id"] for s in self.store.sessions()}, {session_id, fork})
+
+
+class TestSessionPersistence(unittest.TestCase):
+    def setUp(self):
+        self.orchestrator = AgentOrchestrator("model")
+        self.orchestrator.character_pool = CharacterBackendPool("model", 9001, log_file=None, manager_factory=FakeManager, client=FakeClient())
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+        kael = {"spawn": True, "character_name": "Kael", "character_prompt": "You are Kael."}
+        self.backend = ScriptedBackend(
+            self.orchestrator,
+            ["**Astra Vey** meets **Kael**.", "Kael leads them north.", "Kael turns south."],
+            [[kael], [kael]],
+        )
+        self.orchestrator.chat_with_retries = self.backend
+        self.orchestrator.chat_stream = self.backend.stream
+        self.store = StoryStore(":memory:")
+        self.session = StorySession(self.orchestrator, "Astra Vey", "A wanderer.", store=self.store)
+
+    def tearDown(self):
+        self.session.close()
+        self.store.close()
+
+    def test_resume_rebuilds_without_model_calls(self):
+        self.session.start()
+        self.session.advance("Astra follows Kael.")
+        calls = len(self.backend.calls)
+        resumed = StorySession.resume(self.orchestrator, self.store, self.session.session_id)
+        self.assertEqual(len(self.backend.calls), calls)
+        self.assertEqual(resumed.story, self.session.story)
+        self.assertEqual(resumed.cast, {"Kael": "You are Kael."})
+        self.assertEqual(resumed.context.turns, self.session.context.turns)
+        self.assertEqual([h["node"] for h in resumed.history], [h["node"] for h in self.session.history])
+        resumed.close()
+
+    def test_rewind_forks_and_replays_stored_turns(self):
+        self.session.start()
+        first = self.session.advance("Astra follows Kael.")
+        north = self.session.head
+        self.session.rewind(0)
+        self.assertEqual(self.session.story, "**Astra Vey** meets **Kael**.")
+        self.assertEqual(len(self.session.history), 1)
+        self.assertEqual(self.store.session(self.session.session_id)["head"], self.session.history[0]["node"])
+
+        # The same action from the same node is replayed from the store
+        calls = len(self.backend.calls)
+        streamed = []
+        self.assertEqual(self.session.advance("Astra follows Kael.", on_token=streamed.append), first)
+        self.assertEqual(len(self.backend.calls), calls)
+        self.assertEqual(streamed, ["Kael leads them north."])
+        self.assertTrue(self.session.history[-1]["replayed"])
+        self.assertEqual(self.session.head, north)
+
+        # A different action forks a new branch; the cast is as it was at the introduction again
+        self.session.rewind(self.session.history[0]["node"][:10])
+        self.assertEqual(self.session.cast, {})
+        self.session.advance("Astra waits.")
+        self.assertEqual(len(self.backend.prompts("director")), 2)
+        self.assertEqual(len(self.store.children(self.session.history[0]["node"])), 2)
+        self.assertTrue(self.session.story.endswith("Kael turns south.\n[Kael]: I nod."))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import socket
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import BackendTopology
+from cyoa.llm_client import LLMClient, build_chat_payload
+from cyoa.tracing import InMemoryExporter, Tracer
+from scripts.spawn_vllm_server import VLLMServerManager
+from scripts.stub_openai_server import StubConfig, start_in_thread
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestStubServer(unittest.TestCase):
+    def setUp(self):
+        self.client = LLMClient(read_timeout=10)
+        self.servers = []
+
+    def tearDown(self):
+        self.client.close()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start(self, **config):
+        server, url = start_in_thread(StubConfig(**config))
+        self.servers.append(server)
+        return server, url
+
+    def test_models_and_scripted_roles(self):
+        server, url = self.start(cast=["Kael", "Mira"], cast_size=2)
+        self.assertEqual(self.client.get(f"{url}/v1/models").json()["data"][0]["id"], "stub-model")
+        orchestrator = AgentOrchestrator("stub-model")
+        resp = self.client.chat(url, "stub-model", orchestrator.build_storyteller_prompt_with_user("Astra Vey", ""), 64)
+        data = resp.json()
+        story = data["choices"][0]["message"]["content"]
+        self.assertIn("**Astra Vey**", story)
+        self.assertIn("**Kael**", story)
+        self.assertGreater(data["usage"]["prompt_tokens"], 0)
+        self.assertEqual(data["usage"]["completion_tokens"], len(story.split(" ")))
+        director = self.client.chat_content(url, "stub-model", orchestrator.build_director_prompt(story, "Astra Vey"), 256)
+        self.assertEqual([c["character_name"] for c in json.loads(director)], ["Kael", "Mira"])
+
+    def test_streaming_with_usage(self):
+        _, url = self.start(token_latency=0.001)
+        payload = build_chat_payload("stub-model", [{"role": "system", "content": "You are Kael."}, {"role": "user", "content": "Hi"}], 32)
+        deltas = list(self.client.stream(f"{url}/v1/chat/completions", dict(payload, stream_options={"include_usage": True})))
+        self.assertTrue("".join(deltas).startswith("Kael considers the scene"))
+
+    def test_latency_model_and_prefix_cache(self):
+        server, url = self.start(prefill_latency=0.002, token_latency=0.0)
+        messages = [{"role": "system", "content": "word " * 100}, {"role": "user", "content": "go"}]
+        start = time.perf_counter()
+        self.client.chat(url, "m", messages, 8)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        second = self.client.chat(url, "m", messages, 8).json()
+        warm = time.perf_counter() - start
+        self.assertGreater(cold, 0.2)
+        self.assertLess(warm, cold)
+        self.assertEqual(second["usage"]["prompt_tokens_details"]["cached_tokens"], second["usage"]["prompt_tokens"])
+        self.assertIn("vllm:prefix_cache_hits_total", self.client.get(f"{url}/metrics").text)
+
+    def test_failure_injection_and_concurrency_limit(self):
+        _, url = self.start(fail_first=1)
+        self.assertEqual(self.client.chat(url, "m", [{"role": "user", "content": "x"}], 4).status_code, 500)
+        self.assertEqual(self.client.chat(url, "m", [{"role": "user", "content": "x"}], 4).status_code, 200)
+        server, url = self.start(max_concurrency=2, token_latency=0.02)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            statuses = list(executor.map(lambda _: self.client.chat(url, "m", [{"role": "user", "content": "x"}], 8).status_code, range(6)))
+        self.assertEqual(statuses, [200] * 6)
+        self.assertEqual(server.backend.peak_running, 2)
+
+    def test_manager_launches_stub_and_orchestrator_runs_on_cpu(self):
+        port = free_port()
+        orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, topology=BackendTopology(shared_backend=True, shared_gpus=[None], backend="stub", backend_args=["--cast", "Kael,Mira", "--token-latency", "0.001"]))
+        orchestrator.log_agent = lambda *args, **kwargs: None
+        exporter = InMemoryExporter()
+        orchestrator.tracer = Tracer([exporter])
+        for pool in orchestrator.character_pool.pools:
+            pool.log_file = None
+        try:
+            orchestrator.start_storyteller_and_director(timeout=30)
+            streamed = []
+            story = orchestrator.interactive_story_loop("Astra Vey", "A wanderer.", ["Astra greets Kael."], on_token=streamed.append)
+            self.assertIn("**Astra Vey**", story)
+            self.assertIn("[Kael]:", story)
+            self.assertTrue(streamed)
+            storyteller_spans = [span for span in exporter.spans if span.name == "storyteller"]
+            self.assertTrue(storyteller_spans)
+            self.assertTrue(all(span.attributes.get("ttft") is not None for span in storyteller_spans))
+            self.assertTrue(all(span.attributes.get("completion_tokens", 0) > 0 for span in storyteller_spans))
+        finally:
+            orchestrator.stop_all()
+        self.assertIsNone(orchestrator.character_manager)
+
+    def test_characters_run_on_autoscaled_replicas(self):
+        orchestrator = AgentOrchestrator("stub-model", topology=BackendTopology(backend="stub", backend_args=["--cast", "Kael,Mira"], character_autoscale={"max_replicas": 2, "log_file": None, "check_interval": None}))
+        orchestrator.log_agent = lambda *args, **kwargs: None
+        for manager in (orchestrator.storyteller_manager, orchestrator.director_manager):
+            manager.log_file = None
+        try:
+            orchestrator.start_storyteller_and_director(timeout=30)
+            story = orchestrator.interactive_story_loop("Astra Vey", "A wanderer.", ["Astra greets Kael."])
+            self.assertIn("[Kael]:", story)
+            self.assertEqual(orchestrator.character_pool.urls, [orchestrator.character_url])
+            self.assertEqual(set(orchestrator.prefix_cache_stats()), {orchestrator.storyteller_url, orchestrator.director_url, orchestrator.character_url})
+        finally:
+            orchestrator.stop_all()
+        self.assertEqual(orchestrator.character_pool.urls, [])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            VLLMServerManager("m", 1, backend="other").build_command()
+
+
+if __name__ == "__main__":
+    unittest.main()
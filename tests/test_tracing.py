@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+import requests
+from cyoa.agent_orchestrator import AgentOrchestrator
+from cyoa.backend_pool import CharacterBackendPool
+from cyoa.llm_client import chat_completions_url
+from cyoa.story_session import StorySession
+from cyoa.tracing import InMemoryExporter, JsonLinesExporter, PrometheusExporter, Tracer
+from scripts.stub_openai_server import StubConfig, start_in_thread
+from tests.test_backend_pool import FakeManager
+from tests.test_stub_server import free_port
+
+
+class TestTracer(unittest.TestCase):
+    def test_nesting_errors_and_exporters(self):
+        memory = InMemoryExporter()
+        prometheus = PrometheusExporter(buckets=(0.5, 5.0))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "spans.jsonl")
+            jsonl = JsonLinesExporter(path)
+            tracer = Tracer([memory, jsonl, prometheus])
+            with tracer.span("turn", turn=1) as turn:
+                with tracer.span("character", character="Kael") as call:
+                    call.add("retries")
+                    call.set(prompt_tokens=10, completion_tokens=4)
+                with self.assertRaises(ValueError):
+                    with tracer.span("director"):
+                        raise ValueError("bad json")
+            self.assertIsNone(tracer.current())
+            jsonl.close()
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual([line["name"] for line in lines], ["character", "director", "turn"])
+        self.assertEqual(call.parent_id, turn.span_id)
+        self.assertEqual(call.trace_id, turn.trace_id)
+        self.assertEqual(memory.find("director")[0].status, "error")
+        self.assertEqual(memory.find("character", character="Kael")[0].attributes["retries"], 1)
+        text = prometheus.render()
+        self.assertIn('cyoa_span_duration_seconds_count{span="director",status="error"} 1', text)
+        self.assertIn('cyoa_span_duration_seconds_bucket{span="turn",status="ok",le="+Inf"} 1', text)
+        self.assertIn('cyoa_prompt_tokens_total{span="character"} 10', text)
+        self.assertIn('cyoa_retries_total{span="character"} 1', text)
+
+    def test_prometheus_endpoint(self):
+        exporter = PrometheusExporter()
+        tracer = Tracer([exporter])
+        with tracer.span("storyteller"):
+            pass
+        port = free_port()
+        exporter.serve(port)
+        try:
+            resp = requests.get(f"http://127.0.0.1:{port}/metrics", timeout=5)
+        finally:
+            exporter.close()
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('span="storyteller"', resp.text)
+
+
+class TestOrchestratorSpans(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = start_in_thread(StubConfig(cast=["Kael", "Mira"], cast_size=2, fail_first=0))
+        port = self.server.server_address[1]
+        self.memory = InMemoryExporter()
+        self.orchestrator = AgentOrchestrator("stub-model", storyteller_port=port, director_port=port, character_port=port, tracer=Tracer([self.memory]))
+        self.orchestrator.character_pool = CharacterBackendPool("stub-model", port, log_file=None, manager_factory=FakeManager)
+        self.orchestrator.log_agent = lambda *args, **kwargs: None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_turn_and_agent_spans(self):
+        session = StorySession(self.orchestrator, "Astra Vey", "")
+        session.start()
+        session.advance("Astra greets them.")
+        session.close()
+        turns = self.memory.find("turn")
+        self.assertEqual([t.attributes["turn"] for t in turns], [0, 1])
+        storyteller = self.memory.find("storyteller")
+        self.assertEqual(len(storyteller), 2)
+        self.assertGreater(storyteller[1].attributes["prompt_tokens"], 0)
+        self.assertEqual(storyteller[1].attributes["status_code"], 200)
+        self.assertEqual(storyteller[1].parent_id, turns[1].span_id)
+        self.assertEqual(len(self.memory.find("director")), 1)
+        characters = self.memory.find("character")
+        self.assertEqual(sorted(c.attributes["character"] for c in characters), ["Kael", "Mira"])
+        for span in characters:
+            # Characters are dispatched while the director streams, as children of the turn
+            self.assertEqual(span.parent_id, turns[1].span_id)
+            self.assertGreaterEqual(span.attributes["queue_time"], 0)
+            self.assertGreater(span.attributes["completion_tokens"], 0)
+
+    def test_retries_are_counted(self):
+        self.server.backend.config.fail_first = 2
+        with self.orchestrator.tracer.span("character") as span:
+            resp = self.orchestrator.post_with_retries(chat_completions_url(self.url), {"messages": [{"role": "user", "content": "hi"}]}, wait=0)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(span.attributes["retries"], 2)
+        self.assertEqual(span.attributes["status_code"], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import argparse
+import unittest
+from benchmarks.turn_latency import compare, percentile, run_scenario, summarize
+from tests.test_stub_server import free_port
+
+
+class TestStatistics(unittest.TestCase):
+    def test_percentiles(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.5)
+        self.assertAlmostEqual(percentile(values, 99), 99.01)
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(summarize([2.0])["p95"], 2.0)
+        self.assertEqual(summarize([])["count"], 0)
+
+    def test_compare_flags_slowdowns(self):
+        scenario = {"cast_size": 2, "turns": 1}
+        baseline = {"results": [{"scenario": scenario, "latency": {"turn": {"p50": 1.0}, "integration": {"p50": 0.00001}}}]}
+        current = {"results": [
+            {"scenario": scenario, "latency": {"turn": {"p50": 1.5}, "integration": {"p50": 0.00002}}},
+            {"scenario": {"cast_size": 9, "turns": 1}, "latency": {"turn": {"p50": 9.0}}},
+        ]}
+        rows = {row["series"]: row for row in compare(baseline, current, threshold=0.1)}
+        self.assertEqual(set(rows), {"turn", "integration"})
+        self.assertTrue(rows["turn"]["regression"])
+        self.assertAlmostEqual(rows["turn"]["change"], 0.5)
+        self.assertFalse(rows["integration"]["regression"])
+
+
+class TestRunScenario(unittest.TestCase):
+    def options(self, **overrides):
+        values = dict(backend="stub", model="stub-model", port=free_port(), gpu=None, mode="session", repeats=1,
+                      character_concurrency=4, startup_timeout=30, server_log=None)
+        values.update(overrides)
+        return argparse.Namespace(**values)
+
+    def test_session_stages_and_tokens(self):
+        scenario = {"cast_size": 3, "story_tokens": 40, "turns": 2, "token_latency": 0.0, "prefill_latency": 0.0}
+        result = run_scenario(scenario, self.options())
+        latency = result["latency"]
+        self.assertEqual(latency["turn"]["count"], 2)
+        self.assertEqual(latency["storyteller"]["count"], 2)
+        self.assertEqual(latency["character"]["count"], 6)  # three characters react each turn
+        self.assertLessEqual(latency["storyteller"]["p50"], latency["turn"]["max"])
+        self.assertGreater(result["tokens"]["prompt"]["per_turn"], 0)
+        self.assertGreater(result["tokens"]["completion"]["total"], 0)
+
+    def test_run_story_agents_mode(self):
+        scenario = {"cast_size": 1, "story_tokens": 40, "turns": 1, "token_latency": 0.0, "prefill_latency": 0.0}
+        result = run_scenario(scenario, self.options(mode="agents", repeats=2))
+        self.assertEqual(result["latency"]["turn"]["count"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()